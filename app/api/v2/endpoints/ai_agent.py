@@ -1,10 +1,36 @@
-from fastapi import APIRouter, HTTPException, Request
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from mongomock.object_id import ObjectId
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
 
 
-from app.services.ai_service import process_ai_response, process_ai_response_text
-from app.utils.http_client import send_request
+from app.services.ai_service import (
+    answer_text_message,
+    open_conversation,
+    process_ai_response,
+    process_ai_response_audio,
+    process_ai_response_text,
+    process_ai_response_text_stream,
+    text_requests,
+    format_sse,
+)
+from app.utils.answer_cache import answer_cache
+from app.utils.audio_budget import SizeLimitedStream, audio_budget
+from app.utils.backend_router import backend_router
+from app.utils.config_cache import config_cache
+from app.utils.faq_index import faq_index
+from app.utils.audio_preprocessing import audio_preprocessor
+from app.utils.history_cache import history_cache
+from app.utils.invalidation_bus import invalidation_bus
+from app.utils.request_policy import request_policy
+from app.utils.rollups import rollup_recorder
+from app.utils.timing import server_timing_header, stage_histograms
+from app.utils.upstream_guard import upstream_guard
+from app.utils.write_behind import write_behind
 
 router = APIRouter()
 
@@ -19,14 +45,74 @@ class UserMessage(BaseModel):
     #     arbitrary_types_allowed = True
 
 @router.post("/usermessage")
-async def store_user_messages(request: Request, input: UserMessage):
+async def store_user_messages(request: Request, response: Response, input: UserMessage):
     try:
         # Call the service that processes the user message and AI interaction
         ai_response = await process_ai_response(input)
+        response.headers["Server-Timing"] = server_timing_header(ai_response.stage_times)
         return ai_response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/usermessage/audio")
+async def store_user_messages_audio(
+        request: Request,
+        response: Response,
+        companyId: Optional[str] = None,
+        userId: Optional[str] = None,
+        lang: Optional[str] = None,
+):
+    """
+    Voice turn without base64: the clip is sent either as a raw audio/wav body
+    (companyId, userId and lang in the query string) or as a multipart upload
+    with a "file" part (fields may be form fields or query parameters).
+    """
+    content_type = request.headers.get("content-type", "")
+    upload = None
+    limited = None
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if not isinstance(upload, UploadFile):
+                raise HTTPException(status_code=400, detail="Missing audio file")
+            companyId = form.get("companyId", companyId)
+            userId = form.get("userId", userId)
+            lang = form.get("lang", lang)
+            # Starlette spools the upload to disk, hand the file object on as is
+            audio = upload.file
+            audio_size = upload.size or 0
+        else:
+            # Raw body is forwarded chunk by chunk as it arrives
+            content_length = request.headers.get("content-length")
+            if content_length is not None and content_length.isdigit():
+                audio = request.stream()
+                audio_size = int(content_length)
+            else:
+                # Chunked upload: the size is only known once it has been
+                # read, so it is held to the clip limit while it streams
+                audio = limited = SizeLimitedStream(audio_budget, request.stream())
+                audio_size = 0
+
+        if not companyId or not userId or not lang:
+            raise HTTPException(status_code=400, detail="companyId, userId and lang are required")
+
+        ai_response = await process_ai_response_audio(companyId, userId, lang, audio, audio_size=audio_size)
+        response.headers["Server-Timing"] = server_timing_header(ai_response.stage_times)
+        return ai_response
+    except HTTPException:
+        # An upload aborted mid-stream comes back as a failed AI service call
+        if limited is not None and limited.too_large is not None:
+            raise limited.too_large
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if upload is not None:
+            await upload.close()
+
 class UserMessageText(BaseModel):
     companyId: str
     userId: str
@@ -38,11 +124,114 @@ class UserMessageText(BaseModel):
     #     arbitrary_types_allowed = True
 
 @router.post("/textusermessage")
-async def store_user_messages_text(request: Request, input: UserMessageText):
+async def store_user_messages_text(request: Request, response: Response, input: UserMessageText):
     try:
         # Call the service that processes the text message and AI interaction
         ai_response = await process_ai_response_text(input)
+        response.headers["Server-Timing"] = server_timing_header(ai_response.stage_times)
         return ai_response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.post("/textusermessage/stream")
+async def store_user_messages_text_stream(request: Request, input: UserMessageText):
+    # Server-sent events: answer deltas as they are generated, then the stored turn
+    events = await process_ai_response_text_stream(input)
+    return StreamingResponse(
+        (format_sse(event, data) async for event, data in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws/conversation")
+async def conversation_session(websocket: WebSocket, companyId: str, userId: str, lang: str = "EN"):
+    """
+    One conversation over a WebSocket. The ids are validated and the history
+    window read once; every turn then uses and extends the window held here.
+
+    Text frames are JSON: {"question": ..., "lang"?: ..., "stream"?: bool},
+    or {"lang": ...} alone to switch language. A binary frame is one audio
+    clip answered as a voice turn. Replies are {"type": "answer", "data": ...},
+    or "delta" frames followed by "done" for streamed turns, and
+    {"type": "error", "status": ..., "detail": ...} for a failed turn, after
+    which the session stays open.
+    """
+    await websocket.accept()
+    try:
+        history = await open_conversation(companyId, userId)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail)[:120])
+        return
+
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            try:
+                if frame.get("bytes") is not None:
+                    ai_response = await process_ai_response_audio(
+                        companyId, userId, lang, frame["bytes"], history=history, audio_size=len(frame["bytes"])
+                    )
+                    await websocket.send_json({"type": "answer", "data": ai_response.model_dump(mode="json", by_alias=True)})
+                    continue
+
+                try:
+                    message = json.loads(frame.get("text") or "")
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="Text frames must be JSON")
+                if not isinstance(message, dict):
+                    raise HTTPException(status_code=400, detail="Text frames must be JSON objects")
+                lang = message.get("lang") or lang
+                if "question" not in message:
+                    continue
+                try:
+                    input = UserMessageText(companyId=companyId, userId=userId, lang=lang, question=message["question"])
+                except ValidationError as e:
+                    raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+                if message.get("stream"):
+                    events = await process_ai_response_text_stream(input, history=history)
+                    async for event, data in events:
+                        kind = {"answer": "delta"}.get(event, event)
+                        await websocket.send_json({"type": kind, "data": data})
+                else:
+                    ai_response = await answer_text_message(input, history=history)
+                    await websocket.send_json({"type": "answer", "data": ai_response.model_dump(mode="json", by_alias=True)})
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+    except WebSocketDisconnect:
+        pass
+
+
+@router.get("/ai_cache/stats")
+async def get_ai_cache_stats():
+    # Per-worker counters, used to size the caches in production
+    return {
+        "history": history_cache.stats(),
+        "answers": answer_cache.stats(),
+        "faq": faq_index.stats(),
+        "config": config_cache.stats(),
+        "invalidation": invalidation_bus.stats(),
+        "coalescing": text_requests.stats(),
+        "write_behind": write_behind.stats(),
+        "rollups": rollup_recorder.stats(),
+        "upstream": upstream_guard.stats(),
+        "request_policy": request_policy.stats(),
+        "backends": backend_router.stats(),
+        "audio_preprocessing": audio_preprocessor.stats(),
+        "audio_budget": audio_budget.stats(),
+    }
+
+
+@router.get("/ai_metrics", response_class=PlainTextResponse)
+async def get_ai_metrics():
+    # Per-stage latency histograms, audio gauges and per-company queues of this worker, in Prometheus text format
+    return PlainTextResponse(
+        stage_histograms.prometheus() + audio_budget.prometheus() + upstream_guard.fair_queue.prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
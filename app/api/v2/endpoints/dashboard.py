@@ -6,12 +6,15 @@ from pymongo.errors import PyMongoError
 
 from app.database import get_db_spatial_ai
 from app.models.dashboard import Settings, TableData, AIInfo, Preferences, BugReport
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-
-from app.models.user_messages import UserMessages
-from app.schemas.ai_agent import AISummary
-from app.services.ai_service import summarize_data
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Literal, Optional
+
+from app.core.config import settings
+from app.schemas.ai_agent import AILatency, AIRollups, AISummary
+from app.services.analytics_service import company_latency, company_rollups, company_summary
+from app.utils.config_cache import config_cache
+from app.utils.invalidation_bus import invalidation_bus
+from app.utils.rollups import ROLLUP_COLLECTION
 from app.utils.security import validate_object_id
 
 router = APIRouter()
@@ -21,7 +24,10 @@ router = APIRouter()
 async def get_ai_settings(id: str, db=Depends(get_db_spatial_ai)):
     company_id = id
     settings_collection = db['ai_setting']
-    settings_doc = await settings_collection.find_one({'companyId': company_id})
+    # Read on every widget load, so served from the config cache
+    settings_doc = await config_cache.get(
+        'ai_setting', company_id, lambda: settings_collection.find_one({'companyId': company_id})
+    )
 
     if not settings_doc:
         # No settings found, create new one with default values
@@ -33,7 +39,9 @@ async def get_ai_settings(id: str, db=Depends(get_db_spatial_ai)):
             url=""
         )
         # Insert the new settings into the database
-        await settings_collection.insert_one(default_settings.dict(by_alias=True))
+        settings_doc = default_settings.dict(by_alias=True)
+        await settings_collection.insert_one(settings_doc)
+        config_cache.put('ai_setting', company_id, settings_doc)
         return default_settings
     else:
         # Return the existing settings
@@ -57,6 +65,8 @@ async def update_ai_settings(id: str, new_settings: Settings, db=Depends(get_db_
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="No matching company ID found")
 
+    # Cached settings and the answers produced with them are dropped in every worker
+    await invalidation_bus.publish('ai_setting', company_id)
     return {"message": "Settings updated successfully"}
 
 
@@ -85,10 +95,13 @@ async def get_ai_list(id: str, db=Depends(get_db_spatial_ai)):
 async def get_ai_info(companyID: str, db=Depends(get_db_spatial_ai)):
     collection = db['Company']
     try:
-        ai_info_doc = await collection.find_one({'companyId': companyID})
+        ai_info_doc = await config_cache.get(
+            'Company', companyID, lambda: collection.find_one({'companyId': companyID})
+        )
         if not ai_info_doc:
             # No document found, create a new one with default values
             ai_info = AIInfo(
+                id=None,
                 companyId=companyID,
                 enterpriseName='',
                 website='',
@@ -101,7 +114,9 @@ async def get_ai_info(companyID: str, db=Depends(get_db_spatial_ai)):
                 documentationLinks=[],
                 referredLinks=[],
             )
-            result = await collection.insert_one(ai_info.model_dump(by_alias=True))
+            ai_info_doc = ai_info.model_dump(by_alias=True, exclude={'id'})
+            result = await collection.insert_one(ai_info_doc)
+            config_cache.put('Company', companyID, ai_info_doc)
             ai_info.id = result.inserted_id
             return ai_info
         else:
@@ -129,6 +144,8 @@ async def update_ai_info(companyID: str, updated_info: AIInfo, db=Depends(get_db
         else:
             existing_doc = await collection.find_one({'companyId': companyID})
             updated_info.id = existing_doc['_id']
+        # Cached info, answers and common inquiries are dropped in every worker
+        await invalidation_bus.publish('Company', companyID)
         return updated_info
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"Failed to update AI info: {str(e)}")
@@ -136,16 +153,18 @@ async def update_ai_info(companyID: str, updated_info: AIInfo, db=Depends(get_db
 
 @router.get("/appearance/{company_id}", response_model=Preferences)
 async def get_ai_appearance(company_id: str, db=Depends(get_db_spatial_ai)):
-    collection = db["specialAI"]["appearance"]
+    collection = db["appearance"]
 
     # Find the preferences by company ID
-    prefs = await collection.find_one({"company_id": company_id})
+    prefs = await config_cache.get('appearance', company_id, lambda: collection.find_one({"company_id": company_id}))
 
     if prefs is None:
         # Default values if no document exists
         default_prefs = Preferences(company_id=company_id)
         # Insert default preferences
-        await collection.insert_one(default_prefs.model_dump(by_alias=True))
+        prefs = default_prefs.model_dump(by_alias=True)
+        await collection.insert_one(prefs)
+        config_cache.put('appearance', company_id, prefs)
         return default_prefs
 
     return Preferences(**prefs)
@@ -167,6 +186,8 @@ async def set_ai_appearance(company_id: str, prefs: Preferences, db=Depends(get_
     if updated_prefs is None:
         raise HTTPException(status_code=500, detail="Failed to update preferences")
 
+    await invalidation_bus.publish('appearance', company_id)
+
     return {"message": "Preferences updated successfully"}
 
 
@@ -187,32 +208,66 @@ async def create_bug_report(report: BugReport, db=Depends(get_db_spatial_ai)):
 
 
 @router.get("/ai_summary/{company_id}", response_model=AISummary)
-async def get_ai_summary(company_id: str, db=Depends(get_db_spatial_ai)):
+async def get_ai_summary(
+    company_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.AI_SUMMARY_PAGE_SIZE, ge=1, le=settings.AI_SUMMARY_MAX_PAGE_SIZE),
+    db=Depends(get_db_spatial_ai),
+):
     # Validate and convert company_id to ObjectId
     try:
         company_id = validate_object_id(company_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid company ID")
 
-    collection = db["UserMessage"]
-    filter_query = {"companyId": company_id}
-    user_messages_list = await collection.find(filter_query).sort("time",-1).to_list(length=None)
+    # Totals cover the whole range, details one page of it
+    summary = await company_summary(db["UserMessage"], company_id, start, end, cursor, limit)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No messages found")
 
+    return summary
 
-    if not user_messages_list:
-        raise HTTPException(status_code=404, detail="No messages found")
+@router.get("/ai_rollups/{company_id}", response_model=AIRollups)
+async def get_ai_rollups(
+    company_id: str,
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lang: Optional[str] = None,
+    channel: Optional[Literal["voice", "text", "unknown"]] = None,
+    db=Depends(get_db_spatial_ai),
+):
+    # Validate and convert company_id to ObjectId
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
 
-    # Convert MongoDB documents to Pydantic models
-    for message in user_messages_list:
-        message["_id"] = str(message.get("_id"))
-        message["companyId"] =str(message.get("companyId"))
-        message["userId"]=str(message.get("userId"))
-    user_messages = [UserMessages(**message) for message in user_messages_list]
+    # Read from the hourly/daily buckets, not the raw conversation history
+    return await company_rollups(db[ROLLUP_COLLECTION], company_id, granularity, start, end, lang, channel)
 
-    # Summarize the data
-    summary = summarize_data(user_messages)
 
-    return summary
+@router.get("/ai_latency/{company_id}", response_model=AILatency)
+async def get_ai_latency(
+    company_id: str,
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    lang: Optional[str] = None,
+    channel: Optional[Literal["voice", "text", "unknown"]] = None,
+    db=Depends(get_db_spatial_ai),
+):
+    # Validate and convert company_id to ObjectId
+    try:
+        company_id = validate_object_id(company_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
+
+    # Merged from the latency sketches kept in the rollup buckets
+    return await company_latency(db[ROLLUP_COLLECTION], company_id, granularity, start, end, lang, channel)
+
 
 @router.post("/ai_agent", response_model=dict)
 async def create_ai_agent(agent: TableData, db=Depends(get_db_spatial_ai)):
@@ -230,6 +285,8 @@ async def create_ai_agent(agent: TableData, db=Depends(get_db_spatial_ai)):
         result = await collection.insert_one(agent.model_dump(by_alias=True))
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to create new AI agent")
+    # Answers cached before the change are out of date
+    await invalidation_bus.publish('changes', agent.companyId)
 
     return {"message": "AI agent created successfully", "id": str(result.inserted_id)}
 
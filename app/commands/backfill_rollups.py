@@ -0,0 +1,50 @@
+"""
+Rebuilds the analytics rollups from the stored UserMessage history.
+
+Each company's hourly and daily buckets in the range are recomputed from its
+turns and replaced, so the command can be run again safely. The range ends
+at the start of today by default, leaving the buckets still updated by the
+running workers alone.
+
+    python -m app.commands.backfill_rollups --start 2024-01-01
+    python -m app.commands.backfill_rollups --company 507f1f77bcf86cd799439011
+"""
+import argparse
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from app import database
+from app.services.analytics_service import backfill_rollups
+from app.utils.rollups import ROLLUP_COLLECTION, bucket_start
+
+
+async def run(args):
+    await database.init_db()
+    try:
+        messages = database.db_spatial_ai["UserMessage"]
+        rollups = database.db_spatial_ai[ROLLUP_COLLECTION]
+        if args.company:
+            company_ids = [ObjectId(company_id) for company_id in args.company]
+        else:
+            company_ids = await messages.distinct("companyId")
+
+        end = args.end or bucket_start(datetime.utcnow(), "day")
+        for company_id in company_ids:
+            written = await backfill_rollups(messages, rollups, company_id, args.start, end)
+            print(f"Company {company_id}: {written} rollup buckets written")
+    finally:
+        await database.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--company", action="append", default=[], help="Company to rebuild (default: all)")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="First day to rebuild (default: the first turn)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Day to stop before (default: today)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
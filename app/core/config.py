@@ -1,3 +1,4 @@
+import json
 import os
 
 from pydantic_settings import BaseSettings
@@ -40,6 +41,91 @@ class Settings(BaseSettings):
 
     # AI_Agent
     AI_SITE: str = os.getenv("AI_SITE", "default")
+    AI_SITES: str = os.getenv("AI_SITES", "")  # Comma separated replicas; AI_SITE alone when unset
+    AI_ROUTING_STRATEGY: str = os.getenv("AI_ROUTING_STRATEGY", "least_outstanding")  # Or "ewma"
+    AI_ROUTING_PIN_COMPANIES: bool = os.getenv("AI_ROUTING_PIN_COMPANIES", "false").lower() == "true"
+    AI_ROUTING_FAILURE_THRESHOLD: int = int(os.getenv("AI_ROUTING_FAILURE_THRESHOLD", 3))  # Failures in a row
+    AI_ROUTING_DRAIN_SECONDS: float = float(os.getenv("AI_ROUTING_DRAIN_SECONDS", 30))
+    AI_HEALTH_CHECK_INTERVAL: float = float(os.getenv("AI_HEALTH_CHECK_INTERVAL", 0))  # Seconds, 0 to disable
+    AI_HEALTH_CHECK_PATH: str = os.getenv("AI_HEALTH_CHECK_PATH", "/health")
+    AI_HTTP_TIMEOUT: float = float(os.getenv("AI_HTTP_TIMEOUT", 60))  # Seconds per upstream call
+    AI_LATENCY_WINDOW: int = int(os.getenv("AI_LATENCY_WINDOW", 500))  # Recent calls per endpoint
+    AI_LATENCY_MIN_SAMPLES: int = int(os.getenv("AI_LATENCY_MIN_SAMPLES", 50))  # Before timeouts adapt
+    AI_TIMEOUT_PERCENTILE: float = float(os.getenv("AI_TIMEOUT_PERCENTILE", 0.99))
+    AI_TIMEOUT_MULTIPLIER: float = float(os.getenv("AI_TIMEOUT_MULTIPLIER", 3))
+    AI_TIMEOUT_MIN: float = float(os.getenv("AI_TIMEOUT_MIN", 5))  # Seconds, AI_HTTP_TIMEOUT is the maximum
+    AI_HEDGE_ENABLED: bool = os.getenv("AI_HEDGE_ENABLED", "false").lower() == "true"
+    AI_HEDGE_PERCENTILE: float = float(os.getenv("AI_HEDGE_PERCENTILE", 0.95))
+    AI_HEDGE_MIN_DELAY: float = float(os.getenv("AI_HEDGE_MIN_DELAY", 0.5))  # Seconds
+    AI_HEDGE_MAX_SHARE: float = float(os.getenv("AI_HEDGE_MAX_SHARE", 0.1))  # Of all calls
+    AI_RETRY_MAX: int = int(os.getenv("AI_RETRY_MAX", 2))
+    AI_RETRY_BACKOFF_BASE: float = float(os.getenv("AI_RETRY_BACKOFF_BASE", 0.1))  # Seconds
+    AI_RETRY_BACKOFF_MAX: float = float(os.getenv("AI_RETRY_BACKOFF_MAX", 2))
+    AI_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", 5))
+    AI_HTTP_POOL_LIMIT: int = int(os.getenv("AI_HTTP_POOL_LIMIT", 500))  # Open connections per worker
+    AI_HTTP_POOL_LIMIT_PER_HOST: int = int(os.getenv("AI_HTTP_POOL_LIMIT_PER_HOST", 200))
+    AI_HTTP_KEEPALIVE_TIMEOUT: float = float(os.getenv("AI_HTTP_KEEPALIVE_TIMEOUT", 30))
+    AI_CONFIG_CACHE_ENABLED: bool = os.getenv("AI_CONFIG_CACHE_ENABLED", "true").lower() == "true"
+    AI_CONFIG_CACHE_TTL: float = float(os.getenv("AI_CONFIG_CACHE_TTL", 300))  # Seconds
+    AI_CONFIG_CACHE_NEGATIVE_TTL: float = float(os.getenv("AI_CONFIG_CACHE_NEGATIVE_TTL", 30))  # Seconds
+    AI_CONFIG_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_CONFIG_CACHE_MAX_ENTRIES", 10000))
+    # "auto" tails a change stream on replica sets and polls version stamps otherwise; also
+    # "change_stream", "polling" or "off" (per-worker invalidation only)
+    AI_INVALIDATION_MODE: str = os.getenv("AI_INVALIDATION_MODE", "auto")
+    AI_INVALIDATION_POLL_INTERVAL: float = float(os.getenv("AI_INVALIDATION_POLL_INTERVAL", 2))  # Seconds
+    AI_SUMMARY_PAGE_SIZE: int = int(os.getenv("AI_SUMMARY_PAGE_SIZE", 100))  # Details per /ai_summary page
+    AI_SUMMARY_MAX_PAGE_SIZE: int = int(os.getenv("AI_SUMMARY_MAX_PAGE_SIZE", 1000))
+    AI_ROLLUPS_ENABLED: bool = os.getenv("AI_ROLLUPS_ENABLED", "true").lower() == "true"
+    AI_ROLLUPS_FLUSH_INTERVAL: float = float(os.getenv("AI_ROLLUPS_FLUSH_INTERVAL", 5))  # Seconds
+    AI_HISTORY_MAX_TURNS: int = int(os.getenv("AI_HISTORY_MAX_TURNS", 20))  # 0 disables the turn cap
+    AI_HISTORY_MAX_AGE_MINUTES: int = int(os.getenv("AI_HISTORY_MAX_AGE_MINUTES", 0))  # 0 disables the age cap
+    AI_HISTORY_CACHE_ENABLED: bool = os.getenv("AI_HISTORY_CACHE_ENABLED", "true").lower() == "true"
+    AI_HISTORY_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_HISTORY_CACHE_MAX_ENTRIES", 10000))
+    AI_HISTORY_CACHE_MAX_BYTES: int = int(os.getenv("AI_HISTORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    AI_HISTORY_CACHE_TTL: float = float(os.getenv("AI_HISTORY_CACHE_TTL", 900))  # Seconds
+    AI_ANSWER_CACHE_ENABLED: bool = os.getenv("AI_ANSWER_CACHE_ENABLED", "false").lower() == "true"
+    AI_ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_ANSWER_CACHE_MAX_ENTRIES", 5000))
+    AI_ANSWER_CACHE_TTL: float = float(os.getenv("AI_ANSWER_CACHE_TTL", 3600))  # Seconds
+    # JSON object of companyId -> TTL in seconds, 0 disables caching for that company
+    AI_ANSWER_CACHE_COMPANY_TTLS: dict = json.loads(os.getenv("AI_ANSWER_CACHE_COMPANY_TTLS", "{}"))
+    AI_FAQ_ENABLED: bool = os.getenv("AI_FAQ_ENABLED", "false").lower() == "true"
+    AI_FAQ_MIN_SCORE: float = float(os.getenv("AI_FAQ_MIN_SCORE", 0.85))  # Trigram similarity to a common inquiry
+    AI_FAQ_ANSWER_TTL: float = float(os.getenv("AI_FAQ_ANSWER_TTL", 86400))  # Seconds a learned answer is served
+    AI_FAQ_MAX_COMPANIES: int = int(os.getenv("AI_FAQ_MAX_COMPANIES", 1000))
+    AI_COALESCE_ENABLED: bool = os.getenv("AI_COALESCE_ENABLED", "true").lower() == "true"
+    AI_COALESCE_WINDOW: float = float(os.getenv("AI_COALESCE_WINDOW", 2))  # Seconds a finished answer is reused
+    AI_WRITE_BEHIND_ENABLED: bool = os.getenv("AI_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+    AI_WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("AI_WRITE_BEHIND_BATCH_SIZE", 200))
+    AI_WRITE_BEHIND_FLUSH_INTERVAL: float = float(os.getenv("AI_WRITE_BEHIND_FLUSH_INTERVAL", 0.5))  # Seconds
+    AI_WRITE_BEHIND_MAX_PENDING: int = int(os.getenv("AI_WRITE_BEHIND_MAX_PENDING", 5000))  # Backpressure above this
+    AI_WRITE_BEHIND_MAX_WAIT: float = float(os.getenv("AI_WRITE_BEHIND_MAX_WAIT", 5))  # Seconds under backpressure before a 503
+    AI_WRITE_BEHIND_MAX_BACKOFF: float = float(os.getenv("AI_WRITE_BEHIND_MAX_BACKOFF", 30))  # Seconds between retries while Mongo fails
+    # Hold each response until its batch is written (durable, slower) instead of returning right away
+    AI_WRITE_BEHIND_WAIT_FOR_WRITE: bool = os.getenv("AI_WRITE_BEHIND_WAIT_FOR_WRITE", "false").lower() == "true"
+    AI_UPSTREAM_MAX_IN_FLIGHT: int = int(os.getenv("AI_UPSTREAM_MAX_IN_FLIGHT", 100))  # Concurrent AI calls per worker
+    AI_UPSTREAM_MAX_QUEUE: int = int(os.getenv("AI_UPSTREAM_MAX_QUEUE", 200))  # Calls waiting for a slot
+    AI_UPSTREAM_QUEUE_TIMEOUT: float = float(os.getenv("AI_UPSTREAM_QUEUE_TIMEOUT", 5))  # Seconds
+    AI_UPSTREAM_RETRY_AFTER: float = float(os.getenv("AI_UPSTREAM_RETRY_AFTER", 2))  # Seconds, sent when shedding
+    AI_FAIR_DEFAULT_WEIGHT: float = float(os.getenv("AI_FAIR_DEFAULT_WEIGHT", 1))  # Share of AI capacity per company
+    AI_FAIR_COMPANY_WEIGHTS: dict = json.loads(os.getenv("AI_FAIR_COMPANY_WEIGHTS", "{}"))  # companyId -> weight
+    AI_FAIR_COMPANY_MAX_IN_FLIGHT: int = int(os.getenv("AI_FAIR_COMPANY_MAX_IN_FLIGHT", 0))  # 0 for no cap
+    AI_FAIR_COMPANY_CAPS: dict = json.loads(os.getenv("AI_FAIR_COMPANY_CAPS", "{}"))  # companyId -> max in flight
+    AI_FAIR_MAX_IDLE_COMPANIES: int = int(os.getenv("AI_FAIR_MAX_IDLE_COMPANIES", 100))  # Idle companies kept for metrics
+    AI_BREAKER_WINDOW: int = int(os.getenv("AI_BREAKER_WINDOW", 50))  # Recent calls considered
+    AI_BREAKER_MIN_CALLS: int = int(os.getenv("AI_BREAKER_MIN_CALLS", 20))
+    AI_BREAKER_ERROR_RATE: float = float(os.getenv("AI_BREAKER_ERROR_RATE", 0.5))
+    AI_BREAKER_SLOW_CALL_SECONDS: float = float(os.getenv("AI_BREAKER_SLOW_CALL_SECONDS", 20))
+    AI_BREAKER_SLOW_CALL_RATE: float = float(os.getenv("AI_BREAKER_SLOW_CALL_RATE", 0.8))
+    AI_BREAKER_OPEN_SECONDS: float = float(os.getenv("AI_BREAKER_OPEN_SECONDS", 30))
+    AI_AUDIO_PREPROCESS_ENABLED: bool = os.getenv("AI_AUDIO_PREPROCESS_ENABLED", "false").lower() == "true"
+    AI_AUDIO_TARGET_RATE: int = int(os.getenv("AI_AUDIO_TARGET_RATE", 16000))  # Hz, clips above it are downsampled
+    AI_AUDIO_SILENCE_THRESHOLD_DB: float = float(os.getenv("AI_AUDIO_SILENCE_THRESHOLD_DB", -45))  # dBFS
+    AI_AUDIO_SILENCE_FRAME_MS: int = int(os.getenv("AI_AUDIO_SILENCE_FRAME_MS", 20))
+    AI_AUDIO_SILENCE_PAD_MS: int = int(os.getenv("AI_AUDIO_SILENCE_PAD_MS", 200))  # Kept around speech
+    AI_AUDIO_MAX_BYTES: int = int(os.getenv("AI_AUDIO_MAX_BYTES", 25 * 1024 * 1024))  # Per clip, 0 for no limit
+    AI_AUDIO_BUDGET_BYTES: int = int(os.getenv("AI_AUDIO_BUDGET_BYTES", 256 * 1024 * 1024))  # Per worker, 0 for no limit
+    AI_AUDIO_BUDGET_WAIT: float = float(os.getenv("AI_AUDIO_BUDGET_WAIT", 5))  # Seconds before a 503
+    AI_AUDIO_SPILL_BYTES: int = int(os.getenv("AI_AUDIO_SPILL_BYTES", 8 * 1024 * 1024))  # Larger clips go to a temp file
 
     class Config:
         env_file = ".env"  # Load variables from .env file if it exists
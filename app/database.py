@@ -1,5 +1,8 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
 from app.core.config import settings
+from app.utils.invalidation_bus import VERSION_COLLECTION
+from app.utils.rollups import ROLLUP_COLLECTION
 
 # Global variable to store the database client
 client = None
@@ -15,6 +18,27 @@ async def init_db():
     db_spatial_ai = client[settings.MONGODB_DB_NAME_SPETIAL_AI]
     await client.server_info()
     print("Connected to MongoDB")
+    await ensure_indexes()
+
+
+async def ensure_indexes():
+    """Create the indexes the request path relies on (no-op if they exist)."""
+    # Conversation history window: latest turns of one user of one company
+    await db_spatial_ai["UserMessage"].create_index(
+        [("companyId", ASCENDING), ("userId", ASCENDING), ("time", DESCENDING)]
+    )
+    # Dashboard summary: one company's turns in a time range, paged newest first
+    await db_spatial_ai["UserMessage"].create_index(
+        [("companyId", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)]
+    )
+    # Analytics rollups: one document per company, granularity, bucket, language and channel
+    await db_spatial_ai[ROLLUP_COLLECTION].create_index(
+        [("companyId", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING), ("lang", ASCENDING),
+         ("channel", ASCENDING)],
+        unique=True,
+    )
+    # Cache invalidation stamps, polled by date where change streams are unavailable
+    await db_spatial_ai[VERSION_COLLECTION].create_index("updated_at")
 
 
 async def close_db():
@@ -5,7 +5,12 @@ from app.api.v2.router import api_router
 from app.core.config import settings
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.database import init_db, close_db
+from app.database import init_db, close_db, get_db_spatial_ai
+from app.utils.backend_router import backend_router
+from app.utils.http_client import init_http_client, close_http_client
+from app.utils.invalidation_bus import invalidation_bus
+from app.utils.rollups import ROLLUP_COLLECTION, rollup_recorder
+from app.utils.write_behind import write_behind
 
 # Initialize FastAPI app
 
@@ -18,10 +23,23 @@ origins = [
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize DB
+    # Startup: Initialize DB and the AI service connection pool
     await init_db()
+    await init_http_client()
+    await backend_router.start()
+    if settings.AI_WRITE_BEHIND_ENABLED:
+        await write_behind.start()
+    if settings.AI_ROLLUPS_ENABLED:
+        await rollup_recorder.start((await get_db_spatial_ai())[ROLLUP_COLLECTION])
+    # Keeps the per-worker caches of company data in step with the other workers
+    await invalidation_bus.start(await get_db_spatial_ai())
     yield
-    # Shutdown: Close DB
+    # Shutdown: Drain buffered conversation records and rollups, then close the pool and DB
+    await write_behind.stop()
+    await rollup_recorder.stop()
+    await invalidation_bus.stop()
+    await backend_router.stop()
+    await close_http_client()
     await close_db()
 
 
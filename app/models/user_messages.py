@@ -1,7 +1,8 @@
 from datetime import datetime
 
+from bson import ObjectId
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 from app.utils.object_id_pydantic_annotation import PyObjectId
@@ -12,8 +13,10 @@ class AIResponse(BaseModel):
     question: str
     links: Optional[List[str]]=None
     process_time: Optional[float]=None
+    stage_times: Optional[Dict[str, float]] = None  # Seconds per pipeline stage
     lang: Optional[str]=None
     voice: Optional[str] = Field(alias='voice_answer', default=None)
+    cached: Optional[bool] = None  # True when served from the answer cache
     model_config = ConfigDict(
         populate_by_name=True,
         arbitrary_types_allowed=True,
@@ -22,12 +25,13 @@ class AIResponse(BaseModel):
 
 
 class UserMessages(BaseModel):
-    id: Optional[PyObjectId] = Field(alias='_id',default_factory=PyObjectId)
+    id: Optional[PyObjectId] = Field(alias='_id',default_factory=ObjectId)
     companyId: PyObjectId = Field(default_factory=PyObjectId, alias='companyId')
     userId: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias='userId')
     AIResponses: AIResponse = Field(alias='messages')
     lang: Optional[str] = "EN-US"
     time: datetime
+    channel: Optional[str] = None  # "voice" or "text", for the latency analytics
 
     model_config = ConfigDict(
         populate_by_name=True,
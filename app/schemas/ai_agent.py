@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from app.utils.object_id_pydantic_annotation import PyObjectId
 
@@ -12,6 +12,7 @@ class AIResponse(BaseModel):
     voice: Optional[str] = Field(alias='voice_answer')  # Corresponds to 'voice_answer' in JSON
     links: Optional[List[str]]
     process_time: Optional[float] = None  # Represented in seconds
+    stage_times: Optional[Dict[str, float]] = None  # Seconds per pipeline stage
 
     model_config = ConfigDict(
         populate_by_name=True,
@@ -31,6 +32,7 @@ class AISummary(BaseModel):
     total_questions: int
     total_time: str
     details: List[MessageDetail]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= for the next page of details
 
     class Config:
         schema_extra = {
@@ -53,3 +55,45 @@ class AISummary(BaseModel):
                 ]
             }
         }
+
+
+class RollupBucket(BaseModel):
+    bucket: datetime  # Start of the hour or day
+    lang: str
+    channel: str  # "voice", "text" or "unknown" for turns stored before channels were recorded
+    questions: int
+    total_process_time: float  # Seconds
+    max_process_time: float
+    users: int  # Distinct users, estimated within about 3%
+
+
+class AIRollups(BaseModel):
+    granularity: str  # "hour" or "day"
+    total_questions: int
+    total_process_time: float
+    max_process_time: float
+    users: int  # Distinct users over the whole range, estimated within about 3%
+    buckets: List[RollupBucket]
+
+
+class LatencyStats(BaseModel):
+    bucket: Optional[datetime] = None  # Set in the time series
+    lang: Optional[str] = None  # Set in the per language and channel breakdown
+    channel: Optional[str] = None
+    count: int
+    p50: Optional[float] = None  # Seconds, None without answers
+    p90: Optional[float] = None
+    p99: Optional[float] = None
+
+
+class LatencyHistogramBin(BaseModel):
+    le: Optional[float]  # Upper bound in seconds, None for the last, open-ended bin
+    count: int
+
+
+class AILatency(BaseModel):
+    granularity: str  # "hour" or "day"
+    overall: LatencyStats
+    histogram: List[LatencyHistogramBin]
+    series: List[LatencyStats]
+    breakdown: List[LatencyStats]
@@ -1,153 +1,451 @@
-import base64
-import os
+import asyncio
+import json
+import re
 import time
 from datetime import datetime, timedelta
-from typing import List
 
 from fastapi import HTTPException
-from mongomock.object_id import ObjectId
-
-from app.utils.file_manger import save_audio_file
-from app.utils.http_client import send_request
+from bson import ObjectId
+
+from app.services.answer_postprocessing import postprocessor
+from app.utils.file_manger import decode_audio, close_audio
+from app.utils.answer_cache import answer_cache, normalize_question
+from app.utils.audio_budget import audio_budget
+from app.utils.audio_preprocessing import audio_preprocessor
+from app.utils.faq_index import faq_index
+from app.utils.history_cache import history_cache
+from app.utils.rollups import rollup_recorder
+from app.utils.http_client import send_request, stream_request
 from app.utils.security import validate_object_id
+from app.utils.timing import stage, timed_stages
+from app.utils.upstream_guard import upstream_guard
+from app.utils.write_behind import write_behind
 from app.models.user_messages import UserMessages
 from app.models.user_messages import AIResponse as Ai_api_answer
-from app.schemas.ai_agent import AIResponse, AISummary, MessageDetail
+from app.schemas.ai_agent import AIResponse
 from app.database import get_db_spatial_ai
 from app.core.config import settings
 
 
 async def process_ai_response(input):
-    try:
-        start_time = time.time()
-        audio_data = base64.b64decode(input.wavData)
-        file_path = save_audio_file(audio_data)
-        company_id = validate_object_id(input.companyId)
-        user_id = validate_object_id(input.userId)
+    audio = None
+    with timed_stages():
+        try:
+            start_time = time.time()
+            # Refused before decoding; the reservation covers the base64 text and the clip
+            audio_size = len(input.wavData) // 4 * 3
+            audio_budget.check_size(audio_size)
+            async with audio_budget.reserve(len(input.wavData) + audio_size):
+                with stage("decode"):
+                    audio = decode_audio(input.wavData)
+                return await process_ai_response_audio(
+                    input.companyId, input.userId, input.lang, audio, start_time=start_time
+                )
+        finally:
+            close_audio(audio)
+
+
+async def process_ai_response_audio(company_id, user_id, lang, audio, start_time=None, history=None,
+                                    audio_size=None):
+    """
+    Runs a voice turn for audio that is already available as bytes, a binary
+    file object or an async iterable of chunks (e.g. a streamed request body).
+
+    The audio is forwarded to the AI service as it is read; the caller owns it
+    and is responsible for closing it. A caller that keeps the conversation
+    window itself (a WebSocket session) passes it as ``history``; it is used
+    instead of a history read and the new turn is appended to it.
+
+    When the caller passes the clip's ``audio_size``, the turn holds that much
+    of the audio byte budget; callers that reserved it already leave it out.
+    """
+    if audio_size is not None:
+        start_time = start_time or time.time()
+        with timed_stages():
+            audio_budget.check_size(audio_size)
+            async with audio_budget.reserve(audio_size):
+                return await process_ai_response_audio(company_id, user_id, lang, audio, start_time, history)
+
+    with timed_stages() as timer:
+        try:
+            start_time = start_time or time.time()
+            raw_company_id = company_id
+            company_id = validate_object_id(company_id)
+            user_id = validate_object_id(user_id)
+
+            # Fetch user messages from the database
+            with stage("history"):
+                db = await get_db_spatial_ai()
+                collection = db["UserMessage"]
+                if history is None:
+                    user_messages = await fetch_history_window(collection, company_id, user_id)
+                else:
+                    user_messages = list(history)
+
+            # Downmix, trim and resample before the upload; streamed bodies are
+            # forwarded as they arrive and are left alone
+            if settings.AI_AUDIO_PREPROCESS_ENABLED and not hasattr(audio, "__aiter__"):
+                with stage("preprocess"):
+                    audio = await audio_preprocessor.process(audio)
+
+            # Send audio and user messages to AI service
+            path = f"/process_voice/{raw_company_id}"
+            async with upstream_guard.call(company_id):
+                ai_response_data = await send_request(
+                    path, audio=audio, lang=lang, user_messages=user_messages, company_id=company_id
+                )
+
+            if ai_response_data:
+                with stage("postprocess"):
+                    ai_response = AIResponse(**ai_response_data)
+                    process_ai_response_links(ai_response, lang)
+
+                # Calculate processing time
+                ai_response.process_time = time.time() - start_time
+                ai_response.stage_times = dict(timer.stages)
+
+                # Store user message in the database
+                with stage("store"):
+                    user_message = UserMessages(
+                        time=datetime.utcnow(),
+                        AIResponses=ai_response.model_dump(by_alias=True),
+                        lang=lang,
+                        companyId=ObjectId(company_id),
+                        userId=ObjectId(user_id),
+                        channel="voice"
+                    )
+                    await insert_user_message_async(collection, user_message, history=history)
+                # The response also reports the store stage, the stored record cannot
+                ai_response.stage_times = dict(timer.stages)
+                return ai_response
+            else:
+                raise HTTPException(status_code=500, detail="AI response is invalid")
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the
+    call, every other caller with the same key awaits the same result.
+
+    A successful result stays shared for ``window`` seconds after it completes,
+    so a retry or double submit arriving just afterwards is answered too.
+    The call runs in its own task, so a leader that disconnects does not
+    cancel it for the others.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._calls = {}  # key -> task
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, call):
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = asyncio.ensure_future(call())
+        self._calls[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.window > 0 and not task.cancelled() and task.exception() is None:
+            asyncio.get_running_loop().call_later(self.window, self._drop, key, task)
+        else:
+            self._drop(key, task)
 
-        # Fetch user messages from the database
-        db = await get_db_spatial_ai()
-        collection = db["UserMessage"]
-        filter_query = {"companyId": ObjectId(company_id), "userId": ObjectId(user_id)}
-        user_messages =  await collection.find(filter_query).to_list(length=None)
+    def _drop(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
 
-        # Send audio and user messages to AI service
-        url = f"{settings.AI_SITE}/process_voice/{input.companyId}"
-        ai_response_data = await send_request(url, file_path=file_path, lang=input.lang, user_messages=user_messages)
+    def stats(self):
+        return {"in_flight": len(self._calls), "calls": self.calls, "coalesced": self.coalesced}
 
-        if ai_response_data:
-            ai_response = AIResponse(**ai_response_data)
-            process_ai_response_links(ai_response, input.lang)
 
-            # Calculate processing time
-            ai_response.process_time = time.time() - start_time
-
-            # Store user message in the database
-            user_message = UserMessages(
-                time=datetime.utcnow(),
-                AIResponses=ai_response,
-                lang=input.lang,
-                companyId=ObjectId(company_id),
-                userId=ObjectId(user_id)
-            )
-            await insert_user_message_async(collection, user_message)
-            return ai_response
-        else:
-            raise HTTPException(status_code=500, detail="AI response is invalid")
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists("output.wav"):
-            os.remove("output.wav")
+# Identical text turns (same company, user, language and question) in flight on this worker
+text_requests = SingleFlight(window=settings.AI_COALESCE_WINDOW)
 
 
 async def process_ai_response_text(input):
+    if not settings.AI_COALESCE_ENABLED:
+        return await answer_text_message(input)
+
+    key = (input.companyId, input.userId, input.lang.upper(), normalize_question(input.question))
+    return await text_requests.do(key, lambda: answer_text_message(input))
+
+
+async def answer_text_message(input, history=None):
+    with timed_stages() as timer:
+        try:
+            start_time = time.time()
+            company_id = validate_object_id(input.companyId)
+            user_id = validate_object_id(input.userId)
+
+            db = await get_db_spatial_ai()
+            collection = db["UserMessage"]
+
+            # Repeated and common questions are answered locally without calling the AI service
+            ai_response_data, faq_match = local_answer(db, company_id, input)
+            cached = ai_response_data is not None
+
+            if not cached:
+                with stage("history"):
+                    payload = await build_answer_payload(collection, company_id, user_id, input, history=history)
+                async with upstream_guard.call(company_id):
+                    ai_response_data = await send_request("/get_answer/", payload=payload, company_id=company_id)
+                if ai_response_data:
+                    remember_answer(company_id, input, faq_match, ai_response_data)
+
+            if ai_response_data:
+                with stage("postprocess"):
+                    ai_response = Ai_api_answer(**ai_response_data)
+                    process_ai_response_links(ai_response, input.lang)
+
+                # Calculate processing time; cache hits are flagged so they can be told apart
+                ai_response.process_time = time.time() - start_time
+                ai_response.cached = cached
+                ai_response.stage_times = dict(timer.stages)
+
+                # Store user message in the database
+                with stage("store"):
+                    user_message = UserMessages(
+                        time=datetime.utcnow(),
+                        AIResponses=ai_response,
+                        lang=input.lang,
+                        companyId=company_id,
+                        userId=user_id,
+                        channel="text"
+                    )
+                    await insert_user_message_async(collection, user_message, history=history)
+                # The response also reports the store stage, the stored record cannot
+                ai_response.stage_times = dict(timer.stages)
+                return ai_response
+            else:
+                raise HTTPException(status_code=500, detail="AI response is invalid")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def local_answer(db, company_id, input):
+    """
+    Looks the question up in the answer cache, then among the company's
+    common inquiries. Returns (answer data or None, FAQ inquiry matched or
+    None), the latter to be passed on to remember_answer.
+    """
+    if settings.AI_ANSWER_CACHE_ENABLED:
+        with stage("answer_cache"):
+            ai_response_data = answer_cache.get(company_id, input.lang, input.question)
+        if ai_response_data is not None:
+            # Cached under the normalized question; answer the wording this user asked
+            ai_response_data["question"] = input.question
+            return ai_response_data, None
+    if settings.AI_FAQ_ENABLED:
+        with stage("faq"):
+            faq_match, ai_response_data = faq_index.lookup(db, company_id, input.lang, input.question)
+        return ai_response_data, faq_match
+    return None, None
+
+
+def remember_answer(company_id, input, faq_match, ai_response_data):
+    """Keeps an answer from the AI service for the local lookups of local_answer."""
+    if settings.AI_ANSWER_CACHE_ENABLED:
+        answer_cache.put(company_id, input.lang, input.question, ai_response_data)
+    if faq_match is not None:
+        faq_index.learn(company_id, faq_match, input.lang, input.question, ai_response_data)
+
+
+async def build_answer_payload(collection, company_id, user_id, input, history=None):
+    """Builds the /get_answer/ request body: history window, language and question."""
+    # Fetch user messages from the database, unless the caller holds the window
+    if history is None:
+        user_messages_list = await fetch_history_window(collection, company_id, user_id)
+    else:
+        user_messages_list = history
+    # Convert documents to Pydantic models
+    user_messages = [
+        UserMessages(**{**message, "_id": str(message["_id"])}) for message in user_messages_list
+    ]
+    # Serialize models to dictionaries with correct field names
+    user_messages_json = [
+        message.model_dump(mode="json", by_alias=True, exclude={"channel"}) for message in user_messages
+    ]
+    return {
+        "user_messages": user_messages_json,
+        "lang": input.lang,
+        "question": input.question
+    }
+
+
+async def open_conversation(company_id, user_id):
+    """
+    Validates the ids of a conversation session and returns its history
+    window, which the session then keeps and extends for its lifetime.
+    """
+    company_id = validate_object_id(company_id)
+    user_id = validate_object_id(user_id)
+    db = await get_db_spatial_ai()
+    # A copy, so the session never mutates a list held by the history cache
+    return list(await fetch_history_window(db["UserMessage"], company_id, user_id))
+
+
+async def process_ai_response_text_stream(input, history=None):
+    """
+    Streaming variant of process_ai_response_text.
+
+    The request is validated and the history read before anything is sent, so
+    those failures still surface as HTTP errors. It returns an async generator
+    of (event, data) pairs: "answer" events carrying the post-processed
+    answer, voice and links as they arrive from /get_answer_stream/, then one
+    "done" event with the complete AIResponse once the turn has been stored,
+    or an "error" event if the stream breaks.
+    """
     try:
         start_time = time.time()
         company_id = validate_object_id(input.companyId)
         user_id = validate_object_id(input.userId)
 
-        # Fetch user messages from the database
         db = await get_db_spatial_ai()
         collection = db["UserMessage"]
-        filter_query = {"companyId": company_id, "userId": user_id}
-        user_messages_list =  await collection.find(filter_query).to_list(length=None)
-        # Convert documents to Pydantic models
-        user_messages = [
-            UserMessages(**{**message, "_id": str(message["_id"])}) for message in user_messages_list
-        ]
-        # Serialize models to dictionaries with correct field names
-        user_messages_json = [message.model_dump(by_alias=True) for message in user_messages]
-        payload = {
-            "user_messages": user_messages_json,
-            "lang": input.lang,
-            "question": input.question
-        }
-
-        url = f"{settings.AI_SITE}/get_answer/"
-        ai_response_data = send_request(url, payload=payload)
-
-        if ai_response_data:
-            ai_response = Ai_api_answer(**ai_response_data)
-            process_ai_response_links(ai_response, input.lang)
 
-            # Calculate processing time
+        cached_data, faq_match = local_answer(db, company_id, input)
+        payload = None
+        if cached_data is None:
+            # Overload and an open circuit are reported before the stream starts
+            upstream_guard.check(company_id)
+            payload = await build_answer_payload(collection, company_id, user_id, input, history=history)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def cached_chunks():
+        yield cached_data["answer"]
+
+    async def upstream_chunks():
+        async with upstream_guard.call(company_id) as call:
+            async for text in stream_request("/get_answer_stream/", payload, company_id=company_id):
+                call.responded()
+                yield text
+
+    async def events():
+        processor = AnswerStreamProcessor(input.lang)
+        answer_parts = []
+        try:
+            if cached_data is not None:
+                chunks = cached_chunks()
+            else:
+                chunks = upstream_chunks()
+            async for text in chunks:
+                answer_parts.append(text)
+                delta = processor.feed(text)
+                if delta:
+                    yield "answer", delta
+            delta = processor.finish()
+            if delta:
+                yield "answer", delta
+
+            if cached_data is not None:
+                ai_response = Ai_api_answer(**cached_data)
+            else:
+                ai_response_data = {"question": input.question, "answer": "".join(answer_parts)}
+                remember_answer(company_id, input, faq_match, ai_response_data)
+                ai_response = Ai_api_answer(**ai_response_data)
+            process_ai_response_links(ai_response, input.lang)
             ai_response.process_time = time.time() - start_time
+            ai_response.cached = cached_data is not None
 
-            # Store user message in the database
+            # Store user message in the database once the whole answer is known
             user_message = UserMessages(
-                time=str(datetime.now()),
+                time=datetime.utcnow(),
                 AIResponses=ai_response,
                 lang=input.lang,
                 companyId=company_id,
-                userId=user_id
+                userId=user_id,
+                channel="text"
             )
-            await insert_user_message_async(collection, user_message)
-            return ai_response
-        else:
-            raise HTTPException(status_code=500, detail="AI response is invalid")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            await insert_user_message_async(collection, user_message, history=history)
+            yield "done", ai_response.model_dump(by_alias=True)
+        except Exception as e:
+            yield "error", {"detail": getattr(e, "detail", str(e))}
+
+    return events()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# Whitespace after which no link, list number or markdown marker can still be incomplete
+LAST_WHITESPACE = re.compile(r'\s\S*\Z')
+
+
+class AnswerStreamProcessor:
+    """
+    Applies the process_ai_response_links rewriting to an answer that arrives
+    in chunks.
+
+    The post-processing rules never span whitespace, so the text up to the
+    last whitespace seen can be rewritten and released immediately; only the
+    trailing partial word, and the indentation of a line that has no content
+    yet, is held back.
+    """
+
+    def __init__(self, lang):
+        self.lang = lang
+        self.links = []
+        self._buffer = ""
+        self._line_start = True
+        self._started = False
+
+    def feed(self, text):
+        self._buffer += text
+        match = LAST_WHITESPACE.search(self._buffer)
+        if not match:
+            return None
+        cut = match.start() + 1
+        line_begin = self._buffer.rfind("\n", 0, cut) + 1
+        if (line_begin or self._line_start) and not self._buffer[line_begin:cut].strip():
+            # Keep indentation with its line, bullets may follow
+            cut = line_begin
+        if not cut:
+            return None
+        segment, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._process(segment)
+
+    def finish(self):
+        segment, self._buffer = self._buffer, ""
+        return self._process(segment) if segment else None
+
+    def _process(self, segment):
+        answer, voice, links = postprocessor.process(segment, self.lang, line_start=self._line_start)
+        self._line_start = segment.endswith("\n")
+
+        if not self._started:
+            answer, voice = answer.lstrip(), voice.lstrip()
+            self._started = bool(answer)
+        self.links.extend(links)
+        if not answer and not links:
+            return None
+        return {"answer": answer, "voice": voice, "links": links}
 
 
 def process_ai_response_links(ai_response, lang):
-    import re
-
-    # Extract and remove links from the answer
-    link_pattern = re.compile(r'[\[(](https?://[^\s]+|www\.[^\s]+)[\])]')
-    ai_response.links = link_pattern.findall(ai_response.answer)
-    ai_response.answer = link_pattern.sub('', ai_response.answer)
-
-    # Process list numbers in the answer
-    ai_response.voice = replace_list_numbers(ai_response.answer, lang)
+    # Extract links, spell out numbers and strip markdown for the voice in one pass
+    answer, voice, ai_response.links = postprocessor.process(ai_response.answer, lang)
 
     # Clean the answer and voice text
-    ai_response.answer = clean_string(ai_response.answer)
-    ai_response.voice = clean_string(ai_response.voice)
-
-
-def replace_list_numbers(input_text, lang):
-    import re
-
-    # First stage: Replace main numbers (1., 2., etc.)
-    re_main = re.compile(r'(?m)^(\d+)\.')
-    input_text = re_main.sub(lambda m: f"numero {m.group(1)}." if lang == "IT" else f"number {m.group(1)}.", input_text)
-
-    # Second stage: Replace nested numbers (1.1, 1.2, etc.)
-    re_nested = re.compile(r'(\d+(\.\d+)+)')
-
-    def replace_nested(match):
-        numbers = match.group(1).split('.')
-        if lang == "IT":
-            formatted = "numero " + " punto ".join(numbers) + "."
-        else:
-            formatted = "number " + " point ".join(numbers) + "."
-        return formatted
-
-    input_text = re_nested.sub(replace_nested, input_text)
-
-    return input_text
+    ai_response.answer = clean_string(answer)
+    ai_response.voice = clean_string(voice)
 
 
 def clean_string(text):
@@ -155,29 +453,87 @@ def clean_string(text):
     return text.strip()
 
 
-async def insert_user_message_async(collection, user_message):
-    await collection.insert_one(user_message.dict())
-
-
-def summarize_data(messages: List[UserMessages]) -> AISummary:
-    total_questions = len(messages)
-    total_time = timedelta()
-
-    results = []
-    for message in messages:
-        if message.AIResponses.process_time:
-            total_time += timedelta(seconds=message.AIResponses.process_time)
-
-        results.append(MessageDetail(
-            userId=str(message.userId),
-            question=message.AIResponses.question,
-            answer=message.AIResponses.answer,
-            time=message.time
-        ))
-
-    # Return the summary using the AISummary schema
-    return AISummary(
-        total_questions=total_questions,
-        total_time=str(total_time),
-        details=results
-    )
+# Fields of a stored UserMessage that the AI service needs as history
+HISTORY_PROJECTION = {"_id": 1, "companyId": 1, "userId": 1, "AIResponses": 1, "lang": 1, "time": 1}
+
+
+async def fetch_history_window(collection, company_id, user_id):
+    """
+    Returns the user's most recent turns, oldest first.
+
+    The window is capped at AI_HISTORY_MAX_TURNS documents and, when
+    AI_HISTORY_MAX_AGE_MINUTES is set, to turns newer than that. The query is
+    served by the (companyId, userId, time) index created in init_db, and
+    skipped entirely while the window is in the history cache.
+    """
+    since = None
+    if settings.AI_HISTORY_MAX_AGE_MINUTES > 0:
+        since = datetime.utcnow() - timedelta(minutes=settings.AI_HISTORY_MAX_AGE_MINUTES)
+
+    if settings.AI_HISTORY_CACHE_ENABLED:
+        history = history_cache.get(company_id, user_id)
+        if history is not None:
+            if since is not None:
+                history = [message for message in history if message["time"] >= since]
+            return history
+
+    # Turns stored while the query runs make its result stale
+    generation = history_cache.generation()
+    filter_query = {"companyId": ObjectId(company_id), "userId": ObjectId(user_id)}
+    if since is not None:
+        filter_query["time"] = {"$gte": since}
+
+    cursor = collection.find(filter_query, HISTORY_PROJECTION).sort("time", -1)
+    if settings.AI_HISTORY_MAX_TURNS > 0:
+        cursor = cursor.limit(settings.AI_HISTORY_MAX_TURNS)
+    history = await cursor.to_list(length=None)
+    history.reverse()
+
+    # Turns still in the write-behind buffer are not in Mongo yet
+    pending = write_behind.pending_for(company_id, user_id)
+    if pending:
+        stored_ids = {message["_id"] for message in history}
+        history += [
+            history_entry(document) for document in pending
+            if document["_id"] not in stored_ids and (since is None or document["time"] >= since)
+        ]
+        if settings.AI_HISTORY_MAX_TURNS > 0:
+            history = history[-settings.AI_HISTORY_MAX_TURNS:]
+
+    if settings.AI_HISTORY_CACHE_ENABLED:
+        history_cache.put(company_id, user_id, history, generation)
+    return history
+
+
+def history_entry(document):
+    """The part of a stored UserMessage document that history reads return."""
+    return {field: document[field] for field in HISTORY_PROJECTION if field in document}
+
+
+async def insert_user_message_async(collection, user_message, history=None):
+    document = user_message.dict()
+    # Assigned by the model rather than the driver so buffered turns already have their id
+    document["_id"] = document.pop("id")
+
+    if write_behind.running:
+        # Batched with other turns and written off the request path; only
+        # turns that reach Mongo are rolled up
+        await write_behind.add(collection, document, on_written=rollup_recorder.record)
+    else:
+        await collection.insert_one(document)
+        rollup_recorder.record(document)
+
+    # Write-through so the next turn of this conversation is served from memory
+    if settings.AI_HISTORY_CACHE_ENABLED:
+        history_cache.append(
+            user_message.companyId,
+            user_message.userId,
+            history_entry(document),
+            max_turns=settings.AI_HISTORY_MAX_TURNS,
+        )
+
+    # A session-held window is kept to the same bounds as a history read
+    if history is not None:
+        history.append(history_entry(document))
+        if settings.AI_HISTORY_MAX_TURNS > 0:
+            del history[:-settings.AI_HISTORY_MAX_TURNS]
@@ -0,0 +1,228 @@
+import base64
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ReplaceOne
+
+from app.schemas.ai_agent import AILatency, AIRollups, AISummary, LatencyStats, MessageDetail, RollupBucket
+from app.utils.latency_sketch import LatencySketch
+from app.utils.rollups import Bucket, bucket_filter, bucket_keys, bucket_start
+
+# Only what MessageDetail shows, the stored voice answer and stage times stay in Mongo
+SUMMARY_PROJECTION = {"_id": 1, "userId": 1, "time": 1, "AIResponses.question": 1, "AIResponses.answer": 1}
+
+
+def time_range_filter(company_id, start=None, end=None):
+    """Turns of one company, optionally limited to ``start <= time < end``."""
+    filter_query = {"companyId": company_id}
+    time_range = {}
+    if start is not None:
+        time_range["$gte"] = start
+    if end is not None:
+        time_range["$lt"] = end
+    if time_range:
+        filter_query["time"] = time_range
+    return filter_query
+
+
+def encode_cursor(document):
+    """Opaque position after ``document`` in (time, _id) descending order."""
+    position = f"{document['time'].isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        time_text, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(time_text), ObjectId(message_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def summary_totals(collection, filter_query):
+    """Question count and summed process_time, computed by Mongo."""
+    pipeline = [
+        {"$match": filter_query},
+        {"$group": {
+            "_id": None,
+            "total_questions": {"$sum": 1},
+            "total_seconds": {"$sum": {"$ifNull": ["$AIResponses.process_time", 0]}},
+        }},
+    ]
+    totals = await collection.aggregate(pipeline).to_list(length=1)
+    if not totals:
+        return 0, 0.0
+    return totals[0]["total_questions"], totals[0]["total_seconds"]
+
+
+async def summary_page(collection, filter_query, cursor=None, limit=100):
+    """
+    One page of turns, newest first, and the cursor of the next page (None
+    on the last one). Pages are keyed on (time, _id) rather than skipped
+    over, so a page costs the same however deep it is.
+    """
+    if cursor is not None:
+        time, message_id = decode_cursor(cursor)
+        filter_query = {
+            **filter_query,
+            "$or": [{"time": {"$lt": time}}, {"time": time, "_id": {"$lt": message_id}}],
+        }
+    documents = await collection.find(filter_query, SUMMARY_PROJECTION) \
+        .sort([("time", -1), ("_id", -1)]).limit(limit + 1).to_list(length=None)
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    details = [
+        MessageDetail(
+            userId=str(document.get("userId")),
+            question=document["AIResponses"]["question"],
+            answer=document["AIResponses"]["answer"],
+            time=document["time"],
+        )
+        for document in documents[:limit]
+    ]
+    return details, next_cursor
+
+
+async def company_summary(collection, company_id, start=None, end=None, cursor=None, limit=100):
+    """
+    AISummary of a company's turns between ``start`` and ``end``: totals
+    over the whole range, details for one page of it. Served by the
+    (companyId, time, _id) index created in init_db.
+    """
+    filter_query = time_range_filter(company_id, start, end)
+    total_questions, total_seconds = await summary_totals(collection, filter_query)
+    if not total_questions:
+        return None
+    details, next_cursor = await summary_page(collection, filter_query, cursor, limit)
+    return AISummary(
+        total_questions=total_questions,
+        total_time=str(timedelta(seconds=total_seconds)),
+        details=details,
+        next_cursor=next_cursor,
+    )
+
+
+# What a rollup bucket is recomputed from
+ROLLUP_SOURCE_PROJECTION = {
+    "companyId": 1, "userId": 1, "lang": 1, "channel": 1, "time": 1, "AIResponses.process_time": 1
+}
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def rollup_filter(company_id, granularity, start=None, end=None, lang=None, channel=None):
+    """Rollup buckets of one company; ``start`` is rounded down to the granularity."""
+    filter_query = {"companyId": company_id, "granularity": granularity}
+    time_range = {}
+    if start is not None:
+        time_range["$gte"] = bucket_start(start, granularity)
+    if end is not None:
+        time_range["$lt"] = end
+    if time_range:
+        filter_query["bucket"] = time_range
+    if lang:
+        filter_query["lang"] = lang.upper()
+    if channel:
+        filter_query["channel"] = channel
+    return filter_query
+
+
+async def company_rollups(collection, company_id, granularity="day", start=None, end=None, lang=None,
+                          channel=None):
+    """
+    AIRollups of a company from its rollup buckets, one entry per bucket,
+    language and channel, with totals over the range. Reads O(buckets)
+    documents however many turns they summarize.
+    """
+    filter_query = rollup_filter(company_id, granularity, start, end, lang, channel)
+    documents = await collection.find(filter_query, {"_id": 0, "latency": 0}) \
+        .sort([("bucket", 1), ("lang", 1), ("channel", 1)]).to_list(length=None)
+    total = Bucket()
+    buckets = []
+    for document in documents:
+        bucket = Bucket.from_document(document)
+        total.merge(bucket)
+        buckets.append(RollupBucket(
+            bucket=document["bucket"],
+            lang=document["lang"],
+            channel=document["channel"],
+            questions=bucket.count,
+            total_process_time=bucket.total_process_time,
+            max_process_time=bucket.max_process_time,
+            users=bucket.users.count,
+        ))
+    return AIRollups(
+        granularity=granularity,
+        total_questions=total.count,
+        total_process_time=total.total_process_time,
+        max_process_time=total.max_process_time,
+        users=total.users.count,
+        buckets=buckets,
+    )
+
+
+def latency_stats(sketch, **fields):
+    p50, p90, p99 = sketch.percentiles(LATENCY_PERCENTILES)
+    return LatencyStats(count=sketch.count, p50=p50, p90=p90, p99=p99, **fields)
+
+
+async def company_latency(collection, company_id, granularity="day", start=None, end=None, lang=None,
+                          channel=None):
+    """
+    AILatency of a company: answer latency percentiles and histogram over
+    the range, per time bucket and per language and channel. The latency
+    sketches of the rollup buckets are merged, so months of data cost one
+    read per bucket.
+    """
+    filter_query = rollup_filter(company_id, granularity, start, end, lang, channel)
+    documents = await collection.find(filter_query, {"_id": 0, "bucket": 1, "lang": 1, "channel": 1, "latency": 1}) \
+        .sort("bucket", 1).to_list(length=None)
+    total = LatencySketch()
+    series = {}
+    breakdown = {}
+    for document in documents:
+        sketch = LatencySketch(document.get("latency"))
+        total.merge(sketch)
+        series.setdefault(document["bucket"], LatencySketch()).merge(sketch)
+        breakdown.setdefault((document["lang"], document["channel"]), LatencySketch()).merge(sketch)
+    return AILatency(
+        granularity=granularity,
+        overall=latency_stats(total),
+        histogram=total.histogram(),
+        series=[latency_stats(sketch, bucket=bucket) for bucket, sketch in series.items()],
+        breakdown=[
+            latency_stats(sketch, lang=lang, channel=channel) for (lang, channel), sketch in sorted(breakdown.items())
+        ],
+    )
+
+
+async def backfill_rollups(messages, rollups, company_id, start=None, end=None):
+    """
+    Recomputes one company's rollup buckets from its UserMessage turns and
+    replaces them, so running it again gives the same result. Buckets are
+    replaced whole: ``start`` and ``end`` should fall on day boundaries
+    and ``end`` should not be after the current day, which live recording
+    still updates. Returns the number of buckets written.
+    """
+    buckets = {}
+    cursor = messages.find(time_range_filter(company_id, start, end), ROLLUP_SOURCE_PROJECTION)
+    async for document in cursor:
+        if document.get("time") is None:
+            continue
+        for key in bucket_keys(document):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = Bucket()
+            bucket.add(document)
+
+    requests = [
+        ReplaceOne(
+            bucket_filter(key),
+            {**bucket_filter(key), **bucket.document()},
+            upsert=True,
+        )
+        for key, bucket in buckets.items()
+    ]
+    if requests:
+        await rollups.bulk_write(requests, ordered=False)
+    return len(requests)
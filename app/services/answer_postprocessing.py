@@ -0,0 +1,113 @@
+import re
+
+
+class LanguageRules:
+    """How an answer is turned into text for the voice of one language."""
+
+    def __init__(self, list_word, decimal_word, extract_links=True, strip_markdown=True):
+        self.list_word = list_word  # Spoken before list numbers: "number 1."
+        self.decimal_word = decimal_word  # Spoken between the parts of 1.2: "number 1 point 2."
+        self.extract_links = extract_links
+        self.strip_markdown = strip_markdown
+
+
+LANGUAGE_RULES = {
+    "EN": LanguageRules("number", "point"),
+    "IT": LanguageRules("numero", "punto"),
+    "DE": LanguageRules("Nummer", "Punkt"),
+    "FR": LanguageRules("numéro", "point"),
+    "ES": LanguageRules("número", "punto"),
+}
+DEFAULT_LANGUAGE = "EN"
+
+
+def rules_for(lang):
+    """Rules for a language code such as "IT" or "it-IT"; English if unknown."""
+    code = (lang or "").upper()
+    return LANGUAGE_RULES.get(code) or LANGUAGE_RULES.get(code.split("-")[0]) or LANGUAGE_RULES[DEFAULT_LANGUAGE]
+
+
+# Every construct is recognised by one alternation, so an answer is scanned
+# once. Line-start rules match the newline before the line (the text is given
+# a leading newline), and the lookahead lets the scan skip every character
+# that cannot start a match. No rule spans whitespace other than one space
+# or tab after a markdown marker, which the streaming processor relies on.
+ANSWER_PATTERN = re.compile(
+    r"""
+    (?=[\[(\d\n*`])
+    (?:
+        (?P<link>[\[(](?P<url>https?://\S+|www\.\S+)[\])])  # (url) or [url]
+      | (?P<nested>\d+(?:\.\d+)+)                        # 1.2, 1.2.3
+      | (?P<newline>\n)
+        (?:
+            (?P<main>\d+)\.(?!\d)                        # "1." opening a line, not "1.2"
+          | (?P<heading>\#{1,6})[ \t]?                    # markdown heading
+          | (?P<bullet>[ \t]*[-+*])[ \t]                  # markdown bullet
+        )
+      | (?P<emphasis>\*+|`+)                             # bold, italics, code
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+class AnswerPostProcessor:
+    """
+    Single-pass rewriting of an AI answer.
+
+    Links are removed from the answer and collected. The voice text is the
+    answer without links, with list and decimal numbers spelled out in the
+    answer's language and markdown markers removed.
+    """
+
+    def __init__(self, pattern=ANSWER_PATTERN):
+        self.pattern = pattern
+
+    def process(self, text, lang, line_start=True):
+        """
+        Returns (answer, voice, links) for ``text``. With ``line_start`` False
+        the text continues a line, so line-start rules do not apply at its start.
+        """
+        rules = rules_for(lang)
+        text = ("\n" if line_start else "\x00") + text
+        links = []
+        link_spans = []
+
+        list_word = rules.list_word
+        decimal_separator = f" {rules.decimal_word} "
+        strip_markdown = rules.strip_markdown
+
+        def rewrite(match):
+            kind = match.lastgroup
+            if kind == "emphasis":
+                # Markdown stays in the displayed answer, the voice skips it
+                return "" if strip_markdown else match.group()
+            if kind == "nested":
+                return f"{list_word} {decimal_separator.join(match.group().split('.'))}."
+            if kind == "main":
+                return f"\n{list_word} {match.group('main')}."
+            if kind == "link":
+                if not rules.extract_links:
+                    return match.group()
+                links.append(match.group("url"))
+                link_spans.append(match.span())
+                return ""
+            # Heading or bullet, the newline before it is kept
+            return "\n" if strip_markdown else match.group()
+
+        voice = self.pattern.sub(rewrite, text)
+
+        answer = text
+        if link_spans:
+            parts = []
+            position = 0
+            for start, end in link_spans:
+                parts.append(text[position:start])
+                position = end
+            parts.append(text[position:])
+            answer = "".join(parts)
+        return answer[1:], voice[1:], links
+
+
+# Compiled once at import, shared by every request
+postprocessor = AnswerPostProcessor()
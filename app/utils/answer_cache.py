@@ -0,0 +1,102 @@
+import copy
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from app.core.config import settings
+
+_punctuation = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Folds a question to the form used as cache key, so that e.g.
+    "What are your opening hours?" and "what are your  opening hours" match.
+    """
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = _punctuation.sub(" ", question)
+    return _whitespace.sub(" ", question).strip()
+
+
+class AnswerCache:
+    """
+    LRU cache of AI service answers keyed by (companyId, lang, normalized
+    question).
+
+    Each company can have its own TTL (``company_ttls``, seconds); a TTL of 0
+    disables caching for that company. Entries of a company are dropped with
+    ``invalidate_company`` when its AI configuration changes.
+    """
+
+    def __init__(self, max_entries, ttl, company_ttls=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.company_ttls = company_ttls or {}
+        self._entries = OrderedDict()  # key -> (expires_at, answer)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(company_id, lang, question):
+        return str(company_id), (lang or "").upper(), normalize_question(question)
+
+    def ttl_for(self, company_id):
+        return self.company_ttls.get(str(company_id), self.ttl)
+
+    def get(self, company_id, lang, question):
+        """Returns a copy of the cached answer, or None on a miss."""
+        key = self.key(company_id, lang, question)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, company_id, lang, question, answer):
+        ttl = self.ttl_for(company_id)
+        if ttl <= 0:
+            return
+        key = self.key(company_id, lang, question)
+        self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(answer))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_company(self, company_id):
+        company_id = str(company_id)
+        for key in [key for key in self._entries if key[0] == company_id]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.AI_ANSWER_CACHE_MAX_ENTRIES,
+    ttl=settings.AI_ANSWER_CACHE_TTL,
+    company_ttls=settings.AI_ANSWER_CACHE_COMPANY_TTLS,
+)
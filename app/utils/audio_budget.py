@@ -0,0 +1,188 @@
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.utils.timing import stage
+
+
+class AudioByteBudget:
+    """
+    Caps the audio bytes that voice requests hold in memory at once.
+
+    A request reserves its size before its clip is decoded or forwarded and
+    returns it when the turn ends. Reservations that do not fit wait in FIFO
+    order for at most ``wait_timeout`` seconds and are then rejected with 503
+    and a Retry-After header. Clips over ``max_request_bytes`` are refused
+    with 413 before anything is decoded. A limit of 0 disables that check.
+    """
+
+    def __init__(self, max_bytes, max_request_bytes, wait_timeout, retry_after):
+        self.max_bytes = max_bytes
+        self.max_request_bytes = max_request_bytes
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.in_flight_bytes = 0
+        self.in_flight_requests = 0
+        self.peak_bytes = 0
+        self._waiters = deque()  # (nbytes, future)
+        self.admitted = 0
+        self.too_large = 0
+        self.timed_out = 0
+
+    def check_size(self, nbytes):
+        """Rejects a single clip that is over the per-request limit."""
+        if self.max_request_bytes and nbytes > self.max_request_bytes:
+            self.too_large += 1
+            raise HTTPException(
+                status_code=413,
+                detail=f"Audio clip is larger than {self.max_request_bytes} bytes",
+            )
+
+    @asynccontextmanager
+    async def reserve(self, nbytes):
+        """Holds ``nbytes`` of the budget for the enclosed code."""
+        if self.max_bytes:
+            # A clip larger than the whole budget is admitted alone
+            nbytes = min(nbytes, self.max_bytes)
+        with stage("audio_admission"):
+            await self._acquire(nbytes)
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+    @contextmanager
+    def reserve_now(self, nbytes):
+        """
+        Holds ``nbytes`` more for the enclosed code if they fit without
+        waiting, yielding whether they did. For optional work, such as
+        preprocessing, of a request that already holds its clip.
+        """
+        granted = not self._waiters and self._fits(nbytes)
+        if granted:
+            self.in_flight_bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.in_flight_bytes -= nbytes
+                self._wake()
+
+    def _fits(self, nbytes):
+        return not self.max_bytes or self.in_flight_bytes + nbytes <= self.max_bytes
+
+    def _admit(self, nbytes):
+        self.in_flight_bytes += nbytes
+        self.in_flight_requests += 1
+        self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+        self.admitted += 1
+
+    async def _acquire(self, nbytes):
+        if not self._waiters and self._fits(nbytes):
+            self._admit(nbytes)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (nbytes, waiter)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(waiter, self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too much audio in flight, try again later",
+                headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))},
+            )
+        except asyncio.CancelledError:
+            # Bytes granted just before the cancellation must be given back
+            if waiter.done() and not waiter.cancelled():
+                self._release(nbytes)
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                # The head may have been the one blocking the rest
+                self._wake()
+
+    def _release(self, nbytes):
+        self.in_flight_bytes -= nbytes
+        self.in_flight_requests -= 1
+        self._wake()
+
+    def _wake(self):
+        # Grants go in arrival order, so a large clip is not starved by small ones
+        while self._waiters:
+            nbytes, waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(nbytes):
+                return
+            self._waiters.popleft()
+            self._admit(nbytes)
+            waiter.set_result(None)
+
+    def stats(self):
+        return {
+            "max_bytes": self.max_bytes,
+            "in_flight_bytes": self.in_flight_bytes,
+            "in_flight_requests": self.in_flight_requests,
+            "peak_bytes": self.peak_bytes,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "too_large": self.too_large,
+            "timed_out": self.timed_out,
+        }
+
+    def prometheus(self):
+        """Renders the in-flight gauges in the Prometheus text exposition format."""
+        gauges = (
+            ("ai_audio_bytes_in_flight", "Audio bytes held by voice requests.", self.in_flight_bytes),
+            ("ai_audio_requests_in_flight", "Voice requests holding audio.", self.in_flight_requests),
+            ("ai_audio_requests_waiting", "Voice requests waiting for the audio budget.", len(self._waiters)),
+        )
+        lines = []
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class SizeLimitedStream:
+    """
+    Chunks of a body whose size is not known up front (a chunked upload),
+    held to the budget's per-request limit as they arrive.
+
+    Iterating raises the 413 from ``check_size`` as soon as the running total
+    is over the limit. Code between the stream and the caller may turn that
+    error into another one, so it is also kept as ``too_large``.
+    """
+
+    def __init__(self, budget, chunks):
+        self.budget = budget
+        self.chunks = chunks
+        self.size = 0
+        self.too_large = None
+
+    async def __aiter__(self):
+        async for chunk in self.chunks:
+            self.size += len(chunk)
+            try:
+                self.budget.check_size(self.size)
+            except HTTPException as e:
+                self.too_large = e
+                raise
+            yield chunk
+
+
+audio_budget = AudioByteBudget(
+    max_bytes=settings.AI_AUDIO_BUDGET_BYTES,
+    max_request_bytes=settings.AI_AUDIO_MAX_BYTES,
+    wait_timeout=settings.AI_AUDIO_BUDGET_WAIT,
+    retry_after=settings.AI_UPSTREAM_RETRY_AFTER,
+)
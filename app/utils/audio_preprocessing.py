@@ -0,0 +1,185 @@
+import asyncio
+import io
+import wave
+from contextlib import nullcontext
+
+import numpy as np
+
+from app.core.config import settings
+from app.utils.audio_budget import audio_budget
+
+# Peak memory of preprocess_wav per byte of clip: the float32 samples and the
+# float64/complex128 FFT buffers of the worst case, 8-bit audio
+WORKING_SET_FACTOR = 24
+
+
+def read_pcm(data):
+    """
+    Parses a PCM WAV clip into float32 samples in [-1, 1], shaped
+    (frames, channels), and its sample rate. Raises wave.Error or EOFError
+    for anything that is not integer PCM.
+    """
+    with wave.open(io.BytesIO(data)) as clip:
+        channels = clip.getnchannels()
+        width = clip.getsampwidth()
+        rate = clip.getframerate()
+        raw = clip.readframes(clip.getnframes())
+
+    if width == 1:
+        # 8-bit WAV is unsigned
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 2 ** 15
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        values = np.where(values >= 2 ** 23, values - 2 ** 24, values)
+        samples = values.astype(np.float32) / 2 ** 23
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2 ** 31
+    else:
+        raise wave.Error(f"unsupported sample width {width}")
+    return samples[:len(samples) // channels * channels].reshape(-1, channels), rate
+
+
+def write_pcm16(samples, rate):
+    """Encodes mono float samples as a 16-bit PCM WAV clip."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(rate)
+        clip.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def trim_silence(samples, rate, threshold_db, frame_ms, pad_ms):
+    """
+    Drops leading and trailing silence from mono samples. A frame is voiced
+    when its RMS level is above ``threshold_db`` dBFS; ``pad_ms`` of audio is
+    kept around the voiced part. A clip with no voiced frame is returned as is.
+    """
+    frame = max(1, int(rate * frame_ms / 1000))
+    frames = len(samples) // frame
+    if frames == 0:
+        return samples
+    energy = np.mean(samples[:frames * frame].reshape(frames, frame) ** 2, axis=1)
+    voiced = np.flatnonzero(energy > 10 ** (threshold_db / 10))
+    if len(voiced) == 0:
+        return samples
+    pad = int(rate * pad_ms / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def resample(samples, rate, target_rate):
+    """
+    Band-limited resampling to ``target_rate`` by truncating the spectrum.
+    Only downsamples; a clip at or below the target rate is returned as is.
+    """
+    if rate <= target_rate or len(samples) == 0:
+        return samples, rate
+    length = max(1, round(len(samples) * target_rate / rate))
+    spectrum = np.fft.rfft(samples)[:length // 2 + 1]
+    return np.fft.irfft(spectrum, length) * (length / len(samples)), target_rate
+
+
+def file_size(audio):
+    """Bytes left to read in a seekable binary file object."""
+    position = audio.tell()
+    size = audio.seek(0, io.SEEK_END) - position
+    audio.seek(position)
+    return size
+
+
+def preprocess_wav(data, target_rate, threshold_db, frame_ms, pad_ms):
+    """Downmixes, trims and resamples a WAV clip, returning 16-bit mono WAV bytes."""
+    samples, rate = read_pcm(data)
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    # Trimmed before resampling, so silence is never resampled
+    mono = trim_silence(mono, rate, threshold_db, frame_ms, pad_ms)
+    mono, rate = resample(mono, rate, target_rate)
+    return write_pcm16(mono, rate)
+
+
+class AudioPreprocessor:
+    """
+    Shrinks voice clips before they are uploaded to the AI service.
+
+    Clips that cannot be parsed as PCM WAV, or that would not get smaller,
+    are forwarded unchanged. So are file objects over ``max_bytes``, which
+    were spilled to disk to keep them out of memory, and clips whose working
+    set does not fit in ``budget`` right away. The numpy work runs in a
+    thread so it does not hold up the event loop.
+    """
+
+    def __init__(self, target_rate, threshold_db, frame_ms, pad_ms, max_bytes=0, budget=None):
+        self.target_rate = target_rate
+        self.threshold_db = threshold_db
+        self.frame_ms = frame_ms
+        self.pad_ms = pad_ms
+        self.max_bytes = max_bytes  # 0 for no limit
+        self.budget = budget
+        self.clips = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def process(self, audio):
+        """
+        Returns the preprocessed clip as bytes, given bytes or a binary file
+        object; a file object that is skipped is returned as is.
+        """
+        data = audio
+        if not isinstance(audio, (bytes, bytearray)):
+            size = file_size(audio)
+            if self.max_bytes and size > self.max_bytes:
+                self._skip(size)
+                return audio
+            data = await asyncio.to_thread(audio.read)
+
+        working_set = self.budget.reserve_now(WORKING_SET_FACTOR * len(data)) if self.budget else nullcontext(True)
+        with working_set as granted:
+            if not granted:
+                self._skip(len(data))
+                return bytes(data)
+            try:
+                processed = await asyncio.to_thread(
+                    preprocess_wav, data, self.target_rate, self.threshold_db, self.frame_ms, self.pad_ms
+                )
+            except (wave.Error, EOFError, ValueError):
+                processed = data
+        if len(processed) >= len(data):
+            self._skip(len(data))
+            return bytes(data)
+        self.clips += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(processed)
+        return bytes(processed)
+
+    def _skip(self, size):
+        self.clips += 1
+        self.skipped += 1
+        self.bytes_in += size
+        self.bytes_out += size
+
+    def stats(self):
+        return {
+            "clips": self.clips,
+            "skipped": self.skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+        }
+
+
+audio_preprocessor = AudioPreprocessor(
+    target_rate=settings.AI_AUDIO_TARGET_RATE,
+    threshold_db=settings.AI_AUDIO_SILENCE_THRESHOLD_DB,
+    frame_ms=settings.AI_AUDIO_SILENCE_FRAME_MS,
+    pad_ms=settings.AI_AUDIO_SILENCE_PAD_MS,
+    max_bytes=settings.AI_AUDIO_SPILL_BYTES,
+    budget=audio_budget,
+)
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+
+class Replica:
+    """One AI service backend and what this worker has seen of it."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.ewma = None  # Seconds
+        self.healthy = True
+        self.drained_until = 0.0
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now):
+        return self.healthy and now >= self.drained_until
+
+    def stats(self):
+        return {
+            "healthy": self.available(time.monotonic()),
+            "outstanding": self.outstanding,
+            "ewma_ms": None if self.ewma is None else self.ewma * 1000,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class BackendRouter:
+    """
+    Picks the AI service replica for each call.
+
+    With ``strategy`` "least_outstanding" the replica with the fewest calls in
+    progress is used; with "ewma" the one with the lowest latency average
+    weighted by its calls in progress. With ``pin_companies`` each company
+    sticks to one replica chosen by rendezvous hashing, so the replica's own
+    caches stay warm, and moves only when that replica is unavailable.
+
+    A replica failing ``failure_threshold`` calls in a row is drained for
+    ``drain_seconds``; when ``health_interval`` is set, ``health_path`` is
+    polled to drain and restore replicas in the background. If every replica
+    is unavailable, calls still go to the least loaded one.
+    """
+
+    def __init__(self, urls, strategy="least_outstanding", pin_companies=False, failure_threshold=3,
+                 drain_seconds=30, ewma_alpha=0.3, health_interval=0, health_path="/health"):
+        self.strategy = strategy
+        self.pin_companies = pin_companies
+        self.failure_threshold = failure_threshold
+        self.drain_seconds = drain_seconds
+        self.ewma_alpha = ewma_alpha
+        self.health_interval = health_interval
+        self.health_path = health_path
+        self._task = None
+        self.set_backends(urls)
+
+    def set_backends(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+
+    def pick(self, company_id=None, exclude=()):
+        """The replica for the next call, avoiding ``exclude`` when another one is available."""
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica.available(now) and replica not in exclude]
+        if not candidates:
+            candidates = [replica for replica in self.replicas if replica not in exclude] or self.replicas
+        if self.pin_companies and company_id is not None:
+            return max(candidates, key=lambda replica: self._rendezvous(company_id, replica))
+        if self.strategy == "ewma":
+            # Unmeasured replicas go first, so every one gets a latency estimate
+            return min(candidates, key=lambda replica: (replica.ewma or 0.0) * (replica.outstanding + 1))
+        return min(candidates, key=lambda replica: (replica.outstanding, replica.ewma or 0.0))
+
+    @staticmethod
+    def _rendezvous(company_id, replica):
+        return hashlib.blake2b(f"{company_id}|{replica.url}".encode(), digest_size=8).digest()
+
+    @asynccontextmanager
+    async def track(self, replica, timeout=None):
+        """
+        Accounts one call to ``replica``: calls in progress, latency and
+        failures. A call cancelled once its ``timeout`` has run out counts as
+        failed, one cancelled earlier (a hedge that lost the race, a client
+        that went away) does not.
+        """
+        replica.outstanding += 1
+        replica.requests += 1
+        start = time.monotonic()
+        try:
+            yield
+        except aiohttp.ClientResponseError as e:
+            self._record(replica, time.monotonic() - start, failed=e.status >= 500)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            latency = time.monotonic() - start
+            self._record(replica, latency, failed=timeout is not None and latency >= timeout)
+            raise
+        except aiohttp.ClientConnectionError as e:
+            # An upload the client side aborted, e.g. over the clip limit, is not the replica's failure
+            self._record(replica, time.monotonic() - start, failed=not isinstance(e.__cause__, HTTPException))
+            raise
+        except Exception:
+            self._record(replica, time.monotonic() - start, failed=True)
+            raise
+        else:
+            self._record(replica, time.monotonic() - start, failed=False)
+        finally:
+            replica.outstanding -= 1
+
+    def _record(self, replica, latency, failed):
+        if replica.ewma is None:
+            replica.ewma = latency
+        else:
+            replica.ewma += self.ewma_alpha * (latency - replica.ewma)
+        if not failed:
+            replica.consecutive_failures = 0
+            return
+        replica.failures += 1
+        replica.consecutive_failures += 1
+        if replica.consecutive_failures >= self.failure_threshold:
+            replica.consecutive_failures = 0
+            replica.drained_until = time.monotonic() + self.drain_seconds
+            print(f"AI backend {replica.url} drained after repeated failures")
+
+    async def start(self):
+        if self.health_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._health_checks())
+            print("AI backend health checks started")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _health_checks(self):
+        from app.utils.http_client import get_http_session
+
+        timeout = aiohttp.ClientTimeout(total=max(1.0, self.health_interval / 2))
+        while True:
+            http = await get_http_session()
+            await asyncio.gather(*(self._check(http, replica, timeout) for replica in self.replicas))
+            await asyncio.sleep(self.health_interval)
+
+    async def _check(self, http, replica, timeout):
+        try:
+            async with http.get(replica.url + self.health_path, timeout=timeout) as response:
+                healthy = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy != replica.healthy:
+            print(f"AI backend {replica.url} is {'healthy' if healthy else 'unhealthy'}")
+        replica.healthy = healthy
+
+    def stats(self):
+        return {replica.url: replica.stats() for replica in self.replicas}
+
+
+def configured_backends():
+    """The AI service replicas from AI_SITES, or AI_SITE alone."""
+    return [url.strip() for url in settings.AI_SITES.split(",") if url.strip()] or [settings.AI_SITE]
+
+
+backend_router = BackendRouter(
+    urls=configured_backends(),
+    strategy=settings.AI_ROUTING_STRATEGY,
+    pin_companies=settings.AI_ROUTING_PIN_COMPANIES,
+    failure_threshold=settings.AI_ROUTING_FAILURE_THRESHOLD,
+    drain_seconds=settings.AI_ROUTING_DRAIN_SECONDS,
+    health_interval=settings.AI_HEALTH_CHECK_INTERVAL,
+    health_path=settings.AI_HEALTH_CHECK_PATH,
+)
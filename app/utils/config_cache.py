@@ -0,0 +1,116 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+class ConfigCache:
+    """
+    Read-through cache of per-company configuration documents (AI settings,
+    AI info, appearance), keyed by collection name and company.
+
+    Documents are kept for ``ttl`` seconds and missing ones (``None``) for
+    ``negative_ttl``, in an LRU of ``max_entries``. Concurrent misses on the
+    same key share one load, and a load that started before an
+    ``invalidate`` of its key is returned to its callers but not cached, so
+    a POST is never undone by a read that raced it. Callers get their own
+    copy of the document.
+    """
+
+    def __init__(self, ttl, negative_ttl, max_entries, enabled=True):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()  # (kind, key) -> (expires_at, document or None)
+        self._loading = {}  # (kind, key) -> future
+        self._stale = set()  # (kind, key) of loads in flight that were invalidated since they started
+        self.counters = {}  # kind -> {"hits", "negative_hits", "misses", "coalesced"}
+
+    async def get(self, kind, key, load):
+        """The document of ``kind`` for ``key``, calling ``load()`` when it is not cached."""
+        if not self.enabled:
+            return await load()
+        cache_key = (kind, str(key))
+        counters = self._counters(kind)
+
+        entry = self._entries.get(cache_key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(cache_key)
+            counters["hits" if entry[1] is not None else "negative_hits"] += 1
+            return copy.deepcopy(entry[1])
+
+        future = self._loading.get(cache_key)
+        if future is not None:
+            counters["coalesced"] += 1
+            return copy.deepcopy(await asyncio.shield(future))
+
+        counters["misses"] += 1
+        future = self._loading[cache_key] = asyncio.get_running_loop().create_future()
+        try:
+            document = await load()
+        except BaseException as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved when no other caller waited
+            future.exception()
+            raise
+        else:
+            future.set_result(document)
+            if cache_key not in self._stale:
+                self._store(cache_key, document)
+        finally:
+            self._loading.pop(cache_key, None)
+            self._stale.discard(cache_key)
+        return copy.deepcopy(document)
+
+    def _store(self, cache_key, document):
+        ttl = self.ttl if document is not None else self.negative_ttl
+        self._entries[cache_key] = (time.monotonic() + ttl, copy.deepcopy(document))
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, kind, key, document):
+        """Caches a document the caller just wrote, e.g. defaults created for a missing one."""
+        if not self.enabled:
+            return
+        self.invalidate(kind, key)
+        self._store((kind, str(key)), document)
+
+    def invalidate(self, kind, key):
+        cache_key = (kind, str(key))
+        self._entries.pop(cache_key, None)
+        if cache_key in self._loading:
+            self._stale.add(cache_key)
+
+    def invalidate_kind(self, kind):
+        for cache_key in [key for key in [*self._entries, *self._loading] if key[0] == kind]:
+            self.invalidate(*cache_key)
+
+    def clear(self):
+        for cache_key in [*self._entries, *self._loading]:
+            self.invalidate(*cache_key)
+
+    def _counters(self, kind):
+        counters = self.counters.get(kind)
+        if counters is None:
+            counters = self.counters[kind] = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0}
+        return counters
+
+    def stats(self):
+        kinds = {}
+        for kind, counters in self.counters.items():
+            served = sum(counters.values())
+            hits = counters["hits"] + counters["negative_hits"]
+            kinds[kind] = {**counters, "hit_rate": hits / served if served else 0.0}
+        return {"entries": len(self._entries), "loading": len(self._loading), "kinds": kinds}
+
+
+config_cache = ConfigCache(
+    ttl=settings.AI_CONFIG_CACHE_TTL,
+    negative_ttl=settings.AI_CONFIG_CACHE_NEGATIVE_TTL,
+    max_entries=settings.AI_CONFIG_CACHE_MAX_ENTRIES,
+    enabled=settings.AI_CONFIG_CACHE_ENABLED,
+)
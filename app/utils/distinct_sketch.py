@@ -0,0 +1,60 @@
+import hashlib
+import math
+
+# Fixed for all stored data: sketches are only mergeable with the same registers
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+
+def register_of(value):
+    """(register index, rank) of a value, hashed the same way in every process."""
+    digest = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+    index = digest >> (64 - PRECISION)
+    remainder = digest & ((1 << (64 - PRECISION)) - 1)
+    return index, 64 - PRECISION - remainder.bit_length() + 1
+
+
+class DistinctSketch:
+    """
+    Mergeable distinct count (HyperLogLog) of the users of a rollup bucket.
+
+    Each value sets register ``index`` to at least its ``rank``, so sketches
+    of different hours, days, languages or channels merge by taking the
+    maximum of each register, which Mongo does with ``$max``. Counts are
+    within about STANDARD_ERROR (3%) and near exact while small; storage is
+    at most REGISTERS small integers however many users a bucket sees. Only
+    non-empty registers are kept, as a ``{"index": rank}`` mapping that is
+    stored as is in Mongo.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = {}
+        if registers:
+            for index, rank in registers.items():
+                self.registers[int(index)] = max(self.registers.get(int(index), 0), rank)
+
+    def add(self, value):
+        index, rank = register_of(value)
+        if rank > self.registers.get(index, 0):
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for index, rank in other.registers.items():
+            if rank > self.registers.get(index, 0):
+                self.registers[index] = rank
+
+    @property
+    def count(self):
+        if not self.registers:
+            return 0
+        zeros = REGISTERS - len(self.registers)
+        estimate = ALPHA * REGISTERS ** 2 / (zeros + sum(2.0 ** -rank for rank in self.registers.values()))
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Linear counting is more accurate while most registers are empty
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def document(self):
+        return {str(index): rank for index, rank in self.registers.items()}
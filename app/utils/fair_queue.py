@@ -0,0 +1,162 @@
+import time
+from collections import OrderedDict, deque
+
+
+class Tenant:
+    """Scheduling state and counters of one company."""
+
+    def __init__(self, weight, max_in_flight):
+        self.weight = weight
+        self.max_in_flight = max_in_flight  # 0 for no per-company cap
+        self.waiters = deque()
+        self.in_flight = 0
+        self.last_finish = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def idle(self):
+        return not self.waiters and not self.in_flight
+
+    def can_start(self):
+        return not self.max_in_flight or self.in_flight < self.max_in_flight
+
+    def stats(self):
+        return {
+            "weight": self.weight,
+            "queued": len(self.waiters),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "mean_wait_seconds": self.wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class Waiter:
+    def __init__(self, key, future, start, finish):
+        self.key = key
+        self.future = future
+        self.start = start
+        self.finish = finish
+        self.enqueued_at = time.monotonic()
+
+
+class FairQueue:
+    """
+    Weighted fair queue of callers waiting for an AI service slot, keyed by
+    company.
+
+    Each waiter gets a virtual finish time of ``max(now, company's last
+    finish) + 1 / weight`` and free slots go to the smallest finish time
+    among companies below their concurrency cap. A company with twice the
+    weight is served twice as often while both are backlogged, and a company
+    that floods the queue only lengthens its own wait.
+
+    Only companies with queued or running calls are scheduled. A company
+    that ``settle`` finds idle moves to an LRU of ``max_idle`` companies
+    kept for their counters, so the companies tracked stay bounded however
+    many ids callers send. Companies with a configured weight or cap are
+    always kept.
+    """
+
+    def __init__(self, default_weight=1.0, weights=None, default_max_in_flight=0, max_in_flight=None, max_idle=100):
+        self.default_weight = default_weight
+        self.weights = weights or {}
+        self.default_max_in_flight = default_max_in_flight
+        self.max_in_flight = max_in_flight or {}
+        self.max_idle = max_idle
+        self.tenants = {}  # companies with waiters or calls in flight
+        self.idle = OrderedDict()  # companyId -> Tenant, least recently used first
+        self.virtual_time = 0.0
+        self.queued = 0
+
+    def tenant(self, key):
+        key = str(key)
+        tenant = self.tenants.get(key)
+        if tenant is None:
+            tenant = self.idle.pop(key, None)
+            if tenant is None:
+                tenant = Tenant(
+                    float(self.weights.get(key, self.default_weight)),
+                    int(self.max_in_flight.get(key, self.default_max_in_flight)),
+                )
+            self.tenants[key] = tenant
+        return tenant
+
+    def settle(self, key):
+        """Stops scheduling a company that has nothing queued or running."""
+        key = str(key)
+        tenant = self.tenants.get(key)
+        if tenant is None or not tenant.idle() or key in self.weights or key in self.max_in_flight:
+            return
+        del self.tenants[key]
+        self.idle[key] = tenant
+        while len(self.idle) > self.max_idle:
+            self.idle.popitem(last=False)
+
+    def enqueue(self, key, future):
+        tenant = self.tenant(key)
+        start = max(self.virtual_time, tenant.last_finish)
+        tenant.last_finish = start + 1 / tenant.weight
+        waiter = Waiter(str(key), future, start, tenant.last_finish)
+        tenant.waiters.append(waiter)
+        self.queued += 1
+        return waiter
+
+    def discard(self, waiter):
+        tenant = self.tenant(waiter.key)
+        if waiter in tenant.waiters:
+            tenant.waiters.remove(waiter)
+            self.queued -= 1
+
+    def pop_next(self):
+        """Removes and returns the waiter to serve next, or None if no company may start."""
+        best = None
+        for tenant in self.tenants.values():
+            while tenant.waiters and tenant.waiters[0].future.done():
+                tenant.waiters.popleft()
+                self.queued -= 1
+            if tenant.waiters and tenant.can_start():
+                if best is None or tenant.waiters[0].finish < best.waiters[0].finish:
+                    best = tenant
+        if best is None:
+            return None
+        waiter = best.waiters.popleft()
+        self.queued -= 1
+        self.virtual_time = waiter.start
+        return waiter
+
+    def noisiest(self):
+        """The company with the most queued callers relative to its weight."""
+        backlogged = [tenant for tenant in self.tenants.values() if tenant.waiters]
+        if not backlogged:
+            return None
+        return max(backlogged, key=lambda tenant: len(tenant.waiters) / tenant.weight)
+
+    def stats(self):
+        return {key: tenant.stats() for key, tenant in {**self.idle, **self.tenants}.items()}
+
+    def prometheus(self):
+        """Renders per-company queue depth and wait time in the Prometheus text format."""
+        metrics = (
+            ("ai_upstream_queue_depth", "gauge", "Calls waiting for an AI service slot.",
+             lambda tenant: len(tenant.waiters)),
+            ("ai_upstream_in_flight", "gauge", "AI service calls in progress.",
+             lambda tenant: tenant.in_flight),
+            ("ai_upstream_wait_seconds_total", "counter", "Time admitted calls waited for a slot.",
+             lambda tenant: tenant.wait_seconds),
+            ("ai_upstream_admitted_total", "counter", "Calls admitted to the AI service.",
+             lambda tenant: tenant.admitted),
+            ("ai_upstream_shed_total", "counter", "Calls rejected before reaching the AI service.",
+             lambda tenant: tenant.shed + tenant.timed_out),
+        )
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key, tenant in sorted({**self.idle, **self.tenants}.items()):
+                lines.append(f'{name}{{company="{key}"}} {value(tenant)}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,197 @@
+import asyncio
+import copy
+import time
+from collections import Counter, OrderedDict
+
+from app.core.config import settings
+from app.utils.answer_cache import normalize_question
+from app.utils.config_cache import config_cache
+
+
+def trigrams(text):
+    """Character trigrams of a normalized question, padded so word edges count."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def within_one_edit(first, second):
+    """Whether two words differ by at most one inserted, deleted or substituted character."""
+    if abs(len(first) - len(second)) > 1:
+        return False
+    if len(first) > len(second):
+        first, second = second, first
+    for index, (a, b) in enumerate(zip(first, second)):
+        if a != b:
+            skipped = first[index:] if len(first) < len(second) else first[index + 1:]
+            return skipped == second[index + 1:]
+    return True
+
+
+def same_wording(question, inquiry):
+    """
+    Whether a normalized question says what the inquiry says, up to typos:
+    word for word, with one-character slips only in words of five or more
+    letters. An added "not", a changed place or number is a different
+    question, however many trigrams it shares.
+    """
+    question_words, inquiry_words = question.split(), inquiry.split()
+    if len(question_words) != len(inquiry_words):
+        return False
+    for word, expected in zip(question_words, inquiry_words):
+        if word == expected:
+            continue
+        if min(len(word), len(expected)) < 5 or any(c.isdigit() for c in word + expected):
+            return False
+        if not within_one_edit(word, expected):
+            return False
+    return True
+
+
+class CompanyFaq:
+    """
+    Similarity index over one company's ``commonInquiries``.
+
+    Inquiries are matched on their normalized text first, then on the Dice
+    coefficient of their character trigrams, found through an inverted index
+    so only inquiries sharing a trigram with the question are scored.
+    Answers are learned per inquiry and language from the AI service.
+    """
+
+    def __init__(self, inquiries):
+        self.inquiries = [inquiry for inquiry in inquiries if normalize_question(inquiry)]
+        self._exact = {}
+        self._grams = []
+        self._postings = {}
+        for index, inquiry in enumerate(self.inquiries):
+            normalized = normalize_question(inquiry)
+            self._exact.setdefault(normalized, index)
+            grams = trigrams(normalized)
+            self._grams.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(index)
+        self.answers = {}  # (inquiry index, lang) -> (expires_at, answer)
+
+    def is_inquiry(self, index, question):
+        return normalize_question(self.inquiries[index]) == normalize_question(question)
+
+    def match(self, question):
+        """Returns (inquiry index, score) of the closest inquiry, or (None, 0.0)."""
+        normalized = normalize_question(question)
+        index = self._exact.get(normalized)
+        if index is not None:
+            return index, 1.0
+        grams = trigrams(normalized)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        if not shared:
+            return None, 0.0
+        score, index = max((2 * count / (len(grams) + self._grams[index]), index) for index, count in shared.items())
+        return index, score
+
+
+class FaqIndex:
+    """
+    Local fast path for the questions each company lists in its AI info.
+
+    A question that matches a common inquiry with at least ``min_score``
+    similarity and the same wording up to typos is answered with what the AI
+    service last answered for that inquiry in the same language, for up to
+    ``answer_ttl`` seconds. Answers are only learned from the inquiry asked
+    word for word, so a similar but different question never replaces one.
+    Indexes
+    are built in the background the first time a company is seen, so a
+    lookup never waits on the database, and are dropped with
+    ``invalidate_company`` when the company's AI info or settings change.
+    """
+
+    def __init__(self, min_score, answer_ttl, max_companies):
+        self.min_score = min_score
+        self.answer_ttl = answer_ttl
+        self.max_companies = max_companies
+        self._companies = OrderedDict()  # companyId -> CompanyFaq
+        self._loading = {}  # companyId -> task
+        self.hits = 0
+        self.matches = 0
+        self.misses = 0
+        self.learned = 0
+
+    def lookup(self, db, company_id, lang, question):
+        """
+        Returns (inquiry index, answer) for a confident match; the answer is
+        None until one has been learned. Returns (None, None) otherwise.
+        """
+        company_id = str(company_id)
+        faq = self._companies.get(company_id)
+        if faq is None:
+            self._load(db, company_id)
+            return None, None
+        self._companies.move_to_end(company_id)
+
+        index, score = faq.match(question)
+        if index is None or score < self.min_score or not same_wording(
+            normalize_question(question), normalize_question(faq.inquiries[index])
+        ):
+            self.misses += 1
+            return None, None
+        self.matches += 1
+        entry = faq.answers.get((index, (lang or "").upper()))
+        if entry is None or entry[0] <= time.monotonic():
+            return index, None
+        self.hits += 1
+        answer = copy.deepcopy(entry[1])
+        answer["question"] = question
+        return index, answer
+
+    def learn(self, company_id, index, lang, question, answer):
+        """Keeps ``answer`` for the inquiry if ``question`` is that inquiry, word for word."""
+        faq = self._companies.get(str(company_id))
+        if faq is None or index >= len(faq.inquiries) or not faq.is_inquiry(index, question):
+            return
+        faq.answers[(index, (lang or "").upper())] = (time.monotonic() + self.answer_ttl, copy.deepcopy(answer))
+        self.learned += 1
+
+    def invalidate_company(self, company_id):
+        company_id = str(company_id)
+        self._companies.pop(company_id, None)
+        task = self._loading.pop(company_id, None)
+        if task is not None:
+            task.cancel()
+
+    def clear(self):
+        for company_id in [*self._companies, *self._loading]:
+            self.invalidate_company(company_id)
+
+    def _load(self, db, company_id):
+        if company_id not in self._loading:
+            self._loading[company_id] = asyncio.create_task(self._build(db, company_id))
+
+    async def _build(self, db, company_id):
+        try:
+            document = await config_cache.get("Company", company_id, lambda: db["Company"].find_one(
+                {"companyId": company_id}
+            ))
+            self._companies[company_id] = CompanyFaq((document or {}).get("commonInquiries") or [])
+            while len(self._companies) > self.max_companies:
+                self._companies.popitem(last=False)
+        except Exception as e:
+            print(f"FAQ index for company {company_id} could not be built: {e}")
+        finally:
+            self._loading.pop(company_id, None)
+
+    def stats(self):
+        return {
+            "companies": len(self._companies),
+            "inquiries": sum(len(faq.inquiries) for faq in self._companies.values()),
+            "hits": self.hits,
+            "matches": self.matches,
+            "misses": self.misses,
+            "learned": self.learned,
+        }
+
+
+faq_index = FaqIndex(
+    min_score=settings.AI_FAQ_MIN_SCORE,
+    answer_ttl=settings.AI_FAQ_ANSWER_TTL,
+    max_companies=settings.AI_FAQ_MAX_COMPANIES,
+)
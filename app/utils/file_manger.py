@@ -1,7 +1,50 @@
-import os
+import base64
+import binascii
+import re
+import tempfile
 
-def save_audio_file(audio_data):
-    file_path = "output.wav"
-    with open(file_path, "wb") as f:
-        f.write(audio_data)
-    return file_path
\ No newline at end of file
+from app.core.config import settings
+
+# Base64 characters decoded per step when spilling; must stay a multiple of 4
+DECODE_CHUNK_CHARS = 4 * 64 * 1024
+# Line breaks and anything else b64decode would skip
+NON_BASE64 = re.compile(r"[^A-Za-z0-9+/=]")
+
+
+def decode_audio(wav_data: str):
+    """
+    Decodes base64 audio without touching a shared file on disk.
+
+    Small clips are returned as bytes. Clips larger than AI_AUDIO_SPILL_BYTES
+    are decoded chunk by chunk into a private temporary file, which is removed
+    as soon as it is closed. Like b64decode, characters outside the base64
+    alphabet (e.g. MIME line breaks) are ignored.
+
+    :param wav_data: The base64 encoded audio.
+    :return: The decoded audio as bytes or as a binary file object at offset 0.
+    """
+    if len(wav_data) // 4 * 3 <= settings.AI_AUDIO_SPILL_BYTES:
+        return base64.b64decode(wav_data)
+
+    audio_file = tempfile.TemporaryFile()
+    try:
+        # Characters past the last whole quad wait for the next chunk
+        pending = ""
+        for start in range(0, len(wav_data), DECODE_CHUNK_CHARS):
+            chunk = pending + NON_BASE64.sub("", wav_data[start:start + DECODE_CHUNK_CHARS])
+            whole = len(chunk) // 4 * 4
+            audio_file.write(binascii.a2b_base64(chunk[:whole]))
+            pending = chunk[whole:]
+        if pending:
+            audio_file.write(binascii.a2b_base64(pending))
+    except Exception:
+        audio_file.close()
+        raise
+    audio_file.seek(0)
+    return audio_file
+
+
+def close_audio(audio):
+    """Releases the temporary file behind a decoded clip, if there is one."""
+    if hasattr(audio, "close"):
+        audio.close()
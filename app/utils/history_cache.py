@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+def _estimate_size(documents):
+    """Rough in-memory footprint of a history window, in bytes."""
+    return sum(len(str(document)) for document in documents)
+
+
+class HistoryCache:
+    """
+    In-process LRU cache of recent conversation windows keyed by
+    (companyId, userId).
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once either ``max_entries`` or ``max_bytes`` is exceeded. The cache
+    is only touched from the event loop, so it needs no locking.
+
+    A window read from the database is only stored if its conversation was
+    not appended to or invalidated since the read began, as told by the
+    ``generation`` taken before it; otherwise a turn stored during the read
+    would be missing from the cached window until it expires.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, documents)
+        self._bytes = 0
+        self._clock = 0
+        self._changed = OrderedDict()  # key -> clock of its last append or invalidate, oldest first
+        self._forgotten = 0  # Latest clock dropped from _changed
+        self.stale_fills = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(company_id, user_id):
+        return str(company_id), str(user_id)
+
+    def get(self, company_id, user_id):
+        """Returns a copy of the cached window, or None on a miss."""
+        key = self.key(company_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(entry[2])
+
+    def generation(self):
+        """Taken before a database read and passed to ``put`` with its result."""
+        return self._clock
+
+    def put(self, company_id, user_id, documents, generation=None):
+        """Stores a window as read from the database, oldest turn first."""
+        key = self.key(company_id, user_id)
+        if generation is not None and max(self._changed.get(key, 0), self._forgotten) > generation:
+            self.stale_fills += 1
+            return
+        self._remove(key)
+        size = _estimate_size(documents)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, size, list(documents))
+        self._bytes += size
+        self._evict()
+
+    def append(self, company_id, user_id, document, max_turns=0):
+        """
+        Write-through of a newly stored turn. Only windows already in the cache
+        are updated, so a partial history is never served.
+        """
+        key = self.key(company_id, user_id)
+        self._touch(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        documents = entry[2] + [document]
+        if max_turns > 0:
+            documents = documents[-max_turns:]
+        self.put(company_id, user_id, documents)
+
+    def invalidate(self, company_id, user_id):
+        key = self.key(company_id, user_id)
+        self._touch(key)
+        self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._changed.clear()
+        self._clock += 1
+        self._forgotten = self._clock
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_fills": self.stale_fills,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _touch(self, key):
+        self._clock += 1
+        self._changed[key] = self._clock
+        self._changed.move_to_end(key)
+        # Only recent changes are kept; reads older than a dropped one are not stored
+        while len(self._changed) > self.max_entries:
+            _, clock = self._changed.popitem(last=False)
+            self._forgotten = clock
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+
+history_cache = HistoryCache(
+    max_entries=settings.AI_HISTORY_CACHE_MAX_ENTRIES,
+    max_bytes=settings.AI_HISTORY_CACHE_MAX_BYTES,
+    ttl=settings.AI_HISTORY_CACHE_TTL,
+)
@@ -1,33 +1,144 @@
+import codecs
+import json
+
 import aiohttp
 
-import requests
-import json
-import os
-
-def send_request(url, file_path=None, lang=None, user_messages=None, payload=None):
-    if file_path:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-
-        # Prepare multipart/form-data with file
-        with open(file_path, 'rb') as f:
-            files = {
-                'file': ('output.wav', f, 'audio/wav')
-            }
-            data = {
-                'lang': lang,
-                'user_messages': json.dumps(user_messages)
-            }
-
-            response = requests.post(url, files=files, data=data)
-            response.raise_for_status()
-            return response.json()
+from app.core.config import settings
+from app.utils.backend_router import backend_router
+from app.utils.request_policy import request_policy
+from app.utils.timing import stage
+
+# Global connection pool shared by every request handled by this worker
+session = None
+
+
+async def init_http_client():
+    """Open the pooled HTTP session used for calls to the AI service."""
+    global session
+    connector = aiohttp.TCPConnector(
+        limit=settings.AI_HTTP_POOL_LIMIT,
+        limit_per_host=settings.AI_HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=settings.AI_HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.AI_HTTP_TIMEOUT,
+        connect=settings.AI_HTTP_CONNECT_TIMEOUT,
+    )
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        # Conversation history carries ObjectIds and datetimes
+        json_serialize=lambda obj: json.dumps(obj, default=str),
+    )
+    print("HTTP client pool opened")
+
+
+async def close_http_client():
+    """Close the pooled HTTP session."""
+    global session
+    if session:
+        await session.close()
+        session = None
+        print("HTTP client pool closed")
+
+
+async def get_http_session():
+    # Open the pool lazily when the app runs without its lifespan (e.g. tests)
+    if session is None or session.closed:
+        await init_http_client()
+    return session
+
+
+async def send_request(path, audio=None, lang=None, user_messages=None, payload=None, company_id=None):
+    """
+    Posts to an AI service endpoint, e.g. "/get_answer/", and returns the JSON
+    answer. Each attempt (first try, hedge or retry) is routed to a replica
+    by the backend router, avoiding the replicas already tried.
+    """
+    http = await get_http_session()
+    endpoint = endpoint_name(path)
+    tried = []
+
+    async def send(**kwargs):
+        replica = backend_router.pick(company_id, exclude=tried)
+        tried.append(replica)
+        async with backend_router.track(replica, timeout=request_policy.timeout(endpoint)):
+            return await post_json(http, replica.url + path, **kwargs)
+
+    if audio is not None:
+        # Bytes can be sent any number of times, at once; a file can be sent
+        # again from where it started, but only one upload may read it at a time
+        replayable = isinstance(audio, (bytes, bytearray)) or hasattr(audio, "seek")
+        hedgeable = isinstance(audio, (bytes, bytearray))
+        position = audio.tell() if hasattr(audio, "seek") else None
+        messages = json.dumps(user_messages, default=str)
+
+        def send_audio():
+            if position is not None:
+                audio.seek(position)
+            # Prepare multipart/form-data straight from the clip; bytes, file objects and
+            # async chunk iterables are all streamed by aiohttp without an extra copy
+            data = aiohttp.FormData()
+            data.add_field('file', audio, filename='output.wav', content_type='audio/wav')
+            data.add_field('lang', lang)
+            data.add_field('user_messages', messages)
+            return send(data=data)
+
+        return await request_policy.run(endpoint, send_audio, replayable=replayable, hedgeable=hedgeable)
 
     elif payload:
-        headers = {'Content-Type': 'application/json'}
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return await request_policy.run(endpoint, lambda: send(json=payload))
 
     else:
-        raise ValueError("Either file_path or payload must be provided")
+        raise ValueError("Either audio or payload must be provided")
+
+
+def endpoint_name(path):
+    """The AI service endpoint a path calls, e.g. "process_voice" for /process_voice/<companyId>."""
+    return path.strip("/").split("/")[0]
+
+
+async def post_json(http, url, **kwargs):
+    # "upstream" runs until the response headers arrive, "upstream_read" covers the body
+    with stage("upstream"):
+        response = await http.post(url, **kwargs)
+    async with response:
+        response.raise_for_status()
+        with stage("upstream_read"):
+            return await response.json()
+
+
+async def stream_request(path, payload, company_id=None):
+    """
+    Posts a JSON payload to an AI service endpoint and yields the response
+    body as text chunks, as the AI service produces them.
+    """
+    http = await get_http_session()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    endpoint = endpoint_name(path)
+    tried = []
+
+    async def open_stream():
+        replica = backend_router.pick(company_id, exclude=tried)
+        tried.append(replica)
+        # Tracked until the first byte, which is what the timeout covers
+        async with backend_router.track(replica, timeout=request_policy.timeout(endpoint)):
+            response = await http.post(replica.url + path, json=payload)
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError:
+                response.release()
+                raise
+            return response
+
+    # The adaptive timeout and retries cover the wait for the first byte; the
+    # answer itself is not replayed once it has started
+    response = await request_policy.run(endpoint, open_stream, hedgeable=False)
+    async with response:
+        async for chunk in response.content.iter_any():
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
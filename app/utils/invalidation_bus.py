@@ -0,0 +1,196 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.core.config import settings
+from app.utils.answer_cache import answer_cache
+from app.utils.config_cache import config_cache
+from app.utils.faq_index import faq_index
+
+# Watched collections and the field holding their company id
+WATCHED = {"ai_setting": "companyId", "Company": "companyId", "appearance": "company_id", "changes": "companyId"}
+# Collections whose documents the config cache holds
+CONFIG_KINDS = ("ai_setting", "Company", "appearance")
+# Collections answers are produced from: settings, company info and the agent's changes
+ANSWER_SOURCES = ("ai_setting", "Company", "changes")
+
+VERSION_COLLECTION = "cache_versions"
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+def evict(kind, company_id):
+    """Drops what this worker caches from ``kind`` documents of a company, or of every company for None."""
+    if company_id is None:
+        if kind in CONFIG_KINDS:
+            config_cache.invalidate_kind(kind)
+        if kind in ANSWER_SOURCES:
+            answer_cache.clear()
+            faq_index.clear()
+        return
+    if kind in CONFIG_KINDS:
+        config_cache.invalidate(kind, company_id)
+    if kind in ANSWER_SOURCES:
+        answer_cache.invalidate_company(company_id)
+        faq_index.invalidate_company(company_id)
+
+
+class InvalidationBus:
+    """
+    Evicts cached company data in every worker when the documents it came
+    from change.
+
+    With ``mode`` "change_stream" each worker tails a change stream of the
+    watched collections, so writes from any worker, node or script are
+    seen. Change streams need a replica set; with "polling" (or "auto" on a
+    standalone mongod) writers stamp ``cache_versions`` through ``publish``
+    and each worker polls it every ``poll_interval`` seconds. Polls overlap
+    by a few intervals, as evicting twice is harmless and missing a stamp
+    written late is not. A stream that cannot resume evicts everything.
+    """
+
+    def __init__(self, mode, poll_interval):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.active_mode = None
+        self.db = None
+        self._task = None
+        self.events = 0
+        self.evictions = 0
+        self.errors = 0
+
+    async def start(self, db):
+        if self.mode == "off" or self._task is not None:
+            return
+        self.db = db
+        self.active_mode = self.mode
+        if self.mode == "auto":
+            self.active_mode = "change_stream" if await self._supports_change_streams() else "polling"
+        run = self._tail if self.active_mode == "change_stream" else self._poll
+        self._task = asyncio.create_task(run())
+        print(f"Cache invalidation bus started ({self.active_mode})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, kind, company_id):
+        """
+        Called after writing a watched document: evicts it here at once and,
+        in polling mode, stamps it for the other workers.
+        """
+        self._evict(kind, company_id)
+        if self.active_mode != "polling":
+            return
+        try:
+            await self.db[VERSION_COLLECTION].update_one(
+                {"_id": f"{kind}:{company_id}"},
+                {"$set": {"kind": kind, "key": str(company_id)}, "$inc": {"version": 1},
+                 "$currentDate": {"updated_at": True}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            self.errors += 1
+            print(f"Cache invalidation stamp for {kind} {company_id} failed: {e}")
+
+    def _evict(self, kind, company_id):
+        evict(kind, company_id)
+        self.evictions += 1
+
+    async def _supports_change_streams(self):
+        try:
+            hello = await self.db.command("isMaster")
+        except (PyMongoError, AttributeError, NotImplementedError):
+            return False
+        # Replica set members report their set name, mongos reports msg "isdbgrid"
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    def _pipeline(self):
+        return [{"$match": {
+            "ns.coll": {"$in": list(WATCHED)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+
+    async def _tail(self):
+        resume_token = None
+        while True:
+            try:
+                async with self.db.watch(
+                    self._pipeline(), full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.events += 1
+                        self._on_change(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.errors += 1
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    print("Change streams need a replica set, polling cache versions instead")
+                    self.active_mode = "polling"
+                    return await self._poll()
+                # The stream fell off the oplog: events were missed, forget everything
+                print(f"Cache invalidation stream lost its position, evicting all: {e}")
+                resume_token = None
+                for kind in WATCHED:
+                    self._evict(kind, None)
+                await asyncio.sleep(self.poll_interval)
+            except PyMongoError as e:
+                self.errors += 1
+                print(f"Cache invalidation stream interrupted, resuming: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _on_change(self, change):
+        kind = change["ns"]["coll"]
+        document = change.get("fullDocument")
+        if document is None or WATCHED[kind] not in document:
+            # Deleted (or deleted since the update): only the _id is known
+            self._evict(kind, None)
+        else:
+            self._evict(kind, document[WATCHED[kind]])
+
+    async def _poll(self):
+        collection = self.db[VERSION_COLLECTION]
+        # Stamps are dated by the server; only changes from now on matter
+        since = await self._server_time()
+        overlap = timedelta(seconds=max(2.0, 3 * self.poll_interval))
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                now = await self._server_time()
+                async for stamp in collection.find({"updated_at": {"$gte": since - overlap}}):
+                    self.events += 1
+                    self._evict(stamp["kind"], stamp["key"])
+                since = now
+            except PyMongoError as e:
+                self.errors += 1
+                print(f"Cache invalidation poll failed: {e}")
+
+    async def _server_time(self):
+        try:
+            return (await self.db.command("isMaster"))["localTime"]
+        except (PyMongoError, KeyError, AttributeError, NotImplementedError):
+            return datetime.utcnow()
+
+    def stats(self):
+        return {
+            "mode": self.active_mode,
+            "running": self._task is not None,
+            "events": self.events,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+# Started in the app lifespan; until then publish only evicts this worker's caches
+invalidation_bus = InvalidationBus(
+    mode=settings.AI_INVALIDATION_MODE,
+    poll_interval=settings.AI_INVALIDATION_POLL_INTERVAL,
+)
@@ -0,0 +1,87 @@
+import math
+
+# Fixed for all stored data: sketches are only mergeable with the same buckets
+MIN_LATENCY = 0.001  # Seconds, anything faster shares the first bucket
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Upper bounds, in seconds, of the histogram returned by the dashboard
+HISTOGRAM_BOUNDS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, math.inf)
+
+
+def bucket_index(seconds):
+    if seconds <= MIN_LATENCY:
+        return 0
+    return math.ceil(math.log(seconds / MIN_LATENCY) / LOG_GAMMA)
+
+
+def bucket_value(index):
+    """The value reported for a bucket, within RELATIVE_ACCURACY of everything in it."""
+    if index == 0:
+        return MIN_LATENCY
+    return MIN_LATENCY * 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LatencySketch:
+    """
+    Mergeable latency distribution with logarithmic buckets.
+
+    Bucket ``i`` counts latencies in ``(MIN_LATENCY * GAMMA**(i-1),
+    MIN_LATENCY * GAMMA**i]``, so any percentile is known to within
+    RELATIVE_ACCURACY (2%) whatever the range of values, and sketches of
+    different hours, days, languages or channels merge by adding counts.
+    A few hundred buckets cover 1ms to 10 minutes; only non-empty ones are
+    kept, as a ``{"index": count}`` mapping that is stored as is in Mongo.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = {}
+        if counts:
+            for index, count in counts.items():
+                self.counts[int(index)] = self.counts.get(int(index), 0) + count
+
+    def add(self, seconds, count=1):
+        index = bucket_index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def document(self):
+        return {str(index): count for index, count in self.counts.items()}
+
+    def percentiles(self, shares):
+        """Latency below which each of ``shares`` of the values fell, None when empty."""
+        total = self.count
+        if not total:
+            return [None] * len(shares)
+        ranks = sorted((min(total - 1, int(share * total)), position) for position, share in enumerate(shares))
+        results = [None] * len(shares)
+        seen = 0
+        pending = iter(ranks)
+        rank, position = next(pending)
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while rank < seen:
+                results[position] = bucket_value(index)
+                try:
+                    rank, position = next(pending)
+                except StopIteration:
+                    return results
+        return results
+
+    def histogram(self, bounds=HISTOGRAM_BOUNDS):
+        """Counts per ``(previous bound, bound]`` interval; the open-ended last one has ``le`` None."""
+        counts = [0] * len(bounds)
+        for index, count in self.counts.items():
+            value = bucket_value(index)
+            counts[next(position for position, bound in enumerate(bounds) if value <= bound)] += count
+        return [
+            {"le": None if math.isinf(bound) else bound, "count": count} for bound, count in zip(bounds, counts)
+        ]
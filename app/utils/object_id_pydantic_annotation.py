@@ -48,18 +48,17 @@ class PyObjectId:
     def __get_pydantic_core_schema__(
         cls, source_type: Any, handler: Any
     ) -> core_schema.CoreSchema:
-        return core_schema.no_info_after_validator_function(
+        # ObjectIds read from Mongo and valid strings are both accepted; JSON output is the hex string
+        return core_schema.no_info_plain_validator_function(
             cls.validate,
-            core_schema.str_schema()
+            serialization=core_schema.plain_serializer_function_ser_schema(str, when_used="json"),
         )
 
     @classmethod
     def __get_pydantic_json_schema__(
         cls, schema: core_schema.CoreSchema, handler: GetJsonSchemaHandler
     ) -> Dict[str, Any]:
-        json_schema = handler(schema)
-        json_schema.update(type="string", example="507f1f77bcf86cd799439011")
-        return json_schema
+        return {"type": "string", "example": "507f1f77bcf86cd799439011"}
 
     @staticmethod
     def validate(v: Any) -> ObjectId:
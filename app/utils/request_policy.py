@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import aiohttp
+from fastapi import HTTPException
+
+from app.core.config import settings
+
+# Upstream answers that mean the request was not processed and can be sent again
+RETRYABLE_STATUSES = (502, 503, 504)
+
+
+class LatencyTracker:
+    """Recent latencies of one AI service endpoint."""
+
+    def __init__(self, window, min_samples):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, share):
+        """The latency below which ``share`` of recent calls fell, or None while warming up."""
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(len(self._sorted) - 1, int(share * len(self._sorted)))]
+
+
+def is_retryable(error):
+    """Failures after which the AI service cannot have produced an answer we kept."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class RequestPolicy:
+    """
+    Timeouts, hedging and retries for calls to the AI service.
+
+    Each endpoint's timeout is ``timeout_multiplier`` times its recent
+    ``timeout_percentile`` latency, kept between ``min_timeout`` and
+    ``max_timeout`` (the latter also applies until enough calls were seen).
+    A hedgeable call that is still running after the endpoint's
+    ``hedge_percentile`` latency is sent a second time and the first answer
+    wins; at most ``hedge_max_share`` of calls are hedged so an overloaded
+    service is not sent twice the traffic. Retryable failures of a replayable
+    call are retried up to ``max_retries`` times with full-jitter backoff.
+    """
+
+    def __init__(self, window, min_samples, timeout_percentile, timeout_multiplier, min_timeout, max_timeout,
+                 hedge_enabled, hedge_percentile, hedge_min_delay, hedge_max_share,
+                 max_retries, backoff_base, backoff_max):
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_share = hedge_max_share
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.trackers = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    def tracker(self, endpoint):
+        tracker = self.trackers.get(endpoint)
+        if tracker is None:
+            tracker = self.trackers[endpoint] = LatencyTracker(self.window, self.min_samples)
+        return tracker
+
+    def timeout(self, endpoint):
+        latency = self.tracker(endpoint).percentile(self.timeout_percentile)
+        if latency is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, latency * self.timeout_multiplier))
+
+    def hedge_delay(self, endpoint):
+        """Seconds after which a call is hedged, or None if it should not be."""
+        if not self.hedge_enabled or self.hedges >= self.hedge_max_share * max(1, self.calls):
+            return None
+        latency = self.tracker(endpoint).percentile(self.hedge_percentile)
+        return None if latency is None else max(self.hedge_min_delay, latency)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def run(self, endpoint, send, replayable=True, hedgeable=True):
+        """
+        Runs ``send()`` (a coroutine factory making one attempt) under the
+        policy. Calls that are not ``replayable`` get a timeout only.
+        """
+        self.calls += 1
+        attempt = 0
+        while True:
+            try:
+                if replayable and hedgeable:
+                    return await self._hedged(endpoint, send)
+                return await self._attempt(endpoint, send)
+            except Exception as e:
+                if not replayable or attempt >= self.max_retries or not is_retryable(e):
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise HTTPException(status_code=504, detail="AI service timed out")
+                    raise
+            self.retries += 1
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def _attempt(self, endpoint, send):
+        tracker = self.tracker(endpoint)
+        timeout = self.timeout(endpoint)
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout):
+                result = await send()
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # Counted at the timeout so a stuck service pushes the percentiles up
+            tracker.observe(timeout)
+            raise
+        tracker.observe(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, endpoint, send):
+        primary = asyncio.ensure_future(self._attempt(endpoint, send))
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.hedges += 1
+                hedge = asyncio.ensure_future(self._attempt(endpoint, send))
+                pending.add(hedge)
+            error = None
+            while done or pending:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+                done = set()
+                if pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            # The slower attempt is abandoned, its connection is closed by aiohttp
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "timeout_seconds": {endpoint: self.timeout(endpoint) for endpoint in self.trackers},
+        }
+
+
+request_policy = RequestPolicy(
+    window=settings.AI_LATENCY_WINDOW,
+    min_samples=settings.AI_LATENCY_MIN_SAMPLES,
+    timeout_percentile=settings.AI_TIMEOUT_PERCENTILE,
+    timeout_multiplier=settings.AI_TIMEOUT_MULTIPLIER,
+    min_timeout=settings.AI_TIMEOUT_MIN,
+    max_timeout=settings.AI_HTTP_TIMEOUT,
+    hedge_enabled=settings.AI_HEDGE_ENABLED,
+    hedge_percentile=settings.AI_HEDGE_PERCENTILE,
+    hedge_min_delay=settings.AI_HEDGE_MIN_DELAY,
+    hedge_max_share=settings.AI_HEDGE_MAX_SHARE,
+    max_retries=settings.AI_RETRY_MAX,
+    backoff_base=settings.AI_RETRY_BACKOFF_BASE,
+    backoff_max=settings.AI_RETRY_BACKOFF_MAX,
+)
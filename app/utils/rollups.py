@@ -0,0 +1,213 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.core.config import settings
+from app.utils.distinct_sketch import DistinctSketch
+from app.utils.latency_sketch import LatencySketch
+
+ROLLUP_COLLECTION = "AnalyticsRollup"
+GRANULARITIES = ("hour", "day")
+
+
+def bucket_start(time, granularity):
+    """Start of the hour or day ``time`` falls in."""
+    if granularity == "day":
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+class Bucket:
+    """Running totals of one (company, language, channel, granularity, bucket start)."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_process_time = 0.0
+        self.max_process_time = 0.0
+        self.users = DistinctSketch()
+        self.latency = LatencySketch()
+
+    @classmethod
+    def from_document(cls, document):
+        bucket = cls()
+        bucket.count = document.get("count", 0)
+        bucket.total_process_time = document.get("total_process_time", 0.0)
+        bucket.max_process_time = document.get("max_process_time", 0.0)
+        bucket.users = DistinctSketch(document.get("distinct_users"))
+        # Buckets written before the sketch kept every userId, until backfill_rollups replaces them
+        for user_id in document.get("users") or []:
+            bucket.users.add(user_id)
+        bucket.latency = LatencySketch(document.get("latency"))
+        return bucket
+
+    def document(self):
+        return {
+            "count": self.count,
+            "total_process_time": self.total_process_time,
+            "max_process_time": self.max_process_time,
+            "distinct_users": self.users.document(),
+            "latency": self.latency.document(),
+        }
+
+    def add(self, document):
+        process_time = (document.get("AIResponses") or {}).get("process_time")
+        self.count += 1
+        if process_time is not None:
+            self.total_process_time += process_time
+            self.max_process_time = max(self.max_process_time, process_time)
+            self.latency.add(process_time)
+        if document.get("userId") is not None:
+            self.users.add(document["userId"])
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_process_time += other.total_process_time
+        self.max_process_time = max(self.max_process_time, other.max_process_time)
+        self.users.merge(other.users)
+        self.latency.merge(other.latency)
+
+
+def bucket_keys(document):
+    lang = (document.get("lang") or "").upper()
+    # Turns stored before the channel was recorded are kept apart
+    channel = document.get("channel") or "unknown"
+    for granularity in GRANULARITIES:
+        yield document["companyId"], lang, channel, granularity, bucket_start(document["time"], granularity)
+
+
+def bucket_filter(key):
+    company_id, lang, channel, granularity, bucket = key
+    return {"companyId": company_id, "lang": lang, "channel": channel, "granularity": granularity, "bucket": bucket}
+
+
+class RollupRecorder:
+    """
+    Keeps the hourly and daily analytics rollups up to date as turns are stored.
+
+    ``record`` only adds the turn to in-memory buckets; every
+    ``flush_interval`` seconds each touched bucket is written with a single
+    upserted ``$inc``/``$max`` (the latency sketch's buckets are counters
+    and the distinct users sketch's registers maxima), so a busy company
+    costs one fixed-size update per bucket per flush rather than one per
+    turn.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.collection = None
+        self._pending = {}  # bucket key -> Bucket
+        self._task = None
+        self.turns_recorded = 0
+        self.buckets_written = 0
+        self.write_failures = 0
+        self.buckets_dropped = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self, collection):
+        self.collection = collection
+        self._task = asyncio.create_task(self._run())
+        print("Analytics rollups started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"Analytics rollups dropped {len(self._pending)} buckets on shutdown")
+            self._pending.clear()
+
+    def record(self, document):
+        """Adds a stored UserMessage document to its buckets; a no-op unless started."""
+        if not self.running:
+            return
+        for key in bucket_keys(document):
+            bucket = self._pending.get(key)
+            if bucket is None:
+                bucket = self._pending[key] = Bucket()
+            bucket.add(document)
+        self.turns_recorded += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Analytics rollup flush failed: {e!r}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch = list(self._pending.items())
+        self._pending = {}
+        requests = [
+            UpdateOne(
+                bucket_filter(key),
+                {
+                    "$inc": {
+                        "count": bucket.count,
+                        "total_process_time": bucket.total_process_time,
+                        **{f"latency.{index}": count for index, count in bucket.latency.document().items()},
+                    },
+                    "$max": {
+                        "max_process_time": bucket.max_process_time,
+                        **{f"distinct_users.{index}": rank for index, rank in bucket.users.document().items()},
+                    },
+                },
+                upsert=True,
+            )
+            for key, bucket in batch
+        ]
+        try:
+            await self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: only the reported buckets were not updated
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            self._requeue([batch[index] for index in failed])
+            self.buckets_written += len(batch) - len(failed)
+            self.write_failures += 1
+            print(f"Analytics rollup update rejected {len(failed)} buckets: {e}")
+        except PyMongoError as e:
+            # May double count if the write landed anyway; backfill_rollups recomputes exact buckets
+            self._requeue(batch)
+            self.write_failures += 1
+            print(f"Analytics rollup update failed, retrying: {e}")
+        except Exception as e:
+            # Not a Mongo error: the same batch would fail again, so it is dropped
+            self.buckets_dropped += len(batch)
+            self.write_failures += 1
+            print(f"Analytics rollup update dropped {len(batch)} buckets: {e!r}")
+        else:
+            self.buckets_written += len(batch)
+
+    def _requeue(self, entries):
+        for key, bucket in entries:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = bucket
+            else:
+                pending.merge(bucket)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pending_buckets": len(self._pending),
+            "turns_recorded": self.turns_recorded,
+            "buckets_written": self.buckets_written,
+            "write_failures": self.write_failures,
+            "buckets_dropped": self.buckets_dropped,
+        }
+
+
+# Started in the app lifespan when rollups are enabled; records nothing until then
+rollup_recorder = RollupRecorder(flush_interval=settings.AI_ROLLUPS_FLUSH_INTERVAL)
@@ -0,0 +1,91 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds, in the style of Prometheus histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class LatencyHistograms:
+    """Cumulative per-stage latency histograms for this worker."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._stages = {}  # stage -> [bucket counts..., +Inf count], sum
+
+    def observe(self, stage, seconds):
+        counts, total = self._stages.get(stage, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect_left(self.buckets, seconds)] += 1
+        self._stages[stage] = (counts, total + seconds)
+
+    def prometheus(self, name="ai_stage_duration_seconds"):
+        """Renders the histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {name} Time spent in each stage of the AI pipeline.", f"# TYPE {name} histogram"]
+        for stage, (counts, total) in sorted(self._stages.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+stage_histograms = LatencyHistograms()
+
+
+class StageTimer:
+    """Durations, in seconds, of the stages of one AI request."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        stage_histograms.observe(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+
+_current_timer = ContextVar("stage_timer", default=None)
+
+
+@contextmanager
+def timed_stages():
+    """
+    Makes a StageTimer current for the enclosed code and yields it. Nested
+    uses share the outer timer, so helpers can time their own stages.
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        yield timer
+        return
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Times a stage on the current request's timer, if there is one."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def server_timing_header(stages):
+    """Formats stage durations (seconds) as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in (stages or {}).items())
@@ -0,0 +1,286 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.utils.fair_queue import FairQueue
+from app.utils.timing import stage
+
+
+class CircuitBreaker:
+    """
+    Trips when the AI service fails or slows down too often.
+
+    The last ``window`` calls are tracked; once at least ``min_calls`` are in
+    the window and either the error rate reaches ``error_rate`` or the share of
+    calls slower than ``slow_call_seconds`` reaches ``slow_call_rate``, the
+    breaker opens for ``open_seconds``. It then lets a single probe through
+    (half-open): success closes it, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window, min_calls, error_rate, slow_call_seconds, slow_call_rate, open_seconds):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._calls = deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+
+    def retry_after(self):
+        """Seconds until calls are let through again, 0 if they are now."""
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and self._probing:
+            return self.open_seconds
+        return 0
+
+    def allow(self):
+        if self.retry_after() > 0:
+            return False
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+        return True
+
+    def record(self, failed, latency):
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            if failed:
+                self._open()
+            else:
+                self.state = self.CLOSED
+                self._calls.clear()
+            return
+
+        self._calls.append((failed, latency >= self.slow_call_seconds))
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow = sum(1 for _, slow in self._calls if slow)
+        if failures / len(self._calls) >= self.error_rate or slow / len(self._calls) >= self.slow_call_rate:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.trips += 1
+
+
+class UpstreamCall:
+    """Timing of one guarded AI service call."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.responded_at = None
+
+    def responded(self):
+        if self.responded_at is None:
+            self.responded_at = time.monotonic()
+
+    def latency(self):
+        return (self.responded_at or time.monotonic()) - self.start
+
+
+class UpstreamGuard:
+    """
+    Admission control in front of the AI service.
+
+    At most ``max_in_flight`` calls run at once; up to ``max_queue`` more wait
+    for a slot for at most ``queue_timeout`` seconds. Anything beyond that, and
+    every call while the circuit breaker is open, is rejected right away with
+    503 and a Retry-After header instead of piling up in the worker.
+
+    Waiting calls are ordered per company by ``fair_queue``. When the queue is
+    full, a company below its fair share takes the place of the newest caller
+    of the most backlogged company, so a noisy tenant is the one shed.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout, retry_after, breaker, fair_queue=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.breaker = breaker
+        self.fair_queue = fair_queue or FairQueue()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.rejected_open = 0
+
+    def check(self, company_id=None):
+        """Rejects a request up front if it would not be admitted now."""
+        wait = self.breaker.retry_after()
+        if wait > 0:
+            self.rejected_open += 1
+            raise self._unavailable("AI service circuit is open", wait)
+        try:
+            if self.fair_queue.queued >= self.max_queue and not self._can_start(company_id):
+                if self._push_out_victim(company_id) is None:
+                    self.shed += 1
+                    self.fair_queue.tenant(company_id).shed += 1
+                    raise self._unavailable("AI service is overloaded", self.retry_after)
+        finally:
+            self.fair_queue.settle(company_id)
+
+    @asynccontextmanager
+    async def call(self, company_id=None):
+        """
+        Holds an upstream slot for the duration of one AI service call. The
+        yielded UpstreamCall can mark when the service started responding, so
+        streamed answers are judged on their time to first byte.
+        """
+        with stage("admission"):
+            await self._acquire(company_id)
+        if not self.breaker.allow():
+            self._release(company_id)
+            self.rejected_open += 1
+            raise self._unavailable("AI service circuit is open", self.breaker.retry_after())
+
+        call = UpstreamCall()
+        failed = True
+        try:
+            yield call
+            failed = False
+        except aiohttp.ClientResponseError as e:
+            # The service answered; only its own failures count against it
+            failed = e.status >= 500
+            raise
+        except aiohttp.ClientConnectionError as e:
+            # Raised from the request body, e.g. an upload over the clip limit,
+            # the call was aborted on the client's side
+            failed = not isinstance(e.__cause__, HTTPException)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away, which says nothing about the service
+            failed = False
+            raise
+        finally:
+            self.breaker.record(failed, call.latency())
+            self._release(company_id)
+
+    def _can_start(self, company_id):
+        tenant = self.fair_queue.tenant(company_id)
+        return self.in_flight < self.max_in_flight and tenant.can_start() and not tenant.waiters
+
+    def _push_out_victim(self, company_id):
+        """The company whose newest caller would make room for ``company_id``, if any."""
+        victim = self.fair_queue.noisiest()
+        tenant = self.fair_queue.tenant(company_id)
+        if victim is None or victim is tenant:
+            return None
+        if (len(tenant.waiters) + 1) / tenant.weight >= len(victim.waiters) / victim.weight:
+            return None
+        return victim
+
+    async def _acquire(self, company_id):
+        self.check(company_id)
+        tenant = self.fair_queue.tenant(company_id)
+        if self._can_start(company_id):
+            self._start(tenant, 0.0)
+            return
+
+        if self.fair_queue.queued >= self.max_queue:
+            victim = self._push_out_victim(company_id)
+            evicted = victim.waiters.pop()
+            self.fair_queue.queued -= 1
+            victim.shed += 1
+            self.shed += 1
+            evicted.future.set_exception(self._unavailable("AI service is overloaded", self.retry_after))
+
+        waiter = self.fair_queue.enqueue(company_id, asyncio.get_running_loop().create_future())
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            tenant.timed_out += 1
+            raise self._unavailable("Timed out waiting for the AI service", self.retry_after)
+        except asyncio.CancelledError:
+            # A slot handed over just before the cancellation must be passed on
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release(company_id)
+            raise
+        finally:
+            self.fair_queue.discard(waiter)
+            self.fair_queue.settle(company_id)
+
+    def _start(self, tenant, waited):
+        self.in_flight += 1
+        tenant.in_flight += 1
+        self.admitted += 1
+        tenant.admitted += 1
+        tenant.wait_seconds += waited
+        tenant.max_wait_seconds = max(tenant.max_wait_seconds, waited)
+
+    def _release(self, company_id):
+        self.in_flight -= 1
+        self.fair_queue.tenant(company_id).in_flight -= 1
+        # Hand free slots straight to the next waiters in fair order
+        while self.in_flight < self.max_in_flight:
+            waiter = self.fair_queue.pop_next()
+            if waiter is None:
+                break
+            self._start(self.fair_queue.tenant(waiter.key), time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+        self.fair_queue.settle(company_id)
+
+    @staticmethod
+    def _unavailable(detail, retry_after):
+        return HTTPException(
+            status_code=503,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.fair_queue.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "rejected_open": self.rejected_open,
+            "breaker_state": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "companies": self.fair_queue.stats(),
+        }
+
+
+upstream_guard = UpstreamGuard(
+    max_in_flight=settings.AI_UPSTREAM_MAX_IN_FLIGHT,
+    max_queue=settings.AI_UPSTREAM_MAX_QUEUE,
+    queue_timeout=settings.AI_UPSTREAM_QUEUE_TIMEOUT,
+    retry_after=settings.AI_UPSTREAM_RETRY_AFTER,
+    breaker=CircuitBreaker(
+        window=settings.AI_BREAKER_WINDOW,
+        min_calls=settings.AI_BREAKER_MIN_CALLS,
+        error_rate=settings.AI_BREAKER_ERROR_RATE,
+        slow_call_seconds=settings.AI_BREAKER_SLOW_CALL_SECONDS,
+        slow_call_rate=settings.AI_BREAKER_SLOW_CALL_RATE,
+        open_seconds=settings.AI_BREAKER_OPEN_SECONDS,
+    ),
+    fair_queue=FairQueue(
+        default_weight=settings.AI_FAIR_DEFAULT_WEIGHT,
+        weights=settings.AI_FAIR_COMPANY_WEIGHTS,
+        default_max_in_flight=settings.AI_FAIR_COMPANY_MAX_IN_FLIGHT,
+        max_in_flight=settings.AI_FAIR_COMPANY_CAPS,
+        max_idle=settings.AI_FAIR_MAX_IDLE_COMPANIES,
+    ),
+)
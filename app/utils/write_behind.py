@@ -0,0 +1,243 @@
+import asyncio
+import math
+import time
+
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.core.config import settings
+
+# Duplicate key: the document was already written by an earlier attempt
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindBuffer:
+    """
+    Groups inserts into ``insert_many`` batches written off the request path.
+
+    A batch is flushed once ``batch_size`` documents are pending or every
+    ``flush_interval`` seconds. When ``max_pending`` documents are waiting,
+    ``add`` blocks until a batch has been written (backpressure), for at
+    most ``max_wait`` seconds before giving up with 503 and Retry-After.
+    After a transient Mongo error the flusher backs off exponentially, up
+    to ``max_backoff`` seconds, before retrying the batch. With
+    ``wait_for_write`` set, ``add`` only returns once the document's batch is
+    in Mongo, trading latency for durability while still batching.
+    ``on_written``, if given to ``add``, is called with the document once
+    its insert succeeded, and never for a document that was dropped.
+
+    Documents are kept in memory until written, so ``pending_for`` lets
+    history reads in this worker see turns Mongo does not have yet.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_pending, wait_for_write=False, max_wait=5.0,
+                 max_backoff=30.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.wait_for_write = wait_for_write
+        self.max_wait = max_wait
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._pending = []  # (collection, document, future or None, on_written or None)
+        self._writing = []
+        self._task = None
+        self._stopping = False
+        self._wakeup = None
+        self._written = None
+        self.documents_written = 0
+        self.batches_written = 0
+        self.documents_dropped = 0
+        self.write_failures = 0
+        self.backpressure_waits = 0
+        self.backpressure_timeouts = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._written = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print("Write-behind buffer started")
+
+    async def stop(self):
+        """Stops the flusher and drains everything still pending."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self._pending:
+            self.documents_dropped += len(self._pending)
+            print(f"Write-behind buffer dropped {len(self._pending)} documents on shutdown")
+            for entry in self._pending:
+                self._done(entry, RuntimeError("Write-behind buffer stopped before the write"))
+            self._pending.clear()
+        print("Write-behind buffer drained")
+
+    async def add(self, collection, document, on_written=None):
+        deadline = time.monotonic() + self.max_wait
+        while len(self._pending) >= self.max_pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.backpressure_timeouts += 1
+                retry_after = max(self.flush_interval, self._retry_at - time.monotonic())
+                raise HTTPException(
+                    status_code=503,
+                    detail="Conversation storage is backed up, try again later",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                )
+            self.backpressure_waits += 1
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._written.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        future = asyncio.get_running_loop().create_future() if self.wait_for_write else None
+        self._pending.append((collection, document, future, on_written))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if future is not None:
+            await future
+
+    def pending_for(self, company_id, user_id):
+        """Documents of one conversation that are buffered or being written, oldest first."""
+        company_id, user_id = str(company_id), str(user_id)
+        return [
+            document for _, document, _, _ in self._writing + self._pending
+            if str(document.get("companyId")) == company_id and str(document.get("userId")) == user_id
+        ]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # After a failed write, new documents do not make the retry come sooner
+            while not self._stopping and self._retry_at > time.monotonic():
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._retry_at - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep flushing later batches; the failed one was already dropped
+                print(f"Write-behind flush failed: {e}")
+                self._written.set()
+                self._written.clear()
+
+    async def flush(self):
+        while self._pending:
+            self._writing = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            try:
+                retry = await self._write(self._writing)
+            finally:
+                self._writing = []
+            # Wake requests held back by backpressure
+            self._written.set()
+            self._written.clear()
+            if retry:
+                # Transient failure, keep the documents for the next flush
+                self._pending[:0] = retry
+                self._backoff = min(self.max_backoff, max(self.flush_interval, self._backoff * 2))
+                self._retry_at = time.monotonic() + self._backoff
+                break
+            self._backoff = 0.0
+
+    async def _write(self, batch):
+        groups = {}
+        for entry in batch:
+            collection = entry[0]
+            groups.setdefault(getattr(collection, "full_name", id(collection)), []).append(entry)
+
+        retry = []
+        for entries in groups.values():
+            collection = entries[0][0]
+            try:
+                await collection.insert_many([document for _, document, _, _ in entries], ordered=False)
+            except BulkWriteError as e:
+                # Unordered: everything but the reported documents was written
+                failed = {
+                    error["index"]: error for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                }
+                self.write_failures += 1
+                self.documents_dropped += len(failed)
+                print(f"Write-behind insert rejected {len(failed)} documents: {e}")
+                for index, entry in enumerate(entries):
+                    if index in failed:
+                        self._done(entry, BulkWriteError(failed[index]))
+                    else:
+                        self._done(entry)
+                self.documents_written += len(entries) - len(failed)
+            except PyMongoError as e:
+                self.write_failures += 1
+                print(f"Write-behind insert failed, retrying: {e}")
+                retry.extend(entries)
+                continue
+            except Exception as e:
+                # Not a Mongo error, e.g. an InvalidDocument: retrying would fail again
+                self.write_failures += 1
+                self.documents_dropped += len(entries)
+                print(f"Write-behind insert dropped {len(entries)} documents: {e!r}")
+                for entry in entries:
+                    self._done(entry, e)
+                continue
+            else:
+                for entry in entries:
+                    self._done(entry)
+                self.documents_written += len(entries)
+            self.batches_written += 1
+        return retry
+
+    @staticmethod
+    def _done(entry, error=None):
+        _, document, future, on_written = entry
+        if error is None and on_written is not None:
+            try:
+                on_written(document)
+            except Exception as e:
+                print(f"Write-behind callback failed: {e!r}")
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pending": len(self._pending),
+            "writing": len(self._writing),
+            "documents_written": self.documents_written,
+            "batches_written": self.batches_written,
+            "documents_dropped": self.documents_dropped,
+            "write_failures": self.write_failures,
+            "backpressure_waits": self.backpressure_waits,
+            "backpressure_timeouts": self.backpressure_timeouts,
+            "retry_backoff": self._backoff,
+        }
+
+
+# Only used once started in the app lifespan; until then turns are inserted directly
+write_behind = WriteBehindBuffer(
+    batch_size=settings.AI_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.AI_WRITE_BEHIND_FLUSH_INTERVAL,
+    max_pending=settings.AI_WRITE_BEHIND_MAX_PENDING,
+    wait_for_write=settings.AI_WRITE_BEHIND_WAIT_FOR_WRITE,
+    max_wait=settings.AI_WRITE_BEHIND_MAX_WAIT,
+    max_backoff=settings.AI_WRITE_BEHIND_MAX_BACKOFF,
+)
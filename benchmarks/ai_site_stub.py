@@ -0,0 +1,103 @@
+"""
+Local stand-in for the AI service behind settings.AI_SITE.
+
+Serves /process_voice/{companyId}, /get_answer/, /get_answer_stream/ and /health with
+synthetic answers, so the AI endpoints can be load tested offline. Latency is
+drawn from a log-normal distribution and a share of calls fail with 503.
+
+    python -m benchmarks.ai_site_stub --port 8100 --median-ms 800 --error-rate 0.01
+
+Then start the API with AI_SITE=http://127.0.0.1:8100.
+"""
+import argparse
+import asyncio
+import math
+import random
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+ANSWERS = [
+    "We are open from 9 to 18, Monday to Friday. See (https://example.com/hours) for holidays.",
+    "To reset your password:\n1. Open the login page\n2. Choose forgot password\n2.1 Check your inbox\n3. Follow the link",
+    "Our support team answers within one business day [www.example.com/support].",
+    "The premium plan includes 1.5 GB of storage, priority support and monthly reports.",
+]
+
+
+class StubConfig:
+    def __init__(self, median_ms=800.0, sigma=0.5, error_rate=0.0, token_ms=20.0, answer_repeat=1):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.token_ms = token_ms
+        self.answer_repeat = answer_repeat
+
+    def latency(self):
+        """One latency sample in seconds (log-normal around the median)."""
+        return random.lognormvariate(math.log(self.median_ms / 1000), self.sigma)
+
+    def answer(self):
+        return " ".join([random.choice(ANSWERS)] * self.answer_repeat)
+
+
+def create_stub_app(config: StubConfig) -> FastAPI:
+    stub = FastAPI(title="AI_SITE stub")
+
+    async def simulate():
+        await asyncio.sleep(config.latency())
+        if random.random() < config.error_rate:
+            raise HTTPException(status_code=503, detail="Synthetic upstream failure")
+
+    @stub.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @stub.post("/process_voice/{company_id}")
+    async def process_voice(company_id: str, request: Request):
+        form = await request.form()
+        await form["file"].read()
+        await simulate()
+        answer = config.answer()
+        return {"question": "Voice question", "answer": answer, "voice_answer": answer, "links": []}
+
+    @stub.post("/get_answer/")
+    async def get_answer(payload: dict):
+        await simulate()
+        return {"question": payload.get("question", ""), "answer": config.answer()}
+
+    @stub.post("/get_answer_stream/")
+    async def get_answer_stream(payload: dict):
+        await simulate()
+
+        async def tokens():
+            for word in config.answer().split(" "):
+                yield word + " "
+                await asyncio.sleep(config.token_ms / 1000)
+
+        return StreamingResponse(tokens(), media_type="text/plain")
+
+    return stub
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--median-ms", type=float, default=800.0, help="Median upstream latency")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Log-normal spread of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered with 503")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="Delay between streamed words")
+    parser.add_argument("--answer-repeat", type=int, default=1, help="Repeat answers to make them longer")
+
+
+def stub_config_from_args(args) -> StubConfig:
+    return StubConfig(args.median_ms, args.sigma, args.error_rate, args.token_ms, args.answer_repeat)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(stub_config_from_args(args)), host=args.host, port=args.port, log_level="warning")
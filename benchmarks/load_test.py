@@ -0,0 +1,350 @@
+"""
+End-to-end load benchmark for the AI endpoints.
+
+Virtual users replay a weighted mix of conversation turns (FAQ questions
+shared across users, free chat, base64 voice, raw voice uploads, streamed
+answers) and the driver reports throughput, p50/p95/p99 latency and memory.
+
+By default everything runs offline in this process: the API is called through
+httpx's ASGI transport, AI_SITE points at the bundled stub and Mongo is
+replaced by an in-memory mongomock stand-in, so the numbers describe a single
+worker. With --base-url the driver targets a running deployment instead
+(e.g. uvicorn workers against a local Mongo and the stub); pass the worker
+PIDs with --pid to sample their memory.
+
+    python -m benchmarks.load_test --users 50 --duration 30 --mix faq=4,chat=4,voice=1,stream=1
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import socket
+import time
+import tracemalloc
+from collections import defaultdict
+
+import httpx
+from bson import ObjectId
+
+from benchmarks.ai_site_stub import add_stub_arguments, create_stub_app, stub_config_from_args
+
+SCENARIOS = ("faq", "chat", "voice", "voice_raw", "stream")
+
+FAQ_QUESTIONS = [
+    "What are your opening hours?",
+    "How do I reset my password?",
+    "How can I contact support?",
+    "What does the premium plan include?",
+]
+
+
+class StandInCursor:
+    """Async facade over a mongomock cursor, covering what the app awaits."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    async def to_list(self, length=None):
+        documents = list(self._cursor)
+        return documents if length is None else documents[:length]
+
+
+class StandInCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self.full_name = collection.full_name
+
+    def find(self, *args, **kwargs):
+        return StandInCursor(self._collection.find(*args, **kwargs))
+
+    async def find_one(self, *args, **kwargs):
+        return self._collection.find_one(*args, **kwargs)
+
+    async def insert_one(self, document):
+        return self._collection.insert_one(document)
+
+    async def insert_many(self, documents, ordered=True):
+        return self._collection.insert_many(documents, ordered=ordered)
+
+    async def update_one(self, *args, **kwargs):
+        return self._collection.update_one(*args, **kwargs)
+
+    async def bulk_write(self, requests, ordered=True):
+        return self._collection.bulk_write(requests, ordered=ordered)
+
+    async def create_index(self, keys, **kwargs):
+        return self._collection.create_index(keys, **kwargs)
+
+
+class StandInDatabase:
+    """In-memory replacement for the motor database used by the AI endpoints."""
+
+    def __init__(self, name):
+        import mongomock
+
+        self._db = mongomock.MongoClient()[name]
+
+    def __getitem__(self, name):
+        return StandInCollection(self._db[name])
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(share * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def rss_kib(pid="self"):
+    """Current and peak resident memory of a process, from /proc (Linux only)."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+class LoadTest:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.companies = [str(ObjectId()) for _ in range(args.companies)]
+        self.audio = base64.b64encode(os.urandom(args.audio_kib * 1024)).decode()
+        self.deadline = None
+        self.remaining = args.requests
+
+    def next_scenario(self):
+        return random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    def request_allowed(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return False
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+        return True
+
+    async def user(self, number):
+        company_id = self.companies[number % len(self.companies)]
+        user_id = str(ObjectId())
+        turn = 0
+        while self.request_allowed():
+            scenario = self.next_scenario()
+            start = time.perf_counter()
+            try:
+                response = await self.send(scenario, company_id, user_id, turn)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                self.latencies[scenario].append(time.perf_counter() - start)
+            else:
+                self.errors[scenario] += 1
+            turn += 1
+            if self.args.think_ms:
+                await asyncio.sleep(random.expovariate(1000 / self.args.think_ms))
+
+    async def send(self, scenario, company_id, user_id, turn):
+        ids = {"companyId": company_id, "userId": user_id, "lang": random.choice(("EN", "IT"))}
+        if scenario == "faq":
+            return await self.client.post(
+                "/api/v2/textusermessage", json={**ids, "question": random.choice(FAQ_QUESTIONS)}
+            )
+        if scenario == "chat":
+            return await self.client.post(
+                "/api/v2/textusermessage", json={**ids, "question": f"Follow-up question {turn} from {user_id}"}
+            )
+        if scenario == "voice":
+            return await self.client.post("/api/v2/usermessage", json={**ids, "wavData": self.audio})
+        if scenario == "voice_raw":
+            return await self.client.post(
+                "/api/v2/usermessage/audio",
+                params=ids,
+                content=base64.b64decode(self.audio),
+                headers={"content-type": "audio/wav"},
+            )
+        async with self.client.stream(
+            "POST", "/api/v2/textusermessage/stream", json={**ids, "question": random.choice(FAQ_QUESTIONS)}
+        ) as response:
+            async for _ in response.aiter_bytes():
+                pass
+            return response
+
+    async def run(self):
+        if self.args.duration:
+            self.deadline = time.monotonic() + self.args.duration
+        start = time.perf_counter()
+        await asyncio.gather(*(self.user(number) for number in range(self.args.users)))
+        return time.perf_counter() - start
+
+    def report(self, elapsed, memory):
+        rows = []
+        for scenario in SCENARIOS:
+            latencies = sorted(self.latencies.get(scenario, []))
+            if not latencies and not self.errors.get(scenario):
+                continue
+            rows.append({
+                "scenario": scenario,
+                "requests": len(latencies),
+                "errors": self.errors.get(scenario, 0),
+                "rps": len(latencies) / elapsed,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            })
+        total = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        rows.append({
+            "scenario": "all",
+            "requests": len(total),
+            "errors": sum(self.errors.values()),
+            "rps": len(total) / elapsed,
+            "p50_ms": percentile(total, 0.50) * 1000,
+            "p95_ms": percentile(total, 0.95) * 1000,
+            "p99_ms": percentile(total, 0.99) * 1000,
+        })
+        return {"elapsed_s": elapsed, "users": self.args.users, "results": rows, "memory": memory}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def print_report(report):
+    print(f"\n{report['users']} users, {report['elapsed_s']:.1f}s")
+    print(f"{'scenario':<10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in report["results"]:
+        print(
+            f"{row['scenario']:<10} {row['requests']:>9} {row['errors']:>7} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+        )
+    for worker, values in report["memory"].items():
+        print(f"memory {worker}: " + ", ".join(f"{key}={value}" for key, value in values.items()))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_in_process(args):
+    """Runs the app, the AI_SITE stub and an in-memory Mongo inside this process."""
+    import uvicorn
+
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "")
+    from app import database
+    from app.core.config import settings
+    from app.main import app
+    from app.utils.backend_router import backend_router
+    from app.utils.http_client import close_http_client, init_http_client
+    from app.utils.rollups import ROLLUP_COLLECTION, rollup_recorder
+    from app.utils.write_behind import write_behind
+
+    stubs, urls = [], []
+    for _ in range(args.replicas):
+        port = free_port()
+        stub = uvicorn.Server(uvicorn.Config(
+            create_stub_app(stub_config_from_args(args)), host="127.0.0.1", port=port, log_level="warning"
+        ))
+        stubs.append((stub, asyncio.create_task(stub.serve())))
+        urls.append(f"http://127.0.0.1:{port}")
+    while not all(stub.started for stub, _ in stubs):
+        await asyncio.sleep(0.05)
+
+    settings.AI_SITE = urls[0]
+    backend_router.set_backends(urls)
+    database.db_spatial_ai = StandInDatabase(settings.MONGODB_DB_NAME_SPETIAL_AI)
+    await database.ensure_indexes()
+    await init_http_client()
+    if settings.AI_WRITE_BEHIND_ENABLED:
+        await write_behind.start()
+    if settings.AI_ROLLUPS_ENABLED:
+        await rollup_recorder.start(database.db_spatial_ai[ROLLUP_COLLECTION])
+
+    tracemalloc.start()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+            load_test = LoadTest(client, args)
+            elapsed = await load_test.run()
+    finally:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await write_behind.stop()
+        await rollup_recorder.stop()
+        await close_http_client()
+        for stub, stub_task in stubs:
+            stub.should_exit = True
+            await stub_task
+
+    rss, peak = rss_kib()
+    # The stub shares this process, so RSS is an upper bound for one worker
+    memory = {"in-process worker": {"rss_kib": rss, "peak_rss_kib": peak, "python_peak_kib": traced_peak // 1024}}
+    return load_test.report(elapsed, memory)
+
+
+async def run_remote(args):
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None, limits=limits) as client:
+        load_test = LoadTest(client, args)
+        elapsed = await load_test.run()
+    memory = {}
+    for pid in args.pid:
+        rss, peak = rss_kib(pid)
+        memory[f"pid {pid}"] = {"rss_kib": rss, "peak_rss_kib": peak}
+    return load_test.report(elapsed, memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Target a running API instead of the in-process app")
+    parser.add_argument("--pid", type=int, action="append", default=[], help="Worker PID to sample memory from")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--companies", type=int, default=5, help="Distinct companies the users belong to")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run (0 to use --requests only)")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a user's turns")
+    parser.add_argument("--mix", default="faq=4,chat=4,voice=1,voice_raw=1,stream=1",
+                        help="Scenario weights, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--audio-kib", type=int, default=200, help="Size of the synthetic voice clips")
+    parser.add_argument("--replicas", type=int, default=1, help="AI_SITE stubs to route across (in-process only)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    if not args.duration and args.requests is None:
+        parser.error("either --duration or --requests is required")
+
+    report = asyncio.run(run_remote(args) if args.base_url else run_in_process(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Microbenchmark of the answer post-processing run on every AI response.
+
+Compares the single-pass engine with the previous three-pass implementation
+(regexes compiled per call) on answers of growing length, and checks that the
+cost per KiB stays flat, i.e. processing is linear in the answer size.
+
+    python -m benchmarks.postprocessing_bench
+"""
+import argparse
+import re
+import timeit
+
+from app.services.answer_postprocessing import postprocessor
+
+PARAGRAPH = (
+    "## Opening hours\n"
+    "1. Visit **our store** (https://example.com/stores) from 9 to 18.\n"
+    "2. Version 2.1.3 of the app lists 1.5 GB of storage [www.example.com/app].\n"
+    "- Call `support` for anything else, we answer within one business day.\n"
+)
+PROSE = (
+    "The premium plan includes priority support, monthly reports and a dedicated account manager "
+    "who helps you configure the product for your team (https://example.com/premium).\n"
+)
+WORKLOADS = {"markdown": PARAGRAPH, "prose": PROSE}
+
+
+def legacy_process(text, lang):
+    """The implementation replaced by the engine, kept here as the baseline."""
+    link_pattern = re.compile(r'[\[(](https?://[^\s]+|www\.[^\s]+)[\])]')
+    links = link_pattern.findall(text)
+    text = link_pattern.sub('', text)
+
+    re_main = re.compile(r'(?m)^(\d+)\.')
+    voice = re_main.sub(lambda m: f"numero {m.group(1)}." if lang == "IT" else f"number {m.group(1)}.", text)
+    re_nested = re.compile(r'(\d+(\.\d+)+)')
+
+    def replace_nested(match):
+        numbers = match.group(1).split('.')
+        if lang == "IT":
+            return "numero " + " punto ".join(numbers) + "."
+        return "number " + " point ".join(numbers) + "."
+
+    voice = re_nested.sub(replace_nested, voice)
+    return text.strip(), voice.strip(), links
+
+
+def per_call_us(function, text, number):
+    return min(timeit.repeat(lambda: function(text, "IT"), number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,4,16,64,256", help="Answer sizes in paragraphs")
+    parser.add_argument("--max-growth", type=float, default=2.0,
+                        help="Fail if the per-KiB cost of the largest answer exceeds the smallest by this factor")
+    args = parser.parse_args()
+
+    failed = False
+    for name, paragraph in WORKLOADS.items():
+        print(f"\n{name}")
+        print(f"{'KiB':>8} {'engine us':>11} {'legacy us':>11} {'engine us/KiB':>14} {'speedup':>8}")
+        per_kib = []
+        for paragraphs in (int(size) for size in args.sizes.split(",")):
+            text = paragraph * paragraphs
+            kib = len(text.encode()) / 1024
+            number = max(1, 2000 // paragraphs)
+            engine = per_call_us(postprocessor.process, text, number)
+            legacy = per_call_us(legacy_process, text, number)
+            per_kib.append(engine / kib)
+            print(f"{kib:>8.1f} {engine:>11.1f} {legacy:>11.1f} {engine / kib:>14.1f} {legacy / engine:>7.2f}x")
+
+        growth = per_kib[-1] / per_kib[0]
+        print(f"per-KiB cost growth from smallest to largest answer: {growth:.2f}x")
+        failed = failed or growth > args.max_growth
+
+    if failed:
+        raise SystemExit(f"post-processing is not linear in the answer size (limit {args.max_growth}x)")
+
+
+if __name__ == "__main__":
+    main()
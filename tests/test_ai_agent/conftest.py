@@ -0,0 +1,11 @@
+import pytest
+
+from app.utils.config_cache import config_cache
+
+
+# The worker-wide config cache would otherwise carry documents from one test's database into the next
+@pytest.fixture(autouse=True)
+def clear_config_cache():
+    config_cache.clear()
+    yield
+    config_cache.clear()
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.services.analytics_service import company_summary
+
+company_id = ObjectId()
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, count):
+        self.cursor = self.cursor.limit(count)
+        return self
+
+    async def to_list(self, length=None):
+        documents = list(self.cursor)
+        return documents if length is None else documents[:length]
+
+
+class AsyncCollection:
+    """Minimal motor-like wrapper over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline):
+        return AsyncCursor(self.collection.aggregate(pipeline))
+
+
+def make_collection(count):
+    collection = mongomock.MongoClient().db["UserMessage"]
+    start = datetime(2024, 1, 1)
+    collection.insert_many([
+        {
+            "companyId": company_id,
+            "userId": ObjectId(),
+            "time": start + timedelta(hours=index // 2),  # Pairs share a time, _id breaks the tie
+            "AIResponses": {"question": f"q{index}", "answer": f"a{index}", "process_time": 1.5,
+                            "voice_answer": "large base64 audio"},
+        }
+        for index in range(count)
+    ])
+    collection.insert_one({"companyId": ObjectId(), "time": start, "AIResponses": {"question": "x", "answer": "y"}})
+    return AsyncCollection(collection)
+
+
+@pytest.mark.asyncio
+async def test_summary_pages_through_every_turn_once():
+    collection = make_collection(7)
+
+    questions = []
+    cursor = None
+    while True:
+        summary = await company_summary(collection, company_id, cursor=cursor, limit=3)
+        assert summary.total_questions == 7
+        assert summary.total_time == str(timedelta(seconds=10.5))
+        questions += [detail.question for detail in summary.details]
+        cursor = summary.next_cursor
+        if cursor is None:
+            break
+
+    assert sorted(questions) == sorted(f"q{index}" for index in range(7))
+    assert questions[0] == "q6"
+
+
+@pytest.mark.asyncio
+async def test_summary_date_range_and_empty_result():
+    collection = make_collection(6)
+
+    summary = await company_summary(
+        collection, company_id, start=datetime(2024, 1, 1, 1), end=datetime(2024, 1, 1, 2), limit=10
+    )
+    assert summary.total_questions == 2
+    assert {detail.question for detail in summary.details} == {"q2", "q3"}
+    assert summary.next_cursor is None
+
+    assert await company_summary(collection, company_id, start=datetime(2025, 1, 1)) is None
+
+
+@pytest.mark.asyncio
+async def test_summary_rejects_malformed_cursor():
+    with pytest.raises(HTTPException) as error:
+        await company_summary(make_collection(2), company_id, cursor="not-a-cursor")
+    assert error.value.status_code == 400
@@ -0,0 +1,41 @@
+from unittest.mock import MagicMock, patch
+
+from app.services.ai_service import local_answer
+from app.utils.answer_cache import AnswerCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  What are your Opening hours?! ") == "what are your opening hours"
+
+
+def test_answer_cache_hit_on_normalized_question():
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.put("company", "en", "Opening hours?", {"answer": "9 to 5"})
+
+    assert cache.get("company", "EN", "opening   hours") == {"answer": "9 to 5"}
+    assert cache.get("company", "IT", "opening hours") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_answer_cache_company_ttl_and_invalidation():
+    cache = AnswerCache(max_entries=10, ttl=60, company_ttls={"nocache": 0})
+    cache.put("nocache", "EN", "hours", {"answer": "9 to 5"})
+    cache.put("company", "EN", "hours", {"answer": "9 to 5"})
+    cache.put("other", "EN", "hours", {"answer": "8 to 4"})
+
+    assert cache.get("nocache", "EN", "hours") is None
+    cache.invalidate_company("company")
+    assert cache.get("company", "EN", "hours") is None
+    assert cache.get("other", "EN", "hours") == {"answer": "8 to 4"}
+
+
+@patch("app.services.ai_service.settings.AI_ANSWER_CACHE_ENABLED", True)
+def test_cached_answer_carries_the_question_asked():
+    cache = AnswerCache(max_entries=10, ttl=60)
+    cache.put("company", "EN", "Opening hours?", {"question": "Opening hours?", "answer": "9 to 5"})
+
+    with patch("app.services.ai_service.answer_cache", cache):
+        answer, faq_match = local_answer(None, "company", MagicMock(lang="EN", question="opening hours"))
+
+    assert answer == {"question": "opening hours", "answer": "9 to 5"}
+    assert faq_match is None
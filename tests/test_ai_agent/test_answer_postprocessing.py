@@ -0,0 +1,27 @@
+from app.services.answer_postprocessing import postprocessor, rules_for, LANGUAGE_RULES
+
+answer = "## Steps\n1. Open **the app** (https://example.com/start)\n2. Go to 1.2 [www.example.com]\n- use `code`"
+
+
+def test_single_pass_rewrites_answer_and_voice():
+    text, voice, links = postprocessor.process(answer, "EN")
+
+    assert text == "## Steps\n1. Open **the app** \n2. Go to 1.2 \n- use `code`"
+    assert voice == "Steps\nnumber 1. Open the app \nnumber 2. Go to number 1 point 2. \nuse code"
+    assert links == ["https://example.com/start", "www.example.com"]
+
+
+def test_language_rules():
+    assert postprocessor.process("1. Vai a 1.2", "IT")[1] == "numero 1. Vai a numero 1 punto 2."
+    assert rules_for("it-IT") is LANGUAGE_RULES["IT"]
+    assert rules_for("EN-US") is LANGUAGE_RULES["EN"]
+    assert rules_for("xx") is LANGUAGE_RULES["EN"]
+
+
+def test_continued_line_does_not_match_line_start_rules():
+    assert postprocessor.process("1. done", "EN", line_start=False)[1] == "1. done"
+
+
+def test_nested_number_opening_a_line_is_spelled_out():
+    assert postprocessor.process("Intro\n1.2 Sub", "EN")[1] == "Intro\nnumber 1 point 2. Sub"
+    assert postprocessor.process("2.1 Controlla la posta", "IT")[1] == "numero 2 punto 1. Controlla la posta"
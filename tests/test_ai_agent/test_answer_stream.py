@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+from app.services.ai_service import AnswerStreamProcessor, process_ai_response_links
+
+answer = "Steps:\n1. Open (https://example.com/start) the app\n2. Go to 1.2 and see [www.example.com]\nDone 3. times"
+
+
+def stream(text, lang, chunk_size):
+    processor = AnswerStreamProcessor(lang)
+    deltas = [processor.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    deltas.append(processor.finish())
+    return [delta for delta in deltas if delta]
+
+
+def test_stream_matches_full_post_processing():
+    full = SimpleNamespace(answer=answer)
+    process_ai_response_links(full, "IT")
+
+    for chunk_size in (1, 3, 7, len(answer)):
+        deltas = stream(answer, "IT", chunk_size)
+        assert "".join(delta["answer"] for delta in deltas).strip() == full.answer
+        assert "".join(delta["voice"] for delta in deltas).strip() == full.voice
+        assert [link for delta in deltas for link in delta["links"]] == full.links
+
+
+def test_stream_releases_text_before_the_end():
+    processor = AnswerStreamProcessor("EN")
+
+    assert processor.feed("Hello wor") == {"answer": "Hello ", "voice": "Hello ", "links": []}
+    assert processor.feed("ld") is None
+    assert processor.finish()["answer"] == "world"
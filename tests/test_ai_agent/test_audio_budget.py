@@ -0,0 +1,102 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.user_messages import AIResponse
+from app.utils.audio_budget import AudioByteBudget, SizeLimitedStream, audio_budget
+
+
+def make_budget(max_bytes=100, max_request_bytes=80, wait_timeout=1.0):
+    return AudioByteBudget(max_bytes, max_request_bytes, wait_timeout, retry_after=2)
+
+
+def test_oversized_clip_is_refused():
+    budget = make_budget()
+
+    with pytest.raises(HTTPException) as error:
+        budget.check_size(81)
+
+    assert error.value.status_code == 413
+    assert budget.stats()["too_large"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reservations_wait_in_order_and_time_out():
+    budget = make_budget(wait_timeout=0.05)
+    order = []
+
+    async def turn(name, nbytes, hold):
+        async with budget.reserve(nbytes):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    first = asyncio.create_task(turn("first", 70, 0.02))
+    await asyncio.sleep(0)
+    assert budget.stats()["in_flight_bytes"] == 70
+    # The large clip waits for the first one; the small one queues behind it
+    second = asyncio.create_task(turn("second", 60, 0))
+    third = asyncio.create_task(turn("third", 10, 0))
+    await asyncio.gather(first, second, third)
+
+    assert order == ["first", "second", "third"]
+    assert budget.stats()["in_flight_bytes"] == 0
+    assert budget.stats()["peak_bytes"] == 70
+
+    async with budget.reserve(90):
+        with pytest.raises(HTTPException) as error:
+            async with budget.reserve(20):
+                pass
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "2"
+    assert budget.stats()["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_streamed_clip_is_cut_off_at_the_limit():
+    budget = make_budget()
+
+    async def chunks():
+        for _ in range(5):
+            yield b"x" * 30
+
+    stream = SizeLimitedStream(budget, chunks())
+    received = []
+    with pytest.raises(HTTPException) as error:
+        async for chunk in stream:
+            received.append(chunk)
+
+    assert error.value.status_code == 413
+    assert stream.too_large is error.value
+    # The third chunk takes the total to 90, over the 80 byte limit
+    assert len(received) == 2
+    assert budget.stats()["too_large"] == 1
+
+
+def test_chunked_upload_without_content_length_is_held_to_the_limit():
+    async def forward(company_id, user_id, lang, audio, audio_size=None):
+        try:
+            async for _ in audio:
+                pass
+        except HTTPException as e:
+            # As the upload failing reaches the endpoint from the AI service call
+            raise HTTPException(status_code=500, detail="Failed to send bytes") from e
+        return AIResponse(question="Hi", answer="Hello")
+
+    def body(size):
+        for _ in range(size // 100):
+            yield b"x" * 100
+
+    url = f"/api/v2/usermessage/audio?companyId={ObjectId()}&userId={ObjectId()}&lang=EN"
+    with patch("app.api.v2.endpoints.ai_agent.process_ai_response_audio", forward), \
+            patch.object(audio_budget, "max_request_bytes", 1000):
+        client = TestClient(app)
+        accepted = client.post(url, content=body(1000), headers={"Content-Type": "audio/wav"})
+        refused = client.post(url, content=body(1500), headers={"Content-Type": "audio/wav"})
+
+    assert accepted.status_code == 200
+    assert refused.status_code == 413
@@ -0,0 +1,82 @@
+import io
+import tempfile
+import wave
+
+import numpy as np
+import pytest
+
+from app.utils.audio_budget import AudioByteBudget
+from app.utils.audio_preprocessing import WORKING_SET_FACTOR, AudioPreprocessor, read_pcm
+
+
+def make_wav(rate=48000, channels=2, silence_s=1.0, tone_s=0.5):
+    t = np.arange(int(rate * tone_s)) / rate
+    tone = 0.5 * np.sin(2 * np.pi * 440 * t)
+    silence = np.zeros(int(rate * silence_s))
+    mono = np.concatenate([silence, tone, silence])
+    pcm = (np.repeat(mono[:, None], channels, axis=1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as clip:
+        clip.setnchannels(channels)
+        clip.setsampwidth(2)
+        clip.setframerate(rate)
+        clip.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_clip_is_downmixed_resampled_and_trimmed():
+    preprocessor = AudioPreprocessor(target_rate=16000, threshold_db=-45, frame_ms=20, pad_ms=100)
+    data = make_wav()
+
+    processed = await preprocessor.process(data)
+
+    samples, rate = read_pcm(processed)
+    assert rate == 16000
+    assert samples.shape[1] == 1
+    # 0.5 s of tone plus up to 2 x 100 ms of padding
+    assert 0.5 <= len(samples) / rate <= 0.75
+    # The 440 Hz tone survives resampling
+    spectrum = np.abs(np.fft.rfft(samples[:, 0]))
+    assert abs(np.argmax(spectrum) * rate / len(samples) - 440) < 5
+    assert preprocessor.stats()["bytes_saved"] == len(data) - len(processed)
+
+
+@pytest.mark.asyncio
+async def test_unparseable_or_small_clips_are_forwarded_unchanged():
+    preprocessor = AudioPreprocessor(target_rate=16000, threshold_db=-45, frame_ms=20, pad_ms=100)
+    already_small = make_wav(rate=16000, channels=1, silence_s=0)
+
+    assert await preprocessor.process(b"not a wav") == b"not a wav"
+    assert await preprocessor.process(io.BytesIO(already_small)) == already_small
+    assert preprocessor.stats()["skipped"] == 2
+
+
+@pytest.mark.asyncio
+async def test_spilled_clips_are_not_read_back_into_memory():
+    preprocessor = AudioPreprocessor(target_rate=16000, threshold_db=-45, frame_ms=20, pad_ms=100, max_bytes=1024)
+    spilled = tempfile.TemporaryFile()
+    spilled.write(make_wav())
+    spilled.seek(0)
+
+    assert await preprocessor.process(spilled) is spilled
+    assert spilled.tell() == 0
+    assert preprocessor.stats()["skipped"] == 1
+    spilled.close()
+
+
+@pytest.mark.asyncio
+async def test_working_set_is_reserved_from_the_audio_budget():
+    data = make_wav()
+    budget = AudioByteBudget(max_bytes=WORKING_SET_FACTOR * len(data), max_request_bytes=0, wait_timeout=1,
+                             retry_after=1)
+    preprocessor = AudioPreprocessor(target_rate=16000, threshold_db=-45, frame_ms=20, pad_ms=100, budget=budget)
+
+    assert len(await preprocessor.process(data)) < len(data)
+    assert budget.stats()["peak_bytes"] == WORKING_SET_FACTOR * len(data)
+    assert budget.stats()["in_flight_bytes"] == 0
+
+    # No room next to a clip already holding the budget: forwarded unchanged
+    async with budget.reserve(1):
+        assert await preprocessor.process(data) == data
+    assert preprocessor.stats()["skipped"] == 1
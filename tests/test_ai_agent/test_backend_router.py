@@ -0,0 +1,52 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from app.utils.backend_router import BackendRouter
+
+URLS = ["http://a", "http://b", "http://c"]
+
+
+@pytest.mark.asyncio
+async def test_least_outstanding_spreads_concurrent_calls():
+    router = BackendRouter(URLS)
+    release = asyncio.Event()
+    picked = []
+
+    async def call():
+        replica = router.pick()
+        picked.append(replica.url)
+        async with router.track(replica):
+            await release.wait()
+
+    tasks = [asyncio.ensure_future(call()) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert sorted(picked) == URLS
+
+
+def test_companies_stay_pinned_and_hedges_go_elsewhere():
+    router = BackendRouter(URLS, pin_companies=True)
+
+    pinned = router.pick("company")
+    assert all(router.pick("company") is pinned for _ in range(5))
+    assert router.pick("company", exclude=[pinned]) is not pinned
+
+
+@pytest.mark.asyncio
+async def test_failing_replica_is_drained():
+    router = BackendRouter(URLS[:2], failure_threshold=2, drain_seconds=60)
+    failing = router.replicas[0]
+
+    for _ in range(2):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            async with router.track(failing):
+                raise aiohttp.ClientConnectionError()
+
+    assert not router.stats()["http://a"]["healthy"]
+    assert all(router.pick() is router.replicas[1] for _ in range(3))
+    # With nothing else left, a drained replica is still used
+    assert router.pick(exclude=[router.replicas[1]]) is failing
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from app.utils.config_cache import ConfigCache
+
+
+def make_loader(document, release=None):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        if release is not None:
+            await release.wait()
+        return document
+
+    return load, calls
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = ConfigCache(ttl=60, negative_ttl=5, max_entries=10)
+    release = asyncio.Event()
+    load, calls = make_loader({"companyId": "c", "office": "option2"}, release)
+
+    readers = [asyncio.ensure_future(cache.get("appearance", "c", load)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    documents = await asyncio.gather(*readers)
+
+    assert len(calls) == 1
+    assert all(document == {"companyId": "c", "office": "option2"} for document in documents)
+    # Every caller gets its own copy
+    documents[0]["office"] = "changed"
+    assert (await cache.get("appearance", "c", load))["office"] == "option2"
+    assert cache.stats()["kinds"]["appearance"] == {
+        "hits": 1, "negative_hits": 0, "misses": 1, "coalesced": 4, "hit_rate": 1 / 6
+    }
+
+
+@pytest.mark.asyncio
+async def test_missing_documents_are_cached_briefly():
+    cache = ConfigCache(ttl=60, negative_ttl=0, max_entries=10)
+    load, calls = make_loader(None)
+
+    assert await cache.get("Company", "c", load) is None
+    assert await cache.get("Company", "c", load) is None
+    # A zero negative TTL expires at once
+    assert len(calls) == 2
+
+    cache = ConfigCache(ttl=60, negative_ttl=30, max_entries=10)
+    load, calls = make_loader(None)
+    await cache.get("Company", "c", load)
+    await cache.get("Company", "c", load)
+    assert len(calls) == 1 and cache.stats()["kinds"]["Company"]["negative_hits"] == 1
+
+    cache.put("Company", "c", {"companyId": "c"})
+    assert await cache.get("Company", "c", load) == {"companyId": "c"}
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_a_load_is_not_undone():
+    cache = ConfigCache(ttl=60, negative_ttl=5, max_entries=10)
+    release = asyncio.Event()
+    stale_load, _ = make_loader({"chatEnabled": False}, release)
+
+    reader = asyncio.ensure_future(cache.get("ai_setting", "c", stale_load))
+    await asyncio.sleep(0)
+    # A POST lands while the read is in flight
+    cache.invalidate("ai_setting", "c")
+    release.set()
+    assert await reader == {"chatEnabled": False}
+
+    fresh_load, calls = make_loader({"chatEnabled": True})
+    assert await cache.get("ai_setting", "c", fresh_load) == {"chatEnabled": True}
+    assert len(calls) == 1
+    # Once the load is done its invalidation is forgotten, and the next one is cached
+    assert not cache._stale
+    assert await cache.get("ai_setting", "c", fresh_load) == {"chatEnabled": True}
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidations_without_a_load_leave_nothing_behind():
+    cache = ConfigCache(ttl=60, negative_ttl=5, max_entries=10)
+
+    for company in range(1000):
+        cache.put("ai_setting", company, {"companyId": company})
+        cache.invalidate("ai_setting", company)
+
+    assert cache.stats()["entries"] == 0
+    assert not cache._stale
+
+
+@pytest.mark.asyncio
+async def test_clear_forgets_everything_and_discards_loads_in_flight():
+    cache = ConfigCache(ttl=60, negative_ttl=5, max_entries=10)
+    release = asyncio.Event()
+    slow, _ = make_loader({"companyId": "b"}, release)
+    await cache.get("ai_setting", "a", make_loader({"companyId": "a"})[0])
+    reader = asyncio.ensure_future(cache.get("Company", "b", slow))
+    await asyncio.sleep(0)
+
+    cache.clear()
+    release.set()
+    await reader
+
+    assert cache.stats()["entries"] == 0
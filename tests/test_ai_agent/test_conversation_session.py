@@ -0,0 +1,62 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.user_messages import AIResponse
+from app.services.ai_service import insert_user_message_async
+
+company_id = str(ObjectId())
+user_id = str(ObjectId())
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.settings.AI_HISTORY_CACHE_ENABLED", False)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_TURNS", 2)
+async def test_stored_turn_extends_session_history():
+    collection = AsyncMock()
+    user_message = MagicMock()
+    user_message.dict = lambda: {"id": ObjectId(), "time": 3, "lang": "EN", "AIResponses": {}}
+    history = [{"_id": 1}, {"_id": 2}]
+
+    await insert_user_message_async(collection, user_message, history=history)
+
+    assert len(history) == 2
+    assert history[0] == {"_id": 2}
+    assert history[1]["time"] == 3
+
+
+def test_session_reuses_history_for_every_turn():
+    history = [{"_id": 1}]
+    answer = AIResponse(question="Hi", answer="Hello")
+    with patch("app.api.v2.endpoints.ai_agent.open_conversation", AsyncMock(return_value=history)) as opened, \
+            patch("app.api.v2.endpoints.ai_agent.answer_text_message", AsyncMock(return_value=answer)) as answered:
+        client = TestClient(app)
+        with client.websocket_connect(f"/api/v2/ws/conversation?companyId={company_id}&userId={user_id}") as ws:
+            ws.send_json({"question": "Hi"})
+            assert ws.receive_json()["data"]["answer"] == "Hello"
+            ws.send_json({"lang": "IT"})
+            ws.send_json({"question": "Ciao"})
+            assert ws.receive_json()["type"] == "answer"
+
+    opened.assert_awaited_once()
+    assert answered.await_count == 2
+    second_input = answered.await_args_list[1].args[0]
+    assert second_input.lang == "IT"
+    assert all(call.kwargs["history"] is history for call in answered.await_args_list)
+
+
+def test_failed_turn_keeps_session_open():
+    answer = AIResponse(question="Hi", answer="Hello")
+    failing = AsyncMock(side_effect=[HTTPException(status_code=503, detail="busy"), answer])
+    with patch("app.api.v2.endpoints.ai_agent.open_conversation", AsyncMock(return_value=[])), \
+            patch("app.api.v2.endpoints.ai_agent.answer_text_message", failing):
+        client = TestClient(app)
+        with client.websocket_connect(f"/api/v2/ws/conversation?companyId={company_id}&userId={user_id}") as ws:
+            ws.send_json({"question": "Hi"})
+            assert ws.receive_json() == {"type": "error", "status": 503, "detail": "busy"}
+            ws.send_json({"question": "Hi"})
+            assert ws.receive_json()["type"] == "answer"
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.fair_queue import FairQueue
+from app.utils.upstream_guard import CircuitBreaker, UpstreamGuard
+
+
+def make_guard(fair_queue, max_in_flight=1, max_queue=10):
+    breaker = CircuitBreaker(
+        window=4, min_calls=4, error_rate=0.5, slow_call_seconds=10, slow_call_rate=1, open_seconds=30
+    )
+    return UpstreamGuard(max_in_flight, max_queue, 5, retry_after=2, breaker=breaker, fair_queue=fair_queue)
+
+
+async def run_calls(guard, companies):
+    """Starts one call per company in order while a blocker holds the only slot; returns the service order."""
+    order = []
+    release = asyncio.Event()
+
+    async def blocker():
+        async with guard.call("blocker"):
+            await release.wait()
+
+    async def call(company):
+        async with guard.call(company):
+            order.append(company)
+
+    tasks = [asyncio.ensure_future(blocker())]
+    await asyncio.sleep(0)
+    for company in companies:
+        tasks.append(asyncio.ensure_future(call(company)))
+        await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return order, results
+
+
+@pytest.mark.asyncio
+async def test_backlogged_companies_are_served_by_weight():
+    guard = make_guard(FairQueue(weights={"big": 2}))
+
+    order, _ = await run_calls(guard, ["noisy"] * 4 + ["big"] * 4 + ["quiet"])
+
+    # The quiet company is not stuck behind the others' backlogs
+    assert order.index("quiet") <= 3
+    # Twice the weight, twice the share while both are backlogged
+    assert order == ["big", "noisy", "big", "quiet", "big", "noisy", "big", "noisy", "noisy"]
+    assert guard.stats()["companies"]["noisy"]["admitted"] == 4
+
+
+@pytest.mark.asyncio
+async def test_full_queue_sheds_the_noisy_company():
+    guard = make_guard(FairQueue(), max_queue=3)
+
+    order, results = await run_calls(guard, ["noisy"] * 3 + ["quiet"])
+
+    shed = [result for result in results if isinstance(result, HTTPException)]
+    assert len(shed) == 1 and shed[0].status_code == 503
+    assert "quiet" in order
+    assert guard.stats()["companies"]["noisy"]["shed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_company_cap_leaves_slots_to_others():
+    guard = make_guard(FairQueue(max_in_flight={"capped": 1}), max_in_flight=3)
+    release = asyncio.Event()
+
+    async def hold(company):
+        async with guard.call(company):
+            await release.wait()
+
+    tasks = [asyncio.ensure_future(hold(company)) for company in ("capped", "capped", "other")]
+    await asyncio.sleep(0)
+
+    companies = guard.stats()["companies"]
+    assert companies["capped"]["in_flight"] == 1 and companies["capped"]["queued"] == 1
+    assert companies["other"]["in_flight"] == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert guard.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_idle_companies_are_forgotten_after_traffic_drains():
+    guard = make_guard(FairQueue(weights={"big": 2}, max_idle=2))
+
+    await run_calls(guard, ["big"] + [f"company-{index}" for index in range(5)])
+
+    fair_queue = guard.fair_queue
+    # Nothing is scheduled once idle; only the configured and the two most recent companies are kept
+    assert list(fair_queue.tenants) == ["big"]
+    assert list(fair_queue.idle) == ["company-3", "company-4"]
+    assert fair_queue.pop_next() is None
+    assert "company-0" not in fair_queue.prometheus()
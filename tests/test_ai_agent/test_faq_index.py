@@ -0,0 +1,91 @@
+import asyncio
+
+import mongomock
+import pytest
+
+from app.utils.faq_index import CompanyFaq, FaqIndex
+
+
+class AsyncCollection:
+    """Minimal motor-like wrapper over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+
+def make_db(inquiries):
+    collection = mongomock.MongoClient().db["Company"]
+    collection.insert_one({"companyId": "company", "commonInquiries": inquiries})
+    return {"Company": AsyncCollection(collection)}
+
+
+def test_company_faq_matches_close_wording():
+    faq = CompanyFaq(["What are your opening hours?", "Where can I park?", "  "])
+
+    assert faq.match("what are your opening hours") == (0, 1.0)
+    index, score = faq.match("What are your openning hours")
+    assert index == 0 and score > 0.85
+    index, score = faq.match("Do you sell gift cards?")
+    assert score < 0.5
+    assert len(faq.inquiries) == 2
+
+
+@pytest.mark.asyncio
+async def test_faq_index_learns_and_serves_answers():
+    db = make_db(["What are your opening hours?"])
+    index = FaqIndex(min_score=0.85, answer_ttl=60, max_companies=10)
+
+    # The first lookup only schedules the index build
+    assert index.lookup(db, "company", "EN", "Opening hours?") == (None, None)
+    await asyncio.sleep(0)
+
+    match, answer = index.lookup(db, "company", "EN", "What are your opening hours")
+    assert match == 0 and answer is None
+    index.learn(
+        "company", match, "EN", "What are your opening hours",
+        {"question": "What are your opening hours", "answer": "9 to 5"},
+    )
+
+    assert index.lookup(db, "company", "en", "what are your openning hours?") == (
+        0, {"question": "what are your openning hours?", "answer": "9 to 5"}
+    )
+    assert index.lookup(db, "company", "IT", "What are your opening hours")[1] is None
+    assert index.lookup(db, "company", "EN", "Can I bring my dog?") == (None, None)
+    assert index.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_faq_index_invalidation_forgets_answers():
+    db = make_db(["What are your opening hours?"])
+    index = FaqIndex(min_score=0.85, answer_ttl=60, max_companies=10)
+    index.lookup(db, "company", "EN", "warm up")
+    await asyncio.sleep(0)
+    index.learn("company", 0, "EN", "What are your opening hours?", {"question": "q", "answer": "9 to 5"})
+
+    index.invalidate_company("company")
+
+    assert index.lookup(db, "company", "EN", "What are your opening hours?") == (None, None)
+    await asyncio.sleep(0)
+    assert index.lookup(db, "company", "EN", "What are your opening hours?") == (0, None)
+
+
+@pytest.mark.asyncio
+async def test_similar_but_different_questions_neither_teach_nor_get_answers():
+    db = make_db(["How much does shipping cost?", "Do you deliver to Italy?"])
+    index = FaqIndex(min_score=0.85, answer_ttl=60, max_companies=10)
+    index.lookup(db, "company", "EN", "warm up")
+    await asyncio.sleep(0)
+    index.learn("company", 0, "EN", "How much does shipping cost?", {"answer": "5 euros"})
+    index.learn("company", 1, "EN", "Do you deliver to Italy?", {"answer": "Yes"})
+
+    # Close enough in trigrams, but a different question
+    for question, inquiry in (("How much does shipping cost to Spain?", 0), ("Do you not deliver to Italy?", 1)):
+        assert index._companies["company"].match(question)[1] >= 0.85
+        assert index.lookup(db, "company", "EN", question) == (None, None)
+        index.learn("company", inquiry, "EN", question, {"answer": "wrong"})
+
+    assert index.lookup(db, "company", "EN", "how much does shiping cost")[1]["answer"] == "5 euros"
+    assert index.lookup(db, "company", "EN", "Do you deliver to Italy")[1]["answer"] == "Yes"
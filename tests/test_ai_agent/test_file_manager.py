@@ -0,0 +1,39 @@
+import base64
+import os
+from unittest.mock import patch
+
+from app.utils.file_manger import decode_audio, close_audio
+
+audio_data = os.urandom(300 * 1024 + 7)
+wav_data = base64.b64encode(audio_data).decode()
+
+
+def test_decode_audio_small_clip_stays_in_memory():
+    audio = decode_audio(wav_data)
+
+    assert isinstance(audio, bytes)
+    assert audio == audio_data
+    close_audio(audio)
+
+
+@patch("app.utils.file_manger.settings.AI_AUDIO_SPILL_BYTES", 1024)
+def test_decode_audio_large_clip_spills_to_temp_file():
+    audio = decode_audio(wav_data)
+
+    assert not isinstance(audio, bytes)
+    assert audio.read() == audio_data
+    close_audio(audio)
+    assert audio.closed
+
+
+@patch("app.utils.file_manger.settings.AI_AUDIO_SPILL_BYTES", 1024)
+def test_decode_audio_large_clip_accepts_wrapped_base64():
+    # Wrapped at 75 characters, so quads straddle the decode chunks
+    wrapped = "\n".join(wav_data[start:start + 75] for start in range(0, len(wav_data), 75))
+    assert wrapped != wav_data and base64.b64decode(wrapped) == audio_data
+
+    audio = decode_audio(wrapped)
+
+    assert not isinstance(audio, bytes)
+    assert audio.read() == audio_data
+    close_audio(audio)
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from bson import ObjectId
+
+from app.services.ai_service import answer_text_message, build_answer_payload, fetch_history_window, HISTORY_PROJECTION
+from app.utils.history_cache import HistoryCache
+
+company_id = ObjectId()
+user_id = ObjectId()
+
+
+def make_collection(documents):
+    cursor = MagicMock()
+    cursor.sort.return_value = cursor
+    cursor.limit.return_value = cursor
+    cursor.to_list = AsyncMock(return_value=documents)
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    return collection, cursor
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.settings.AI_HISTORY_CACHE_ENABLED", False)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_AGE_MINUTES", 0)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_TURNS", 2)
+async def test_fetch_history_window_is_bounded_and_chronological():
+    collection, cursor = make_collection([{"_id": 2}, {"_id": 1}])
+
+    history = await fetch_history_window(collection, company_id, user_id)
+
+    collection.find.assert_called_once_with({"companyId": company_id, "userId": user_id}, HISTORY_PROJECTION)
+    cursor.sort.assert_called_once_with("time", -1)
+    cursor.limit.assert_called_once_with(2)
+    assert history == [{"_id": 1}, {"_id": 2}]
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.settings.AI_HISTORY_CACHE_ENABLED", False)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_AGE_MINUTES", 30)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_TURNS", 0)
+async def test_fetch_history_window_age_cap():
+    collection, cursor = make_collection([])
+
+    await fetch_history_window(collection, company_id, user_id)
+
+    filter_query = collection.find.call_args[0][0]
+    assert "$gte" in filter_query["time"]
+    cursor.limit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_answer_payload_from_stored_turns_is_json():
+    stored = {
+        "_id": ObjectId(),
+        "companyId": company_id,
+        "userId": user_id,
+        "AIResponses": {"question": "Hi", "answer": "Hello"},
+        "lang": "EN",
+        "time": datetime.utcnow(),
+    }
+    input = MagicMock(lang="EN", question="And now?")
+
+    payload = await build_answer_payload(None, company_id, user_id, input, history=[stored])
+
+    message = json.loads(json.dumps(payload))["user_messages"][0]
+    assert message["companyId"] == str(company_id)
+    assert message["_id"] == str(stored["_id"])
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.settings.AI_HISTORY_CACHE_ENABLED", True)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_AGE_MINUTES", 0)
+@patch("app.services.ai_service.settings.AI_HISTORY_MAX_TURNS", 10)
+async def test_fetch_history_window_does_not_cache_a_window_that_raced_a_turn():
+    cache = HistoryCache(max_entries=10, max_bytes=1024 * 1024, ttl=60)
+    collection, cursor = make_collection([{"_id": 1}])
+
+    async def read_while_a_turn_is_stored(length=None):
+        cache.append(company_id, user_id, {"_id": 2})
+        return [{"_id": 1}]
+
+    cursor.to_list = read_while_a_turn_is_stored
+    with patch("app.services.ai_service.history_cache", cache):
+        assert await fetch_history_window(collection, company_id, user_id) == [{"_id": 1}]
+        assert cache.get(company_id, user_id) is None
+
+
+@pytest.mark.asyncio
+async def test_text_turns_are_stored_in_utc_like_voice_turns():
+    input = MagicMock(companyId=str(company_id), userId=str(user_id), lang="EN", question="Hi")
+    store = AsyncMock()
+    previous_tz = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Tokyo"
+    time.tzset()
+    try:
+        with patch("app.services.ai_service.get_db_spatial_ai", AsyncMock(return_value=MagicMock())), \
+                patch("app.services.ai_service.local_answer", return_value=(None, None)), \
+                patch("app.services.ai_service.build_answer_payload", AsyncMock(return_value={})), \
+                patch("app.services.ai_service.send_request", AsyncMock(return_value={"question": "Hi", "answer": "Hello"})), \
+                patch("app.services.ai_service.insert_user_message_async", store):
+            await answer_text_message(input)
+    finally:
+        if previous_tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = previous_tz
+        time.tzset()
+
+    stored = store.await_args.args[1]
+    assert abs(stored.time - datetime.utcnow()) < timedelta(minutes=1)
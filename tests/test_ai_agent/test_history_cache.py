@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+from app.utils.history_cache import HistoryCache
+
+
+def test_history_cache_write_through_and_counters():
+    cache = HistoryCache(max_entries=10, max_bytes=1024 * 1024, ttl=60)
+
+    assert cache.get("company", "user") is None
+    cache.append("company", "user", {"_id": 0})  # Not cached yet, ignored
+    cache.put("company", "user", [{"_id": 1}, {"_id": 2}])
+    cache.append("company", "user", {"_id": 3}, max_turns=2)
+
+    assert cache.get("company", "user") == [{"_id": 2}, {"_id": 3}]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_history_cache_evicts_least_recently_used():
+    cache = HistoryCache(max_entries=2, max_bytes=1024 * 1024, ttl=60)
+    cache.put("company", "a", [{"_id": 1}])
+    cache.put("company", "b", [{"_id": 2}])
+    cache.get("company", "a")
+    cache.put("company", "c", [{"_id": 3}])
+
+    assert cache.get("company", "b") is None
+    assert cache.get("company", "a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_history_cache_memory_bound_and_ttl():
+    cache = HistoryCache(max_entries=10, max_bytes=50, ttl=60)
+    cache.put("company", "a", [{"answer": "x" * 100}])
+    assert cache.get("company", "a") is None
+
+    cache.put("company", "b", [{"_id": 1}])
+    with patch("app.utils.history_cache.time.monotonic", return_value=10 ** 9):
+        assert cache.get("company", "b") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_history_cache_skips_fills_that_raced_a_new_turn():
+    cache = HistoryCache(max_entries=2, max_bytes=1024 * 1024, ttl=60)
+
+    generation = cache.generation()
+    # A turn stored while the window was being read finds nothing to append to
+    cache.append("company", "user", {"_id": 2})
+    cache.put("company", "user", [{"_id": 1}], generation)
+    assert cache.get("company", "user") is None
+    assert cache.stats()["stale_fills"] == 1
+
+    # Other conversations are not affected, until too many changes to remember them all
+    generation = cache.generation()
+    cache.put("company", "other", [{"_id": 1}], generation)
+    assert cache.get("company", "other") == [{"_id": 1}]
+    for user in ("a", "b", "c"):
+        cache.invalidate("company", user)
+    cache.put("company", "late", [{"_id": 1}], generation)
+    assert cache.get("company", "late") is None
@@ -0,0 +1,133 @@
+"""
+The change stream test needs a replica set and only runs when
+AI_TEST_REPLICA_SET_URL points at one, e.g. a local single-node set:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27018
+    mongosh --port 27018 --eval "rs.initiate()"
+    AI_TEST_REPLICA_SET_URL=mongodb://localhost:27018/?replicaSet=rs0 pytest tests/test_ai_agent/test_invalidation_bus.py
+"""
+import asyncio
+import os
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from app.utils.answer_cache import answer_cache
+from app.utils.config_cache import config_cache
+from app.utils.invalidation_bus import InvalidationBus, VERSION_COLLECTION
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.cursor:
+            yield document
+
+
+class AsyncCollection:
+    """Minimal motor-like wrapper over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def update_one(self, *args, **kwargs):
+        return self.collection.update_one(*args, **kwargs)
+
+
+class StandaloneDatabase:
+    """A mongomock database that, like a standalone mongod, has no change streams."""
+
+    def __init__(self):
+        self.db = mongomock.MongoClient().db
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.db[name])
+
+    async def command(self, name):
+        return {"ismaster": True}
+
+
+def recording_bus(poll_interval=0.01):
+    bus = InvalidationBus(mode="auto", poll_interval=poll_interval)
+    evicted = []
+    bus._evict = lambda kind, company_id: evicted.append((kind, str(company_id)))
+    return bus, evicted
+
+
+@pytest.mark.asyncio
+async def test_publish_evicts_config_and_answers_locally():
+    company_id = str(ObjectId())
+    config_cache.put("Company", company_id, {"companyId": company_id})
+    answer_cache.put(company_id, "EN", "hours?", {"answer": "9 to 5"})
+
+    await InvalidationBus(mode="off", poll_interval=1).publish("Company", company_id)
+
+    assert await config_cache.get("Company", company_id, lambda: asyncio.sleep(0, result="reloaded")) == "reloaded"
+    assert answer_cache.get(company_id, "EN", "hours?") is None
+
+
+@pytest.mark.asyncio
+async def test_polling_carries_evictions_to_other_workers():
+    db = StandaloneDatabase()
+    writer, _ = recording_bus()
+    reader, evicted = recording_bus()
+    await writer.start(db)
+    await reader.start(db)
+    assert reader.stats()["mode"] == "polling"
+
+    await writer.publish("appearance", "company")
+    for _ in range(100):
+        if evicted:
+            break
+        await asyncio.sleep(0.01)
+    await writer.stop()
+    await reader.stop()
+
+    assert ("appearance", "company") in evicted
+    assert db.db[VERSION_COLLECTION].find_one({"_id": "appearance:company"})["version"] == 1
+
+
+def test_change_events_evict_their_company():
+    bus, evicted = recording_bus()
+    company_id = ObjectId()
+
+    bus._on_change({"ns": {"coll": "ai_setting"}, "fullDocument": {"companyId": company_id}})
+    bus._on_change({"ns": {"coll": "appearance"}, "fullDocument": {"company_id": "c"}})
+    # A delete only carries the _id, so the whole collection's entries go
+    bus._on_change({"ns": {"coll": "Company"}, "documentKey": {"_id": ObjectId()}})
+
+    assert evicted == [("ai_setting", str(company_id)), ("appearance", "c"), ("Company", "None")]
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not os.getenv("AI_TEST_REPLICA_SET_URL"), reason="needs a replica set")
+async def test_change_stream_sees_writes_from_anywhere():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.getenv("AI_TEST_REPLICA_SET_URL"))
+    db = client["invalidation_bus_test"]
+    bus, evicted = recording_bus()
+    await bus.start(db)
+    try:
+        assert bus.stats()["mode"] == "change_stream"
+        await asyncio.sleep(0.5)
+        # Written directly, as another worker or a script would
+        await db["ai_setting"].update_one({"companyId": "company"}, {"$set": {"creative": True}}, upsert=True)
+        for _ in range(100):
+            if evicted:
+                break
+            await asyncio.sleep(0.05)
+        assert evicted == [("ai_setting", "company")]
+    finally:
+        await bus.stop()
+        await client.drop_database("invalidation_bus_test")
+        client.close()
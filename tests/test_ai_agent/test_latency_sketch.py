@@ -0,0 +1,67 @@
+import random
+from datetime import datetime
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from app.services.analytics_service import company_latency
+from app.utils.latency_sketch import RELATIVE_ACCURACY, LatencySketch
+from app.utils.rollups import RollupRecorder
+from tests.test_ai_agent.test_rollups import AsyncCollection
+
+company_id = ObjectId()
+
+
+def test_percentiles_within_relative_accuracy():
+    rng = random.Random(7)
+    values = sorted(rng.lognormvariate(0, 1) for _ in range(5000))
+    sketch = LatencySketch()
+    for value in values:
+        sketch.add(value)
+
+    for share, estimate in zip((0.5, 0.9, 0.99), sketch.percentiles((0.5, 0.9, 0.99))):
+        exact = values[int(share * len(values))]
+        assert abs(estimate - exact) <= RELATIVE_ACCURACY * exact * 1.01
+
+
+def test_merged_sketches_equal_one_sketch_of_everything():
+    everything, first, second = LatencySketch(), LatencySketch(), LatencySketch()
+    for index, value in enumerate([0.0005, 0.2, 0.7, 1.5, 4, 9, 45, 700]):
+        everything.add(value)
+        (first if index % 2 else second).add(value)
+
+    # Stored and read back, as the rollups do
+    merged = LatencySketch(first.document())
+    merged.merge(LatencySketch(second.document()))
+
+    assert merged.counts == everything.counts
+    assert [bin["count"] for bin in merged.histogram()] == [2, 0, 1, 1, 0, 1, 0, 1, 0, 0, 1, 1]
+    assert LatencySketch().percentiles((0.5,)) == [None]
+
+
+@pytest.mark.asyncio
+async def test_company_latency_by_bucket_and_channel():
+    rollups = AsyncCollection(mongomock.MongoClient().db["AnalyticsRollup"])
+    recorder = RollupRecorder(flush_interval=60)
+    await recorder.start(rollups)
+    for hour, channel, process_time in [(9, "text", 1.0), (9, "text", 2.0), (9, "voice", 6.0), (10, "voice", 8.0)]:
+        recorder.record({
+            "companyId": company_id,
+            "userId": ObjectId(),
+            "lang": "EN",
+            "channel": channel,
+            "time": datetime(2024, 1, 1, hour),
+            "AIResponses": {"process_time": process_time},
+        })
+    await recorder.stop()
+
+    latency = await company_latency(rollups, company_id, "hour")
+    assert latency.overall.count == 4
+    assert latency.overall.p99 == pytest.approx(8.0, rel=RELATIVE_ACCURACY)
+    assert [(point.bucket.hour, point.count) for point in latency.series] == [(9, 3), (10, 1)]
+    assert [(entry.channel, entry.count) for entry in latency.breakdown] == [("text", 2), ("voice", 2)]
+    assert latency.breakdown[0].p50 == pytest.approx(2.0, rel=RELATIVE_ACCURACY)
+
+    voice = await company_latency(rollups, company_id, "day", channel="voice")
+    assert voice.overall.count == 2 and voice.overall.p50 == pytest.approx(8.0, rel=RELATIVE_ACCURACY)
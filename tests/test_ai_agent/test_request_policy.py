@@ -0,0 +1,75 @@
+import asyncio
+
+import aiohttp
+import pytest
+from fastapi import HTTPException
+
+from app.utils.request_policy import RequestPolicy
+
+
+def make_policy(**overrides):
+    options = dict(
+        window=100, min_samples=5, timeout_percentile=0.99, timeout_multiplier=3, min_timeout=0.05,
+        max_timeout=1.0, hedge_enabled=True, hedge_percentile=0.95, hedge_min_delay=0.01, hedge_max_share=1.0,
+        max_retries=2, backoff_base=0.001, backoff_max=0.001,
+    )
+    options.update(overrides)
+    return RequestPolicy(**options)
+
+
+def warm_up(policy, endpoint, seconds):
+    for _ in range(10):
+        policy.tracker(endpoint).observe(seconds)
+
+
+@pytest.mark.asyncio
+async def test_timeout_adapts_to_observed_latency():
+    policy = make_policy()
+    assert policy.timeout("get_answer") == 1.0
+
+    warm_up(policy, "get_answer", 0.02)
+    assert policy.timeout("get_answer") == pytest.approx(0.06)
+
+    with pytest.raises(HTTPException) as error:
+        await policy.run("get_answer", lambda: asyncio.sleep(10), replayable=False)
+    assert error.value.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_stuck_call_is_hedged_and_the_hedge_wins():
+    policy = make_policy()
+    warm_up(policy, "get_answer", 0.02)
+    attempts = []
+
+    async def send():
+        attempts.append(None)
+        # The first attempt is stuck, the hedge answers at once
+        await asyncio.sleep(10 if len(attempts) == 1 else 0)
+        return len(attempts)
+
+    assert await policy.run("get_answer", send) == 2
+    assert policy.stats()["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_only_retryable_failures_are_retried():
+    policy = make_policy(hedge_enabled=False)
+    calls = []
+
+    async def flaky():
+        calls.append(None)
+        if len(calls) < 3:
+            raise aiohttp.ClientConnectionError()
+        return "answer"
+
+    assert await policy.run("get_answer", flaky) == "answer"
+    assert policy.stats()["retries"] == 2
+
+    async def rejected():
+        calls.append(None)
+        raise aiohttp.ClientResponseError(None, (), status=400)
+
+    calls.clear()
+    with pytest.raises(aiohttp.ClientResponseError):
+        await policy.run("get_answer", rejected)
+    assert len(calls) == 1
@@ -0,0 +1,158 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import AsyncMock
+
+import mongomock
+import pytest
+from bson import ObjectId
+from bson.errors import InvalidDocument
+
+from app.services.analytics_service import backfill_rollups, company_rollups
+from app.utils.distinct_sketch import REGISTERS, STANDARD_ERROR, DistinctSketch
+from app.utils.rollups import RollupRecorder
+
+company_id = ObjectId()
+users = [ObjectId(), ObjectId()]
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.cursor)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.cursor:
+            yield document
+
+
+class AsyncCollection:
+    """Minimal motor-like wrapper over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def bulk_write(self, requests, ordered=True):
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+
+def turn(user_id, time, process_time, lang="en"):
+    return {
+        "_id": ObjectId(),
+        "companyId": company_id,
+        "userId": user_id,
+        "lang": lang,
+        "time": time,
+        "AIResponses": {"question": "q", "answer": "a", "process_time": process_time},
+    }
+
+
+TURNS = [
+    turn(users[0], datetime(2024, 1, 1, 9, 15), 1.0),
+    turn(users[0], datetime(2024, 1, 1, 9, 45), 3.0),
+    turn(users[1], datetime(2024, 1, 1, 10, 5), 2.0),
+    turn(users[1], datetime(2024, 1, 2, 8, 0), 4.0, lang="IT"),
+]
+
+
+def make_db():
+    db = mongomock.MongoClient().db
+    return AsyncCollection(db["UserMessage"]), AsyncCollection(db["AnalyticsRollup"])
+
+
+@pytest.mark.asyncio
+async def test_recorded_turns_roll_up_by_hour_and_day():
+    _, rollups = make_db()
+    recorder = RollupRecorder(flush_interval=60)
+    await recorder.start(rollups)
+    for document in TURNS[:2]:
+        recorder.record(document)
+    await recorder.flush()
+    for document in TURNS[2:]:
+        recorder.record(document)
+    await recorder.stop()
+
+    daily = await company_rollups(rollups, company_id, "day")
+    assert (daily.total_questions, daily.total_process_time, daily.max_process_time, daily.users) == (4, 10.0, 4.0, 2)
+    assert [(bucket.lang, bucket.questions, bucket.users) for bucket in daily.buckets] == [("EN", 3, 2), ("IT", 1, 1)]
+
+    hourly = await company_rollups(rollups, company_id, "hour", start=datetime(2024, 1, 1, 9, 30),
+                                   end=datetime(2024, 1, 1, 11), lang="en")
+    assert [(bucket.bucket.hour, bucket.questions, bucket.max_process_time) for bucket in hourly.buckets] == [
+        (9, 2, 3.0), (10, 1, 2.0)
+    ]
+    assert recorder.stats()["turns_recorded"] == 4
+
+
+@pytest.mark.asyncio
+async def test_backfill_matches_live_recording_and_is_repeatable():
+    messages, rollups = make_db()
+    messages.collection.insert_many([dict(document) for document in TURNS])
+
+    assert await backfill_rollups(messages, rollups, company_id) == 5
+    assert await backfill_rollups(messages, rollups, company_id) == 5
+
+    daily = await company_rollups(rollups, company_id, "day")
+    assert (daily.total_questions, daily.total_process_time, daily.users) == (4, 10.0, 2)
+    assert rollups.collection.count_documents({}) == 5
+
+
+def test_distinct_users_sketch_merges_and_stays_small():
+    first, second = DistinctSketch(), DistinctSketch()
+    for index in range(20000):
+        (first if index % 2 else second).add(ObjectId())
+        first.add(f"shared-{index % 100}")
+
+    # Stored and read back, as the rollups do
+    merged = DistinctSketch(first.document())
+    merged.merge(DistinctSketch(second.document()))
+
+    assert len(merged.document()) <= REGISTERS
+    assert merged.count == pytest.approx(20100, rel=3 * STANDARD_ERROR)
+    assert DistinctSketch().count == 0
+
+
+@pytest.mark.asyncio
+async def test_buckets_written_before_the_sketch_still_count_users():
+    _, rollups = make_db()
+    rollups.collection.insert_one({
+        "companyId": company_id, "lang": "EN", "channel": "text", "granularity": "day",
+        "bucket": datetime(2024, 1, 1), "count": 2, "users": [users[0]],
+    })
+    recorder = RollupRecorder(flush_interval=60)
+    await recorder.start(rollups)
+    recorder.record({**TURNS[2], "channel": "text"})
+    await recorder.stop()
+
+    daily = await company_rollups(rollups, company_id, "day")
+    assert (daily.total_questions, daily.users) == (3, 2)
+
+
+@pytest.mark.asyncio
+async def test_flusher_survives_unexpected_errors():
+    _, rollups = make_db()
+    recorder = RollupRecorder(flush_interval=0.01)
+    await recorder.start(rollups)
+    rollups.bulk_write = AsyncMock(side_effect=[InvalidDocument("cannot encode object"), None])
+
+    recorder.record(TURNS[0])
+    while rollups.bulk_write.await_count < 1:
+        await asyncio.sleep(0.01)
+    recorder.record(TURNS[1])
+    while rollups.bulk_write.await_count < 2:
+        await asyncio.sleep(0.01)
+
+    assert recorder.running and recorder.stats()["pending_buckets"] == 0
+    assert recorder.stats()["buckets_dropped"] == 2
+    await recorder.stop()
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from app.services.ai_service import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    flight = SingleFlight(window=0)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("key", call) for _ in range(5)))
+
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "coalesced": 4}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_window_and_errors():
+    flight = SingleFlight(window=60)
+
+    async def fail():
+        raise ValueError("upstream down")
+
+    async def succeed():
+        return "answer"
+
+    with pytest.raises(ValueError):
+        await flight.do("failing", fail)
+    assert await flight.do("failing", succeed) == "answer"  # Errors are not shared afterwards
+    assert await flight.do("failing", fail) == "answer"  # Results are, within the window
+    assert flight.stats()["coalesced"] == 1
@@ -0,0 +1,36 @@
+from app.utils.timing import LatencyHistograms, server_timing_header, stage, timed_stages
+
+
+def test_timed_stages_nest_and_accumulate():
+    with timed_stages() as timer:
+        with stage("history"):
+            pass
+        with timed_stages() as inner:
+            assert inner is timer
+            with stage("history"):
+                pass
+        with stage("upstream"):
+            pass
+
+    assert set(timer.stages) == {"history", "upstream"}
+    with stage("ignored"):  # No current timer, nothing is recorded
+        pass
+    assert "ignored" not in timer.stages
+
+
+def test_server_timing_header():
+    assert server_timing_header({"history": 0.0123, "upstream": 1.5}) == "history;dur=12.3, upstream;dur=1500.0"
+    assert server_timing_header(None) == ""
+
+
+def test_prometheus_histogram():
+    histograms = LatencyHistograms(buckets=(0.1, 1))
+    histograms.observe("upstream", 0.05)
+    histograms.observe("upstream", 0.5)
+    histograms.observe("upstream", 5)
+
+    text = histograms.prometheus()
+    assert 'ai_stage_duration_seconds_bucket{stage="upstream",le="0.1"} 1' in text
+    assert 'ai_stage_duration_seconds_bucket{stage="upstream",le="1"} 2' in text
+    assert 'ai_stage_duration_seconds_bucket{stage="upstream",le="+Inf"} 3' in text
+    assert 'ai_stage_duration_seconds_count{stage="upstream"} 3' in text
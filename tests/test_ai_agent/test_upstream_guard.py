@@ -0,0 +1,93 @@
+import asyncio
+from unittest.mock import patch
+
+import aiohttp
+import pytest
+from fastapi import HTTPException
+
+from app.utils.upstream_guard import CircuitBreaker, UpstreamGuard
+
+
+def make_guard(max_in_flight=1, max_queue=1, queue_timeout=5):
+    breaker = CircuitBreaker(
+        window=4, min_calls=4, error_rate=0.5, slow_call_seconds=10, slow_call_rate=1, open_seconds=30
+    )
+    return UpstreamGuard(max_in_flight, max_queue, queue_timeout, retry_after=2, breaker=breaker)
+
+
+@pytest.mark.asyncio
+async def test_guard_queues_then_sheds_with_retry_after():
+    guard = make_guard()
+    release = asyncio.Event()
+
+    async def hold():
+        async with guard.call():
+            await release.wait()
+
+    running = asyncio.ensure_future(hold())
+    queued = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as error:
+        async with guard.call():
+            pass
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "2"
+
+    release.set()
+    await asyncio.gather(running, queued)
+    assert guard.stats()["admitted"] == 2
+    assert guard.stats()["shed"] == 1
+    assert guard.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_guard_queue_deadline():
+    guard = make_guard(queue_timeout=0.01)
+    release = asyncio.Event()
+
+    async def hold():
+        async with guard.call():
+            await release.wait()
+
+    running = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException):
+        async with guard.call():
+            pass
+    release.set()
+    await running
+    assert guard.stats()["timed_out"] == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_errors_and_probes():
+    guard = make_guard(max_in_flight=10)
+
+    for _ in range(4):
+        with pytest.raises(ConnectionError):
+            async with guard.call():
+                raise ConnectionError()
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(HTTPException) as error:
+        guard.check()
+    assert error.value.status_code == 503
+
+    with patch("app.utils.upstream_guard.time.monotonic", return_value=10 ** 9):
+        async with guard.call():
+            pass
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_aborted_upload_does_not_trip_breaker():
+    guard = make_guard(max_in_flight=10)
+
+    for _ in range(4):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            async with guard.call():
+                # How aiohttp reports a request body that raised
+                too_large = HTTPException(status_code=413, detail="Audio clip is too large")
+                raise aiohttp.ClientConnectionError("Failed to send bytes") from too_large
+    assert guard.breaker.state == CircuitBreaker.CLOSED
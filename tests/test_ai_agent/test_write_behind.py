@@ -0,0 +1,116 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from bson.errors import InvalidDocument
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app.utils.write_behind import WriteBehindBuffer
+
+
+def make_collection():
+    collection = MagicMock()
+    collection.full_name = "db.UserMessage"
+    collection.insert_many = AsyncMock()
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_write_behind_flushes_full_batches():
+    collection = make_collection()
+    buffer = WriteBehindBuffer(batch_size=2, flush_interval=60, max_pending=100)
+    await buffer.start()
+
+    for i in range(3):
+        await buffer.add(collection, {"_id": i, "companyId": "c", "userId": "u"})
+    assert [document["_id"] for document in buffer.pending_for("c", "u")] == [0, 1, 2]
+    assert buffer.pending_for("c", "other") == []
+
+    # A full batch wakes the flusher without waiting for the interval
+    while collection.insert_many.await_count < 2:
+        await asyncio.sleep(0.01)
+    await buffer.stop()
+
+    assert [call.args[0] for call in collection.insert_many.await_args_list] == [
+        [{"_id": 0, "companyId": "c", "userId": "u"}, {"_id": 1, "companyId": "c", "userId": "u"}],
+        [{"_id": 2, "companyId": "c", "userId": "u"}],
+    ]
+    assert buffer.stats()["documents_written"] == 3
+
+
+@pytest.mark.asyncio
+async def test_write_behind_retries_transient_failures():
+    collection = make_collection()
+    collection.insert_many.side_effect = [AutoReconnect("down"), None]
+    buffer = WriteBehindBuffer(batch_size=10, flush_interval=60, max_pending=100, wait_for_write=True)
+    await buffer.start()
+
+    add = asyncio.ensure_future(buffer.add(collection, {"_id": 1}))
+    await asyncio.sleep(0)
+    await buffer.flush()
+    assert not add.done()
+    await buffer.flush()
+    await add
+
+    assert buffer.stats()["write_failures"] == 1
+    assert buffer.stats()["documents_written"] == 1
+    await buffer.stop()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_survives_non_mongo_errors():
+    collection = make_collection()
+    collection.insert_many.side_effect = [InvalidDocument("cannot encode object"), None]
+    buffer = WriteBehindBuffer(batch_size=1, flush_interval=60, max_pending=1, wait_for_write=True)
+    await buffer.start()
+
+    with pytest.raises(InvalidDocument):
+        await asyncio.wait_for(buffer.add(collection, {"_id": 1, "bad": object()}), 1)
+    # The flusher is still running, so later turns are written instead of hanging
+    await asyncio.wait_for(buffer.add(collection, {"_id": 2}), 1)
+    await buffer.stop()
+
+    assert buffer.stats()["documents_dropped"] == 1
+    assert buffer.stats()["documents_written"] == 1
+
+
+@pytest.mark.asyncio
+async def test_write_behind_reports_only_documents_that_were_written():
+    collection = make_collection()
+    collection.insert_many.side_effect = [
+        BulkWriteError({"writeErrors": [{"index": 1, "code": 121, "errmsg": "validation failed"}]}),
+        InvalidDocument("cannot encode object"),
+    ]
+    buffer = WriteBehindBuffer(batch_size=2, flush_interval=60, max_pending=100)
+    await buffer.start()
+    written = []
+
+    for i in range(4):
+        await buffer.add(collection, {"_id": i}, on_written=written.append)
+    await buffer.stop()
+
+    # 1 was rejected and 2 and 3 failed as a batch
+    assert written == [{"_id": 0}]
+    assert buffer.stats()["documents_dropped"] == 3
+
+
+@pytest.mark.asyncio
+async def test_write_behind_backs_off_and_sheds_while_mongo_is_down():
+    collection = make_collection()
+    collection.insert_many.side_effect = AutoReconnect("down")
+    buffer = WriteBehindBuffer(batch_size=1, flush_interval=0.01, max_pending=2, max_wait=0.1, max_backoff=0.04)
+    await buffer.start()
+
+    await buffer.add(collection, {"_id": 1})
+    await buffer.add(collection, {"_id": 2})
+    # Full and not draining: the caller gets a 503 instead of waiting forever
+    with pytest.raises(HTTPException) as raised:
+        await asyncio.wait_for(buffer.add(collection, {"_id": 3}), 1)
+    assert raised.value.status_code == 503 and "Retry-After" in raised.value.headers
+
+    # Retries were spaced out by the backoff rather than made on every wakeup
+    assert collection.insert_many.await_count <= 8
+    assert buffer.stats()["retry_backoff"] == 0.04
+    assert buffer.stats()["backpressure_timeouts"] == 1
+    await buffer.stop()